@@ -20,6 +20,7 @@ if config.config_file_name is not None:
 # add your model's MetaData object here
 # for 'autogenerate' support
 from app.agent.models import *
+from app.campaign.models import *
 from app.knowledgebase.models import *
 from app.lk_connector.models import *
 
@@ -0,0 +1,37 @@
+"""add account indexes
+
+Revision ID: 2a6e90c3f5d8
+Revises: f8b26e4d1c70
+Create Date: 2026-10-19 13:12:09.402716
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+import sqlmodel.sql.sqltypes
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2a6e90c3f5d8'
+down_revision: Union[str, None] = 'f8b26e4d1c70'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_inbound_trunks_account_id_twilio_sid', 'inbound_trunks', ['account_id', 'twilio_sid'], unique=False)
+    op.create_index(op.f('ix_outbound_trunks_account_id'), 'outbound_trunks', ['account_id'], unique=False)
+    op.create_index(op.f('ix_phone_numbers_trunk_id'), 'phone_numbers', ['trunk_id'], unique=False)
+    op.create_index(op.f('ix_knowledgebase_account_id'), 'knowledgebase', ['account_id'], unique=False)
+    op.create_index('ix_agents_agent_phone', 'agents', [sa.text("(config->>'agent_phone')")], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_agents_agent_phone', table_name='agents')
+    op.drop_index(op.f('ix_knowledgebase_account_id'), table_name='knowledgebase')
+    op.drop_index(op.f('ix_phone_numbers_trunk_id'), table_name='phone_numbers')
+    op.drop_index(op.f('ix_outbound_trunks_account_id'), table_name='outbound_trunks')
+    op.drop_index('ix_inbound_trunks_account_id_twilio_sid', table_name='inbound_trunks')
@@ -0,0 +1,27 @@
+"""add trunk next dispatch at
+
+Revision ID: 5b8c1f3e7a92
+Revises: 9e4b7d2a6c15
+Create Date: 2026-10-19 14:41:07.530912
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b8c1f3e7a92'
+down_revision: Union[str, None] = '9e4b7d2a6c15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('outbound_trunks', sa.Column('next_dispatch_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('outbound_trunks', 'next_dispatch_at')
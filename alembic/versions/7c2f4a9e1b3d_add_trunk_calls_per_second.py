@@ -0,0 +1,27 @@
+"""add trunk calls per second
+
+Revision ID: 7c2f4a9e1b3d
+Revises: e1e3dba5167b
+Create Date: 2026-10-19 09:30:12.418205
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2f4a9e1b3d'
+down_revision: Union[str, None] = 'e1e3dba5167b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('outbound_trunks', sa.Column('calls_per_second', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('outbound_trunks', 'calls_per_second')
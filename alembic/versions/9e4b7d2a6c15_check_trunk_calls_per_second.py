@@ -0,0 +1,29 @@
+"""check trunk calls per second
+
+Revision ID: 9e4b7d2a6c15
+Revises: 2a6e90c3f5d8
+Create Date: 2026-10-19 14:02:41.118305
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4b7d2a6c15'
+down_revision: Union[str, None] = '2a6e90c3f5d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # a rate of 0 or less can't pace anything, those trunks use the default rate
+    op.execute('UPDATE outbound_trunks SET calls_per_second = NULL WHERE calls_per_second <= 0')
+    op.create_check_constraint('ck_outbound_trunks_calls_per_second', 'outbound_trunks', 'calls_per_second > 0')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('ck_outbound_trunks_calls_per_second', 'outbound_trunks', type_='check')
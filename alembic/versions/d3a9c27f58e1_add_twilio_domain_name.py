@@ -0,0 +1,29 @@
+"""add twilio domain name
+
+Revision ID: d3a9c27f58e1
+Revises: b5d81e6c04a2
+Create Date: 2026-10-19 10:41:26.530871
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+import sqlmodel.sql.sqltypes
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3a9c27f58e1'
+down_revision: Union[str, None] = 'b5d81e6c04a2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('inbound_trunks', sa.Column('twilio_domain_name', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('inbound_trunks', 'twilio_domain_name')
@@ -0,0 +1,29 @@
+"""add phone number twilio sid
+
+Revision ID: f8b26e4d1c70
+Revises: d3a9c27f58e1
+Create Date: 2026-10-19 12:05:48.118204
+
+"""
+from typing import Sequence, Union
+import sqlmodel
+import sqlmodel.sql.sqltypes
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f8b26e4d1c70'
+down_revision: Union[str, None] = 'd3a9c27f58e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('phone_numbers', sa.Column('twilio_sid', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('phone_numbers', 'twilio_sid')
@@ -0,0 +1,200 @@
+"""
+Local answering machine detection for outbound calls.
+
+The first seconds of the callee's audio are cut into 20ms frames and analysed in
+numpy batches, energy for speech and silence, and the spectrum for the pure tone of
+a voicemail beep. The decision follows the classic greeting heuristics: people
+answer with a word or two and wait, machines play a long greeting, or beep. The
+agent must stay silent until the decision, a person replying to it would be taken
+for a machine.
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Literal
+
+import numpy as np
+from livekit import rtc
+from loguru import logger
+
+AMDResult = Literal["human", "machine", "unknown"]
+
+
+@dataclass
+class AMDDecision:
+    result: AMDResult
+    reason: str
+    after: float
+    """ seconds of audio analysed """
+
+
+@dataclass
+class AMDOptions:
+    speech_threshold_db: float = -40.0
+    """ frames louder than this (dBFS) are speech """
+    min_word: float = 0.1
+    """ shorter bursts of sound are noise """
+    between_words_silence: float = 0.05
+    max_greeting: float = 1.5
+    """ a greeting talking longer than this without a pause is a machine """
+    max_words: int = 3
+    """ a greeting with this many words is a machine """
+    after_greeting_silence: float = 0.8
+    """ a pause this long after a short greeting is a person waiting for us """
+    beep_min_duration: float = 0.15
+    beep_band: tuple[float, float] = (400.0, 2500.0)
+    beep_tonality: float = 0.85
+    """ share of the band energy in the peak frequency for a frame to be tonal """
+    timeout: float = 5.0
+
+
+class FrameAnalyzer:
+    """Vectorized per frame energy and tonality of mono int16 audio"""
+
+    FRAME_MS = 20
+
+    def __init__(self, sample_rate: int, options: AMDOptions) -> None:
+        self._frame_len = sample_rate * self.FRAME_MS // 1000
+        self._options = options
+        self._buffer = np.zeros(0, dtype=np.int16)
+        self._window = np.hanning(self._frame_len).astype(np.float32)
+
+        freqs = np.fft.rfftfreq(self._frame_len, d=1 / sample_rate)
+        low, high = options.beep_band
+        self._band = (freqs >= low) & (freqs <= high)
+        self._band_freqs = freqs[self._band]
+
+    def push(
+        self, samples: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Level (dBFS), tonality and peak frequency of each complete frame"""
+        self._buffer = np.concatenate([self._buffer, samples])
+        n = len(self._buffer) // self._frame_len
+        frames = self._buffer[: n * self._frame_len].reshape(n, self._frame_len)
+        self._buffer = self._buffer[n * self._frame_len :]
+
+        x = frames.astype(np.float32) / 32768.0
+        rms = np.sqrt(np.mean(x * x, axis=1))
+        level = 20 * np.log10(rms + 1e-9)
+
+        power = np.abs(np.fft.rfft(x * self._window, axis=1)) ** 2
+        band = power[:, self._band]
+        peak = np.argmax(band, axis=1)
+        # the window spreads a tone over its neighbouring bins
+        rows = np.arange(n)[:, None]
+        around = np.clip(peak[:, None] + np.arange(-2, 3), 0, band.shape[1] - 1)
+        tonality = band[rows, around].sum(axis=1) / (band.sum(axis=1) + 1e-12)
+        return level, tonality, self._band_freqs[peak]
+
+
+class AnsweringMachineDetector:
+    def __init__(
+        self, sample_rate: int = 16000, options: AMDOptions | None = None
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.options = options or AMDOptions()
+        self._analyzer = FrameAnalyzer(sample_rate, self.options)
+        self._frame_s = FrameAnalyzer.FRAME_MS / 1000
+
+        self._elapsed = 0.0
+        self._words = 0
+        self._in_word = False
+        self._sound = 0.0
+        self._silence = 0.0
+        self._greeting_started: float | None = None
+        self._beep = 0.0
+        self._beep_freq = 0.0
+
+    def push(self, samples: np.ndarray) -> AMDDecision | None:
+        level, tonality, freq = self._analyzer.push(samples)
+        is_speech = level > self.options.speech_threshold_db
+        is_tone = is_speech & (tonality > self.options.beep_tonality)
+
+        for speech, tone, f in zip(is_speech, is_tone, freq):
+            self._elapsed += self._frame_s
+            decision = self._beep_frame(bool(tone), float(f)) or self._voice_frame(
+                bool(speech)
+            )
+            if decision is not None:
+                return decision
+
+        if self._elapsed >= self.options.timeout:
+            return AMDDecision("unknown", "timeout", self._elapsed)
+        return None
+
+    def _beep_frame(self, tone: bool, freq: float) -> AMDDecision | None:
+        if tone and (self._beep == 0 or abs(freq - self._beep_freq) < 50):
+            self._beep += self._frame_s
+            self._beep_freq = freq
+        else:
+            self._beep = 0.0
+
+        if self._beep >= self.options.beep_min_duration:
+            return AMDDecision(
+                "machine", f"beep at {self._beep_freq:.0f}Hz", self._elapsed
+            )
+        return None
+
+    def _voice_frame(self, speech: bool) -> AMDDecision | None:
+        options = self.options
+        if speech:
+            self._sound += self._frame_s
+            self._silence = 0.0
+            if self._greeting_started is None:
+                self._greeting_started = self._elapsed
+            if not self._in_word and self._sound >= options.min_word:
+                self._in_word = True
+                self._words += 1
+                if self._words >= options.max_words:
+                    return AMDDecision(
+                        "machine", f"{self._words} words", self._elapsed
+                    )
+            if self._elapsed - self._greeting_started >= options.max_greeting:
+                return AMDDecision("machine", "long greeting", self._elapsed)
+            return None
+
+        self._silence += self._frame_s
+        if self._silence >= options.between_words_silence:
+            self._in_word = False
+            self._sound = 0.0
+        if self._words > 0 and self._silence >= options.after_greeting_silence:
+            return AMDDecision("human", "short greeting", self._elapsed)
+        if self._silence >= options.after_greeting_silence:
+            # sounds too short to be words, start over
+            self._greeting_started = None
+        return None
+
+    async def run(self, participant: rtc.RemoteParticipant) -> AMDDecision:
+        """Analyses the participant's microphone until a decision"""
+        stream = rtc.AudioStream.from_participant(
+            participant=participant,
+            track_source=rtc.TrackSource.SOURCE_MICROPHONE,
+            sample_rate=self.sample_rate,
+            num_channels=1,
+        )
+        try:
+            async for ev in stream:
+                samples = np.frombuffer(ev.frame.data, dtype=np.int16)
+                decision = self.push(samples)
+                if decision is not None:
+                    return decision
+        finally:
+            await stream.aclose()
+        return AMDDecision("unknown", "audio ended", self._elapsed)
+
+
+async def detect_answering_machine(
+    participant: rtc.RemoteParticipant,
+    on_machine: Callable[[AMDDecision], Awaitable[None]],
+    options: AMDOptions | None = None,
+) -> AMDDecision:
+    started_at = time.perf_counter()
+    decision = await AnsweringMachineDetector(options=options).run(participant)
+    logger.info(
+        f"answering machine detection: {decision.result} ({decision.reason}) after "
+        f"{decision.after:.2f}s of audio, {time.perf_counter() - started_at:.2f}s"
+    )
+    if decision.result == "machine":
+        await on_machine(decision)
+    return decision
+
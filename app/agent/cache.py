@@ -0,0 +1,300 @@
+"""
+Two tier cache of the agent configs.
+
+Every call and every `/agent/find` looks up one of a few hundred agents, so each
+process keeps an LRU of the agents it has seen, with their validated settings,
+in front of a Redis copy shared by all processes. Publishing an agent deletes the
+Redis copy and publishes its id, every process listening drops it from its LRU.
+The LRU entries also expire after `ttl` seconds, in case an invalidation is missed.
+
+A lookup that read the database before a publish could write the old config back
+after the delete. Publishing also leaves the agent's new `updated_at` in Redis, and
+the write of an older version is refused.
+
+Redis is optional at runtime: when it can't be reached the cache logs it and falls
+back to the database, the in-process tier keeps working.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from functools import cached_property
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from app.agent.models import AgentModel
+from app.agent.schema import AgentSettings
+from app.core.config import settings
+
+INVALIDATE_CHANNEL = "agents:invalidate"
+
+
+def _version(updated_at: datetime) -> float:
+    """The agent's `updated_at` as a timestamp, naive datetimes are UTC"""
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return updated_at.timestamp()
+
+
+@dataclass
+class CachedAgent:
+    agent: AgentModel
+    """ detached from any session, read only """
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    @cached_property
+    def settings(self) -> AgentSettings:
+        return AgentSettings.model_validate(self.agent.config)
+
+    @property
+    def phone(self) -> str | None:
+        return self.agent.config.get("agent_phone")
+
+
+class AgentConfigCache:
+    def __init__(
+        self,
+        redis_url: str,
+        *,
+        max_size: int = 512,
+        ttl: float = 60.0,
+        redis_ttl: int = 3600,
+        redis_client=None,
+    ) -> None:
+        self._redis_url = redis_url
+        self._max_size = max_size
+        self._ttl = ttl
+        self._redis_ttl = redis_ttl
+
+        self._agents: OrderedDict[str, CachedAgent] = OrderedDict()
+        self._phones: dict[str, str] = {}
+        """ agent id by phone number, for the agents in `_agents` """
+
+        self._redis = redis_client
+        self._redis_loop: asyncio.AbstractEventLoop | None = None
+        self._listener: asyncio.Task | None = None
+        self._redis_down_until = 0.0
+
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    # ╦  ┌┐┌┌─┐┌─┐┌─┐┌─┐┌─┐┌─┐┌─┐┌─┐┬
+    # ║  │││├─┘├┬┘│ ││  ├┤ └─┐└─┐│  │
+    # ╩═╝┘└┘┴  ┴└─└─┘└─┘└─┘└─┘└─┘└─┘o
+
+    def _get_local(self, agent_id: str) -> CachedAgent | None:
+        cached = self._agents.get(agent_id)
+        if cached is None:
+            return None
+        if time.monotonic() - cached.loaded_at > self._ttl:
+            self._drop_local(agent_id)
+            return None
+        self._agents.move_to_end(agent_id)
+        return cached
+
+    def _put_local(self, cached: CachedAgent) -> None:
+        self._drop_local(cached.agent.id)
+        self._agents[cached.agent.id] = cached
+        if cached.phone:
+            self._phones[cached.phone] = cached.agent.id
+        while len(self._agents) > self._max_size:
+            oldest, _ = self._agents.popitem(last=False)
+            self._drop_phones_of(oldest)
+
+    def _drop_local(self, agent_id: str) -> None:
+        if self._agents.pop(agent_id, None) is not None:
+            self._drop_phones_of(agent_id)
+
+    def _drop_phones_of(self, agent_id: str) -> None:
+        for phone in [p for p, id in self._phones.items() if id == agent_id]:
+            del self._phones[phone]
+
+    # ╦═╗┌─┐┌┬┐┬┌─┐┬
+    # ╠╦╝├┤  │││└─┐│
+    # ╩╚═└─┘─┴┘┴└─┘o
+
+    def _client(self):
+        """The redis client of the running loop, None while redis is unreachable"""
+        if time.monotonic() < self._redis_down_until:
+            return None
+
+        loop = asyncio.get_running_loop()
+        if self._redis is None or (
+            self._redis_loop is not None and self._redis_loop is not loop
+        ):
+            # redis connections belong to the loop that opened them
+            import redis.asyncio as redis
+
+            self._redis = redis.from_url(
+                self._redis_url, socket_timeout=0.5, socket_connect_timeout=0.5
+            )
+            self._redis_loop = loop
+        elif self._redis_loop is None:
+            self._redis_loop = loop
+
+        if self._listener is None or self._listener.done():
+            self._listener = loop.create_task(self._listen(self._redis))
+        return self._redis
+
+    def _redis_failed(self, e: Exception) -> None:
+        logger.warning(f"agent cache: redis unavailable, using the database: {e}")
+        # don't wait for a timeout on every lookup while it is down
+        self._redis_down_until = time.monotonic() + 10
+
+    async def _listen(self, client) -> None:
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        agent_id = message["data"]
+                        if isinstance(agent_id, bytes):
+                            agent_id = agent_id.decode()
+                        self._drop_local(agent_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._redis_failed(e)
+
+    async def _get_shared(self, key: str) -> AgentModel | None:
+        client = self._client()
+        if client is None:
+            return None
+        try:
+            data = await client.get(key)
+            if data is not None and key.startswith("agent_phone:"):
+                data = await client.get(f"agent:{data.decode()}")
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+        if data is None:
+            return None
+        return AgentModel.model_validate(json.loads(data))
+
+    async def _put_shared(self, agent: AgentModel) -> bool:
+        """Caches the agent, unless a newer version was published since it was read"""
+        client = self._client()
+        if client is None:
+            return True
+        from redis.exceptions import WatchError
+
+        version_key = f"agent_version:{agent.id}"
+        try:
+            async with client.pipeline(transaction=True) as pipe:
+                await pipe.watch(version_key)
+                published = await pipe.get(version_key)
+                if published is not None and float(published) > _version(
+                    agent.updated_at
+                ):
+                    return False
+                pipe.multi()
+                pipe.set(
+                    f"agent:{agent.id}",
+                    agent.model_dump_json(),
+                    ex=self._redis_ttl,
+                )
+                phone = agent.config.get("agent_phone")
+                if phone:
+                    pipe.set(f"agent_phone:{phone}", agent.id, ex=self._redis_ttl)
+                await pipe.execute()
+        except WatchError:
+            return False  # published while writing, the next lookup reads it
+        except Exception as e:
+            self._redis_failed(e)
+        return True
+
+    # ╔═╗┬ ┬┌┐ ┬  ┬┌─┐┬
+    # ╠═╝│ │├┴┐│  ││  │
+    # ╩  └─┘└─┘┴─┘┴└─┘o
+
+    async def get(
+        self,
+        *,
+        agent_id: str | None = None,
+        phone_number: str | None = None,
+        load: Callable[[], Awaitable[AgentModel | None]],
+    ) -> CachedAgent | None:
+        """The agent by id or phone number, `load` reads it from the database"""
+        if agent_id is None and phone_number is not None:
+            agent_id = self._phones.get(phone_number)
+        cached = self._get_local(agent_id) if agent_id else None
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        agent = await self._get_shared(
+            f"agent:{agent_id}" if agent_id else f"agent_phone:{phone_number}"
+        )
+        if agent is not None:
+            self.redis_hits += 1
+        else:
+            self.misses += 1
+            agent = await load()
+            if agent is None:
+                return None
+            if not await self._put_shared(agent):
+                # outdated already, this lookup uses it but nothing keeps it
+                return CachedAgent(agent=agent)
+
+        cached = CachedAgent(agent=agent)
+        self._put_local(cached)
+        return cached
+
+    async def invalidate(
+        self, agent_id: str, *phones: str | None, updated_at: datetime | None = None
+    ) -> None:
+        """
+        Drops the agent everywhere, `phones` are its old and new numbers. With the
+        `updated_at` of the new version, older versions can't be cached again.
+        """
+        self._drop_local(agent_id)
+        client = self._client()
+        if client is None:
+            return
+        try:
+            keys = [f"agent:{agent_id}"]
+            keys += [f"agent_phone:{phone}" for phone in phones if phone]
+            async with client.pipeline(transaction=True) as pipe:
+                if updated_at is not None:
+                    pipe.set(
+                        f"agent_version:{agent_id}",
+                        _version(updated_at),
+                        ex=self._redis_ttl,
+                    )
+                pipe.delete(*keys)
+                await pipe.execute()
+            await client.publish(INVALIDATE_CHANNEL, agent_id)
+        except Exception as e:
+            self._redis_failed(e)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._agents),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+        }
+
+    async def aclose(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._redis is not None:
+            try:
+                await self._redis.aclose()
+            except Exception:
+                pass
+            self._redis = None
+            self._redis_loop = None
+
+
+agent_cache = AgentConfigCache(
+    settings.REDIS_URL,
+    max_size=settings.AGENT_CACHE_SIZE,
+    ttl=settings.AGENT_CACHE_TTL,
+)
@@ -0,0 +1,169 @@
+import asyncio
+import json
+from typing import Any
+
+from livekit.agents import llm
+from livekit.agents.pipeline import VoicePipelineAgent
+from loguru import logger
+
+SUMMARY_PROMPT = """You compact phone call transcripts for a voice agent.
+Summarize the conversation below in a few short sentences. Keep every fact the agent may still need:
+names, phone numbers, addresses, dates, times, booking or reference numbers, what was decided and what is still open.
+Do not add anything that was not said."""
+
+SUMMARY_HEADER = "[Summary of the earlier part of this call]:\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """~4 characters per token, close enough for budgeting without a tokenizer"""
+    return len(text) // 4 + 1
+
+
+def _content_text(content: Any) -> str:
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(_content_text(c) for c in content)
+    try:
+        return json.dumps(content, default=str)
+    except (TypeError, ValueError):
+        return str(content)
+
+
+def message_tokens(msg: llm.ChatMessage) -> int:
+    tokens = estimate_tokens(_content_text(msg.content))
+    for call in msg.tool_calls or []:
+        tokens += estimate_tokens(call.raw_arguments or "")
+    return tokens
+
+
+def truncate_payload(payload: Any, max_tokens: int) -> Any:
+    """Returns the payload as is when it fits, otherwise a truncated string of it"""
+    text = _content_text(payload)
+    if estimate_tokens(text) <= max_tokens:
+        return payload
+    return text[: max_tokens * 4] + "... [truncated]"
+
+
+class ChatContextManager:
+    """
+    Keeps the chat context of a call within a token budget.
+
+    The system prompt and the most recent messages stay verbatim. Once the context
+    goes over budget, the older messages are summarized by the LLM in the background,
+    after the agent has finished speaking, and swapped for a summary appended to the
+    system prompt. Gemini only keeps the last system message as its instructions, so
+    a separate summary message would replace the agent's prompt.
+    """
+
+    def __init__(
+        self,
+        *,
+        llm: llm.LLM,
+        token_budget: int,
+        keep_recent_messages: int = 8,
+    ) -> None:
+        self._llm = llm
+        self._token_budget = token_budget
+        self._keep_recent_messages = keep_recent_messages
+
+        self._agent: VoicePipelineAgent | None = None
+        self._task: asyncio.Task | None = None
+        self._system_prompt: str | None = None
+        """ the system prompt as it was before the first summary was appended """
+        self._summary = ""
+        self.compactions = 0
+
+    def attach(self, agent: VoicePipelineAgent) -> None:
+        self._agent = agent
+        agent.on("agent_speech_committed", self._on_agent_speech)
+        agent.on("agent_speech_interrupted", self._on_agent_speech)
+
+    def context_tokens(self) -> int:
+        if self._agent is None:
+            return 0
+        return sum(message_tokens(msg) for msg in self._agent.chat_ctx.messages)
+
+    def _on_agent_speech(self, msg: llm.ChatMessage) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        if self.context_tokens() <= self._token_budget:
+            return
+        self._task = asyncio.create_task(self._compact())
+
+    def _compaction_range(self, messages: list[llm.ChatMessage]) -> tuple[int, int]:
+        start = 1 if messages and messages[0].role == "system" else 0
+
+        # cut on a user message so tool calls are never separated from their results
+        end = len(messages) - max(1, self._keep_recent_messages)
+        while end > start and messages[end].role != "user":
+            end -= 1
+        return start, end
+
+    async def _compact(self) -> None:
+        assert self._agent is not None
+        messages = self._agent.chat_ctx.messages
+        start, end = self._compaction_range(messages)
+        old_messages = messages[start:end]
+        if len(old_messages) < 2:
+            return
+
+        transcript = "\n".join(
+            f"{msg.role}: {_content_text(msg.content)}"
+            for msg in old_messages
+            if msg.content
+        )
+        if self._summary:
+            # the earlier summary leaves the context with them, its facts must stay
+            transcript = f"{SUMMARY_HEADER}{self._summary}\n\n{transcript}"
+        try:
+            summary = await self._summarize(transcript)
+        except Exception as e:
+            logger.warning(f"failed to summarize chat context: {e}")
+            return
+
+        # the agent only appends while we summarize, find our messages again
+        messages = self._agent.chat_ctx.messages
+        try:
+            index = next(i for i, msg in enumerate(messages) if msg is old_messages[0])
+        except StopIteration:
+            return
+        if any(
+            a is not b
+            for a, b in zip(messages[index : index + len(old_messages)], old_messages)
+        ):
+            return
+
+        tokens_before = self.context_tokens()
+        del messages[index : index + len(old_messages)]
+        self._set_summary(messages, summary)
+        self.compactions += 1
+        logger.info(
+            f"compacted {len(old_messages)} messages, context {tokens_before} -> {self.context_tokens()} tokens"
+        )
+
+    def _set_summary(self, messages: list[llm.ChatMessage], summary: str) -> None:
+        self._summary = summary
+        if not messages or messages[0].role != "system":
+            messages.insert(0, llm.ChatMessage.create(text="", role="system"))
+        if self._system_prompt is None:
+            self._system_prompt = _content_text(messages[0].content)
+        # appended after the prompt, so the prompt's cached prefix stays the same
+        messages[0].content = (
+            f"{self._system_prompt}\n\n{SUMMARY_HEADER}{summary}".lstrip()
+        )
+
+    async def _summarize(self, transcript: str) -> str:
+        chat_ctx = (
+            llm.ChatContext()
+            .append(role="system", text=SUMMARY_PROMPT)
+            .append(role="user", text=transcript)
+        )
+        summary = ""
+        async with self._llm.chat(chat_ctx=chat_ctx) as stream:
+            async for chunk in stream:
+                for choice in chunk.choices:
+                    summary += choice.delta.content or ""
+        return summary.strip()
@@ -1,11 +1,14 @@
 from typing_extensions import Annotated
 from app.agent.service import AssistantService
+from app.core.clients import OpenAIClientType
 from app.core.database import DatabaseSessionType
 from fastapi import Depends
 
 
-def create_user_service(session: DatabaseSessionType) -> AssistantService:
-    return AssistantService(session)
+def create_user_service(
+    session: DatabaseSessionType, client: OpenAIClientType
+) -> AssistantService:
+    return AssistantService(session, client)
 
 
 AssistantServiceType = Annotated[AssistantService, Depends(create_user_service)]
@@ -0,0 +1,145 @@
+import dataclasses
+import statistics
+import time
+
+from livekit.agents import llm, metrics
+from livekit.agents.pipeline import VoicePipelineAgent
+from loguru import logger
+
+
+class AdaptiveEndpointing:
+    """
+    Tunes the end-of-utterance delay of one call from how the caller actually talks.
+
+    - the caller starting to talk again right after the agent took the turn is a
+      cut-off, the delay backs off quickly so callers with long pauses keep the turn
+    - every clean turn decays the delay back towards the agent's
+      `min_endpointing_delay`, and below it only once the caller's measured
+      intra-turn pauses show they are short, so fast talkers don't wait for it
+    - interruptions followed by no real words are false interruptions, when they
+      become frequent the agent needs more speech before it stops talking
+
+    `VoicePipelineAgent` has no public setters for these options, they are applied
+    to its deferred reply validation and options directly.
+    """
+
+    CUTOFF_WINDOW = 1.5
+    """ caller speech within this many seconds of the agent's reply is a cut-off """
+    BACKOFF_FACTOR = 1.5
+    DECAY_FACTOR = 0.9
+    PAUSE_MARGIN = 0.15
+    MIN_PAUSES = 3
+    """ intra-turn pauses measured before the delay goes below the configured one """
+    MAX_INTERRUPT_SPEECH_DURATION = 1.5
+
+    def __init__(
+        self,
+        *,
+        min_endpointing_delay: float,
+        max_endpointing_delay: float,
+        interrupt_speech_duration: float,
+        floor: float = 0.2,
+    ) -> None:
+        self._min_delay = min_endpointing_delay
+        self._floor = min(floor, min_endpointing_delay)
+        self._ceiling = max_endpointing_delay
+        self.delay = min_endpointing_delay
+        self.interrupt_speech_duration = interrupt_speech_duration
+
+        self._agent: VoicePipelineAgent | None = None
+        self._user_stopped_at: float | None = None
+        self._turn_committed = True
+        self._reply_started_at: float | None = None
+        self._interruption_pending = False
+
+        self._pauses: list[float] = []
+        self._eou_delays: list[float] = []
+        self.turns = 0
+        self.cutoffs = 0
+        self.interruptions = 0
+        self.false_interruptions = 0
+
+    def attach(self, agent: VoicePipelineAgent) -> None:
+        self._agent = agent
+        agent.on("user_started_speaking", self._on_user_started_speaking)
+        agent.on("user_stopped_speaking", self._on_user_stopped_speaking)
+        agent.on("user_speech_committed", self._on_user_speech_committed)
+        agent.on("agent_started_speaking", self._on_agent_started_speaking)
+        agent.on("agent_speech_interrupted", self._on_agent_speech_interrupted)
+        agent.on("metrics_collected", self._on_metrics_collected)
+
+    def _on_user_started_speaking(self) -> None:
+        now = time.perf_counter()
+        if self._user_stopped_at is not None and not self._turn_committed:
+            # the caller paused mid turn and kept going
+            self._pauses = (self._pauses + [now - self._user_stopped_at])[-20:]
+
+        if (
+            self._reply_started_at is not None
+            and now - self._reply_started_at < self.CUTOFF_WINDOW
+        ):
+            self.cutoffs += 1
+            self._reply_started_at = None
+            self._set_delay(self.delay * self.BACKOFF_FACTOR)
+
+    def _on_user_stopped_speaking(self) -> None:
+        self._user_stopped_at = time.perf_counter()
+        self._turn_committed = False
+
+    def _on_user_speech_committed(self, msg: llm.ChatMessage) -> None:
+        self._turn_committed = True
+        self.turns += 1
+
+        text = msg.content if isinstance(msg.content, str) else ""
+        if self._interruption_pending:
+            self._interruption_pending = False
+            if len(text.split()) < 2:
+                self.false_interruptions += 1
+                self._adapt_interruptions()
+
+        target = self._min_delay
+        if len(self._pauses) >= self.MIN_PAUSES:
+            target = statistics.quantiles(self._pauses, n=10)[-1] + self.PAUSE_MARGIN
+        if self.delay > target:
+            self._set_delay(max(target, self.delay * self.DECAY_FACTOR))
+
+    def _on_agent_started_speaking(self) -> None:
+        self._reply_started_at = time.perf_counter()
+
+    def _on_agent_speech_interrupted(self, msg: llm.ChatMessage) -> None:
+        self.interruptions += 1
+        self._interruption_pending = True
+
+    def _on_metrics_collected(self, agent_metrics: metrics.AgentMetrics) -> None:
+        if isinstance(agent_metrics, metrics.PipelineEOUMetrics):
+            self._eou_delays.append(agent_metrics.end_of_utterance_delay)
+
+    def _adapt_interruptions(self) -> None:
+        if self.interruptions < 3:
+            return
+        if self.false_interruptions / self.interruptions <= 0.3:
+            return
+
+        self.interrupt_speech_duration = min(
+            self.MAX_INTERRUPT_SPEECH_DURATION,
+            self.interrupt_speech_duration * self.BACKOFF_FACTOR,
+        )
+        if self._agent is not None and hasattr(self._agent, "_opts"):
+            self._agent._opts = dataclasses.replace(
+                self._agent._opts, int_speech_duration=self.interrupt_speech_duration
+            )
+
+    def _set_delay(self, delay: float) -> None:
+        self.delay = min(self._ceiling, max(self._floor, delay))
+
+        validation = getattr(self._agent, "_deferred_validation", None)
+        if validation is not None:
+            validation._end_of_speech_delay = self.delay
+
+    def log_report(self) -> None:
+        eou = statistics.mean(self._eou_delays) if self._eou_delays else 0.0
+        logger.info(
+            f"endpointing: {self.turns} turns, avg end of utterance {eou:.2f}s, "
+            f"{self.cutoffs} cut-offs, {self.false_interruptions}/{self.interruptions} false interruptions, "
+            f"final delay {self.delay:.2f}s, interrupt speech duration {self.interrupt_speech_duration:.2f}s"
+        )
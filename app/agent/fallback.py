@@ -0,0 +1,573 @@
+"""
+Provider fallback chains.
+
+Each modality can list providers to use after the agent's own. A provider that
+errors before its first token or audio byte is skipped for the next one, and a
+provider that is merely slow is hedged: the next provider is asked as well once the
+deadline passes and whichever answers first is used, so the latency of a turn is
+bounded by the fastest healthy provider rather than the slowest.
+
+Providers that keep failing are skipped for a while by their circuit breaker. A job
+process serves a single call, so the opened breakers are shared through redis, see
+`SharedBreakers`.
+"""
+
+import asyncio
+import dataclasses
+import json
+import statistics
+import time
+import weakref
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Literal, Union
+
+from livekit import rtc
+from livekit.agents import (
+    DEFAULT_API_CONNECT_OPTIONS,
+    APIConnectionError,
+    APIConnectOptions,
+    llm,
+    stt,
+    tokenize,
+    tts,
+)
+from loguru import logger
+
+from app.core.circuit_breaker import CircuitBreaker
+
+
+class SharedBreakers:
+    """
+    The circuit breakers of the providers, shared through redis by every call of
+    every worker process.
+
+    A breaker that opens or closes is written to redis, and a call loads the breakers
+    of its providers when it starts, so a dead provider is skipped from the first
+    turn instead of failing again on every new call. Consecutive failures are still
+    counted per call. Without redis the breakers only last for the call.
+    """
+
+    KEY_PREFIX = "provider_breaker:"
+    KEEP_AFTER_COOLDOWN = 300
+    """ seconds an opened breaker is kept past its cooldown, a failure then reopens
+    it with a longer cooldown """
+
+    def __init__(self, redis_url: str, *, redis_client=None) -> None:
+        self._redis_url = redis_url
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any] = (
+            weakref.WeakKeyDictionary()
+        )
+        self._redis_client = redis_client
+        self._redis_down_until = 0.0
+        self._saves: set[asyncio.Task] = set()
+
+    def get(self, key: str, name: str) -> CircuitBreaker:
+        """The breaker of a provider client, `key` must tell credentials apart"""
+        if key not in self._breakers:
+            breaker = CircuitBreaker(name)
+            breaker.on_change = lambda breaker: self._on_change(key, breaker)
+            self._breakers[key] = breaker
+        return self._breakers[key]
+
+    def _client(self):
+        """The redis client of the running loop, None while redis is unreachable"""
+        if time.monotonic() < self._redis_down_until:
+            return None
+        if self._redis_client is not None:
+            return self._redis_client
+
+        # redis connections belong to the loop that opened them, job threads have one
+        # loop each
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            import redis.asyncio as redis
+
+            self._clients[loop] = redis.from_url(
+                self._redis_url, socket_timeout=0.5, socket_connect_timeout=0.5
+            )
+        return self._clients[loop]
+
+    def _redis_failed(self, e: Exception) -> None:
+        logger.warning(f"provider breakers: redis unavailable, not shared: {e}")
+        self._redis_down_until = time.monotonic() + 10
+
+    async def load(self, keys: list[str]) -> None:
+        """Restores the breakers opened by other calls"""
+        client = self._client()
+        if client is None or not keys:
+            return
+        try:
+            values = await client.mget([self.KEY_PREFIX + key for key in keys])
+        except Exception as e:
+            self._redis_failed(e)
+            return
+        for key, value in zip(keys, values):
+            if value is not None and key in self._breakers:
+                self._breakers[key].restore(**json.loads(value))
+
+    def _on_change(self, key: str, breaker: CircuitBreaker) -> None:
+        task = asyncio.create_task(self._save(key, breaker))
+        self._saves.add(task)
+        task.add_done_callback(self._saves.discard)
+
+    async def _save(self, key: str, breaker: CircuitBreaker) -> None:
+        client = self._client()
+        if client is None:
+            return
+        try:
+            if breaker.openings == 0:
+                await client.delete(self.KEY_PREFIX + key)
+                return
+            state = {"openings": breaker.openings, "open_until": breaker.open_until}
+            ttl = breaker.open_until - time.time() + self.KEEP_AFTER_COOLDOWN
+            await client.set(self.KEY_PREFIX + key, json.dumps(state), ex=int(ttl))
+        except Exception as e:
+            self._redis_failed(e)
+
+
+@dataclass
+class MemberStats:
+    requests: int = 0
+    wins: int = 0
+    hedges: int = 0
+    failures: int = 0
+    first_response: list[float] = field(default_factory=list)
+
+
+@dataclass
+class ChainMember:
+    client: Any
+    breaker: CircuitBreaker
+    stats: MemberStats = field(default_factory=MemberStats)
+
+
+def _ordered(members: list[ChainMember]) -> list[ChainMember]:
+    """Healthy providers first, the open ones are only tried when nothing else is left"""
+    healthy = [member for member in members if member.breaker.available()]
+    return healthy + [member for member in members if member not in healthy]
+
+
+async def first_to_respond(
+    members: list[ChainMember],
+    *,
+    open_stream: Callable[[ChainMember], Any],
+    close_stream: Callable[[Any], Awaitable[None]],
+    hedge_after: float,
+    hedge_from: asyncio.Event | None = None,
+) -> tuple[ChainMember, Any, Any]:
+    """
+    Opens a stream on the first provider and waits for its first event. The next
+    provider is opened as well when it errors, or when `hedge_after` seconds pass
+    without an event. Those seconds are counted from `hedge_from` being set when
+    given, for providers that can't answer before it. Returns the winner, its stream
+    and its first event, the other streams are closed.
+    """
+    queue = iter(_ordered(members))
+    pending: dict[asyncio.Task, tuple[ChainMember, Any, float]] = {}
+    errors: list[BaseException] = []
+    hedge_started: asyncio.Task | None = None
+    if hedge_from is not None and not hedge_from.is_set():
+        hedge_started = asyncio.create_task(hedge_from.wait())
+
+    def launch() -> bool:
+        member = next(queue, None)
+        if member is None:
+            return False
+        stream = open_stream(member)
+        member.stats.requests += 1
+        task = asyncio.create_task(_first_event(stream))
+        pending[task] = (member, stream, time.perf_counter())
+        return True
+
+    launch()
+    try:
+        while pending:
+            if hedge_started is not None and not hedge_started.done():
+                # the deadline hasn't started, wait for an answer or for it to start
+                done, _ = await asyncio.wait(
+                    [*pending, hedge_started], return_when=asyncio.FIRST_COMPLETED
+                )
+                done.discard(hedge_started)
+                if not done:
+                    continue
+            else:
+                done, _ = await asyncio.wait(
+                    pending, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED
+                )
+            if not done:
+                # slow, not failed, ask the next provider as well
+                member = next(iter(pending.values()))[0]
+                if launch():
+                    member.stats.hedges += 1
+                else:
+                    hedge_after = None  # type: ignore
+                continue
+
+            for task in done:
+                member, stream, started_at = pending.pop(task)
+                try:
+                    first = task.result()
+                except Exception as e:
+                    errors.append(e)
+                    member.stats.failures += 1
+                    member.breaker.record_failure()
+                    logger.warning(
+                        f"{member.breaker.name} failed, trying the next provider: {e}"
+                    )
+                    await close_stream(stream)
+                    if not pending:
+                        launch()
+                    continue
+
+                member.stats.wins += 1
+                member.stats.first_response.append(time.perf_counter() - started_at)
+                member.breaker.record_success()
+                return member, stream, first
+    finally:
+        if hedge_started is not None:
+            hedge_started.cancel()
+        for task, (_, stream, _) in pending.items():
+            task.cancel()
+            asyncio.create_task(close_stream(stream))
+
+    raise APIConnectionError(
+        f"all providers failed: {[member.breaker.name for member in members]}, {errors}"
+    )
+
+
+async def _first_event(stream: Any) -> Any:
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+def log_chain_report(kind: str, members: list[ChainMember]) -> None:
+    for member in members:
+        stats = member.stats
+        first = (
+            statistics.median(stats.first_response) if stats.first_response else 0.0
+        )
+        logger.info(
+            f"{kind} chain: {member.breaker.name} {stats.wins}/{stats.requests} won, "
+            f"{stats.hedges} hedged, {stats.failures} failed, median first response {first:.2f}s, "
+            f"breaker {member.breaker.state}"
+        )
+
+
+# ╦  ╦  ╔╦╗┬
+# ║  ║  ║║║│
+# ╩═╝╩═╝╩ ╩o
+
+
+class HedgedLLM(llm.LLM):
+    def __init__(self, members: list[ChainMember], *, hedge_after: float) -> None:
+        clients: list[llm.LLM] = [member.client for member in members]
+        super().__init__(
+            capabilities=llm.LLMCapabilities(
+                supports_choices_on_int=all(
+                    c.capabilities.supports_choices_on_int for c in clients
+                ),
+                requires_persistent_functions=any(
+                    c.capabilities.requires_persistent_functions for c in clients
+                ),
+            )
+        )
+        self.members = members
+        self._hedge_after = hedge_after
+
+    def chat(
+        self,
+        *,
+        chat_ctx: llm.ChatContext,
+        conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS,
+        fnc_ctx: llm.FunctionContext | None = None,
+        temperature: float | None = None,
+        n: int | None = None,
+        parallel_tool_calls: bool | None = None,
+        tool_choice: Union[llm.ToolChoice, Literal["auto", "required", "none"]]
+        | None = None,
+    ) -> llm.LLMStream:
+        return _HedgedLLMStream(
+            self,
+            chat_ctx=chat_ctx,
+            fnc_ctx=fnc_ctx,
+            conn_options=conn_options,
+            chat_kwargs=dict(
+                temperature=temperature,
+                n=n,
+                parallel_tool_calls=parallel_tool_calls,
+                tool_choice=tool_choice,
+            ),
+        )
+
+    def log_report(self) -> None:
+        log_chain_report("llm", self.members)
+
+
+class _HedgedLLMStream(llm.LLMStream):
+    def __init__(
+        self,
+        hedged: HedgedLLM,
+        *,
+        chat_ctx: llm.ChatContext,
+        fnc_ctx: llm.FunctionContext | None,
+        conn_options: APIConnectOptions,
+        chat_kwargs: dict,
+    ) -> None:
+        # failing over is the retry
+        super().__init__(
+            hedged,
+            chat_ctx=chat_ctx,
+            fnc_ctx=fnc_ctx,
+            conn_options=dataclasses.replace(conn_options, max_retry=0),
+        )
+        self._hedged = hedged
+        self._member_conn_options = dataclasses.replace(conn_options, max_retry=0)
+        self._chat_kwargs = chat_kwargs
+
+    def _open(self, member: ChainMember) -> llm.LLMStream:
+        return member.client.chat(
+            chat_ctx=self._chat_ctx,
+            fnc_ctx=self._fnc_ctx,
+            conn_options=self._member_conn_options,
+            **self._chat_kwargs,
+        )
+
+    async def _run(self) -> None:
+        member, stream, first = await first_to_respond(
+            self._hedged.members,
+            open_stream=self._open,
+            close_stream=lambda stream: stream.aclose(),
+            hedge_after=self._hedged._hedge_after,
+        )
+        # filled in by the winning stream as it parses tool calls
+        self._function_calls_info = stream._function_calls_info
+        try:
+            if first is not None:
+                self._event_ch.send_nowait(first)
+                async for chunk in stream:
+                    self._event_ch.send_nowait(chunk)
+        finally:
+            await stream.aclose()
+
+
+# ╔╦╗╔╦╗╔═╗┬
+#  ║  ║ ╚═╗│
+#  ╩  ╩ ╚═╝o
+
+
+class HedgedTTS(tts.TTS):
+    """
+    Every provider must support streaming input (wrap the others in a
+    `StreamAdapter`), so the chain can start on the first LLM tokens. Audio of every
+    provider is resampled to the rate of the first one.
+    """
+
+    def __init__(self, members: list[ChainMember], *, hedge_after: float) -> None:
+        primary: tts.TTS = members[0].client
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=True),
+            sample_rate=primary.sample_rate,
+            num_channels=primary.num_channels,
+        )
+        self.members = members
+        self._hedge_after = hedge_after
+
+    def synthesize(
+        self, text: str, *, conn_options: APIConnectOptions | None = None
+    ) -> tts.ChunkedStream:
+        return _HedgedChunkedStream(
+            tts=self, input_text=text, conn_options=conn_options
+        )
+
+    def stream(
+        self, *, conn_options: APIConnectOptions | None = None
+    ) -> tts.SynthesizeStream:
+        return _HedgedSynthesizeStream(tts=self, conn_options=conn_options)
+
+    async def _forward(
+        self,
+        member: ChainMember,
+        first: tts.SynthesizedAudio | None,
+        stream: AsyncIterator[tts.SynthesizedAudio],
+        event_ch,
+    ) -> None:
+        client: tts.TTS = member.client
+        resampler = None
+        if client.sample_rate != self.sample_rate:
+            resampler = rtc.AudioResampler(
+                input_rate=client.sample_rate,
+                output_rate=self.sample_rate,
+                num_channels=self.num_channels,
+            )
+
+        async def _events():
+            if first is not None:
+                yield first
+            async for ev in stream:
+                yield ev
+
+        async for ev in _events():
+            if resampler is None:
+                event_ch.send_nowait(ev)
+                continue
+            frames = resampler.push(ev.frame)
+            if ev.is_final:
+                frames += resampler.flush()
+            for i, frame in enumerate(frames):
+                event_ch.send_nowait(
+                    dataclasses.replace(
+                        ev, frame=frame, is_final=ev.is_final and i == len(frames) - 1
+                    )
+                )
+
+    def log_report(self) -> None:
+        log_chain_report("tts", self.members)
+
+
+class _HedgedChunkedStream(tts.ChunkedStream):
+    def __init__(
+        self,
+        *,
+        tts: HedgedTTS,
+        input_text: str,
+        conn_options: APIConnectOptions | None,
+    ) -> None:
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._hedged = tts
+
+    async def _run(self) -> None:
+        member, stream, first = await first_to_respond(
+            self._hedged.members,
+            open_stream=lambda member: member.client.synthesize(self._input_text),
+            close_stream=lambda stream: stream.aclose(),
+            hedge_after=self._hedged._hedge_after,
+        )
+        try:
+            await self._hedged._forward(member, first, stream, self._event_ch)
+        finally:
+            await stream.aclose()
+
+
+class _HedgedSynthesizeStream(tts.SynthesizeStream):
+    def __init__(
+        self, *, tts: HedgedTTS, conn_options: APIConnectOptions | None
+    ) -> None:
+        super().__init__(tts=tts, conn_options=conn_options)
+        self._hedged = tts
+
+    async def _run(self) -> None:
+        # a provider opened late (hedge, failover) gets the text pushed so far replayed
+        inputs: list[str | tts.SynthesizeStream._FlushSentinel] = []
+        streams: list[tts.SynthesizeStream] = []
+        input_done = False
+        first_input = asyncio.Event()
+        # a `StreamAdapter` provider only gets the text a sentence at a time, its
+        # deadline must not run while the LLM is still writing the first sentence
+        first_sentence = asyncio.Event()
+        sentences = tokenize.basic.SentenceTokenizer().stream()
+
+        def _push(stream: tts.SynthesizeStream, data) -> None:
+            if isinstance(data, self._FlushSentinel):
+                stream.flush()
+            else:
+                stream.push_text(data)
+
+        def _open(member: ChainMember) -> tts.SynthesizeStream:
+            stream = member.client.stream()
+            for data in inputs:
+                _push(stream, data)
+            if input_done:
+                stream.end_input()
+            streams.append(stream)
+            return stream
+
+        async def _close(stream: tts.SynthesizeStream) -> None:
+            if stream in streams:
+                streams.remove(stream)
+            await stream.aclose()
+
+        async def _forward_input():
+            nonlocal input_done
+            async for data in self._input_ch:
+                inputs.append(data)
+                first_input.set()
+                if isinstance(data, self._FlushSentinel):
+                    first_sentence.set()
+                elif not first_sentence.is_set():
+                    sentences.push_text(data)
+                for stream in streams:
+                    _push(stream, data)
+            input_done = True
+            first_input.set()
+            first_sentence.set()
+            for stream in streams:
+                stream.end_input()
+
+        async def _watch_sentences():
+            async for _ in sentences:
+                first_sentence.set()
+                return
+
+        input_task = asyncio.create_task(_forward_input())
+        sentences_task = asyncio.create_task(_watch_sentences())
+        try:
+            # the hedge deadline runs from the first sentence, not from the LLM's
+            # latency
+            await first_input.wait()
+            if not inputs:
+                return
+
+            member, stream, first = await first_to_respond(
+                self._hedged.members,
+                open_stream=_open,
+                close_stream=_close,
+                hedge_after=self._hedged._hedge_after,
+                hedge_from=first_sentence,
+            )
+            streams[:] = [stream]
+            try:
+                await self._hedged._forward(member, first, stream, self._event_ch)
+            finally:
+                await stream.aclose()
+        finally:
+            input_task.cancel()
+            sentences_task.cancel()
+            await sentences.aclose()
+
+
+# ╔═╗╔╦╗╔╦╗┬
+# ╚═╗ ║  ║ │
+# ╚═╝ ╩  ╩ o
+
+
+def failover_stt(members: list[ChainMember]) -> stt.STT:
+    """
+    The speech of a call goes through one long-lived stream, running a second one
+    in parallel would double the STT bill for every call, so STT fails over without
+    hedging, using livekit's `FallbackAdapter` on the streaming providers. The
+    breakers decide the order, and are updated from its availability events.
+    """
+    streaming = [m for m in _ordered(members) if m.client.capabilities.streaming]
+    for member in members:
+        if member not in streaming:
+            logger.warning(
+                f"{member.breaker.name} has no streaming support, left out of the stt chain"
+            )
+    if len(streaming) <= 1:
+        return (streaming or members)[0].client
+
+    adapter = stt.FallbackAdapter([member.client for member in streaming])
+    breakers = {id(member.client): member.breaker for member in streaming}
+
+    @adapter.on("stt_availability_changed")
+    def _on_availability_changed(ev: stt.AvailabilityChangedEvent) -> None:
+        breaker = breakers[id(ev.stt)]
+        if ev.available:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+
+    return adapter
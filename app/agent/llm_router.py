@@ -0,0 +1,180 @@
+import re
+import statistics
+from dataclasses import dataclass, field
+from typing import Literal, Union
+
+from livekit.agents import (
+    DEFAULT_API_CONNECT_OPTIONS,
+    APIConnectOptions,
+    llm,
+    metrics,
+)
+from loguru import logger
+
+from app.agent.context import _content_text
+from app.agent.tool_routing import keywords
+
+Tier = Literal["fast", "strong"]
+
+COMPLEX_CUES = re.compile(
+    r"\b(why|how (do|does|can|would|much|many|long)|explain|compare|difference|"
+    r"problem|issue|wrong|complain\w*|refund|cancel\w*|change|reschedul\w*)\b"
+)
+AMBIGUOUS_CUES = re.compile(
+    r"\b(not sure|what do you mean|i don'?t (understand|know)|confus\w*|"
+    r"that'?s not what|i meant|either|or maybe|depends)\b"
+)
+
+
+@dataclass
+class RoutingDecision:
+    tier: Tier
+    reason: str
+
+
+class TurnClassifier:
+    """
+    Decides locally, from the request alone, whether a turn needs the strong model.
+
+    Tool results to talk through, words matching the agent's actions, long or
+    multi-question utterances and hedging callers go to the strong model, greetings,
+    confirmations and other short conversational turns go to the fast one.
+    """
+
+    def __init__(
+        self, *, action_keywords: set[str], long_turn_words: int = 30
+    ) -> None:
+        self._action_keywords = action_keywords
+        self._long_turn_words = long_turn_words
+
+    def classify(
+        self, chat_ctx: llm.ChatContext, fnc_ctx: llm.FunctionContext | None
+    ) -> RoutingDecision:
+        if not chat_ctx.messages:
+            return RoutingDecision("fast", "empty")
+
+        last = chat_ctx.messages[-1]
+        if last.role == "tool" or last.tool_calls:
+            return RoutingDecision("strong", "tool_result")
+        if last.role != "user":
+            return RoutingDecision("fast", "no_user_turn")
+
+        text = _content_text(last.content).lower()
+        if fnc_ctx is not None and keywords(text) & self._action_keywords:
+            return RoutingDecision("strong", "tool")
+        if len(text.split()) >= self._long_turn_words:
+            return RoutingDecision("strong", "long")
+        if text.count("?") > 1 or COMPLEX_CUES.search(text):
+            return RoutingDecision("strong", "complex")
+        if AMBIGUOUS_CUES.search(text):
+            return RoutingDecision("strong", "ambiguous")
+        return RoutingDecision("fast", "simple")
+
+
+@dataclass
+class TierStats:
+    requests: int = 0
+    ttft: list[float] = field(default_factory=list)
+    duration: list[float] = field(default_factory=list)
+
+
+class CascadingLLM(llm.LLM):
+    """
+    Sends each request to a fast or a strong LLM, as decided by a `TurnClassifier`.
+
+    It is passed to the pipeline as the agent's LLM, so the follow-up requests after
+    tool calls are routed as well. The metrics of both tiers are re-emitted with
+    their own label, so the usual `metrics_collected` handlers see them.
+    """
+
+    def __init__(
+        self,
+        *,
+        fast: llm.LLM,
+        strong: llm.LLM,
+        classifier: TurnClassifier,
+    ) -> None:
+        if fast is strong:
+            # both handlers would be on one emitter and count every request twice
+            raise ValueError("the fast and strong tiers are the same LLM client")
+        super().__init__(
+            capabilities=llm.LLMCapabilities(
+                supports_choices_on_int=fast.capabilities.supports_choices_on_int
+                and strong.capabilities.supports_choices_on_int,
+                requires_persistent_functions=(
+                    fast.capabilities.requires_persistent_functions
+                    or strong.capabilities.requires_persistent_functions
+                ),
+            )
+        )
+        self._tiers: dict[Tier, llm.LLM] = {"fast": fast, "strong": strong}
+        self._classifier = classifier
+
+        self.decisions: dict[str, int] = {}
+        self.stats: dict[Tier, TierStats] = {
+            "fast": TierStats(),
+            "strong": TierStats(),
+        }
+
+        self._handlers = {tier: self._metrics_handler(tier) for tier in self._tiers}
+        for tier, tier_llm in self._tiers.items():
+            tier_llm.on("metrics_collected", self._handlers[tier])
+
+    @property
+    def fast(self) -> llm.LLM:
+        return self._tiers["fast"]
+
+    def _metrics_handler(self, tier: Tier):
+        def _on_metrics(llm_metrics: metrics.LLMMetrics) -> None:
+            stats = self.stats[tier]
+            stats.ttft.append(llm_metrics.ttft)
+            stats.duration.append(llm_metrics.duration)
+            self.emit("metrics_collected", llm_metrics)
+
+        return _on_metrics
+
+    def chat(
+        self,
+        *,
+        chat_ctx: llm.ChatContext,
+        conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS,
+        fnc_ctx: llm.FunctionContext | None = None,
+        temperature: float | None = None,
+        n: int | None = None,
+        parallel_tool_calls: bool | None = None,
+        tool_choice: Union[llm.ToolChoice, Literal["auto", "required", "none"]]
+        | None = None,
+    ) -> llm.LLMStream:
+        decision = self._classifier.classify(chat_ctx, fnc_ctx)
+        key = f"{decision.tier}/{decision.reason}"
+        self.decisions[key] = self.decisions.get(key, 0) + 1
+        self.stats[decision.tier].requests += 1
+        logger.debug(
+            f"routing LLM request to the {decision.tier} model ({decision.reason})"
+        )
+
+        return self._tiers[decision.tier].chat(
+            chat_ctx=chat_ctx,
+            conn_options=conn_options,
+            fnc_ctx=fnc_ctx,
+            temperature=temperature,
+            n=n,
+            parallel_tool_calls=parallel_tool_calls,
+            tool_choice=tool_choice,
+        )
+
+    async def aclose(self) -> None:
+        # the tier clients belong to the call's `ProviderClientRegistry`, which
+        # closes them
+        for tier, tier_llm in self._tiers.items():
+            tier_llm.off("metrics_collected", self._handlers[tier])
+
+    def log_report(self) -> None:
+        for tier, stats in self.stats.items():
+            ttft = statistics.median(stats.ttft) if stats.ttft else 0.0
+            duration = statistics.median(stats.duration) if stats.duration else 0.0
+            logger.info(
+                f"llm routing: {stats.requests} requests to the {tier} model, "
+                f"median ttft {ttft:.2f}s, median duration {duration:.2f}s"
+            )
+        logger.info(f"llm routing decisions: {self.decisions}")
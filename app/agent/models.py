@@ -1,6 +1,7 @@
 from app.core.database import BaseTable
 from app.utils import make_cuid
 from sqlmodel import Column, Field
+from sqlalchemy import Index, text
 from sqlalchemy.dialects import postgresql
 
 
@@ -11,6 +12,10 @@ Base = declarative_base()
 
 class AgentModel(BaseTable, table=True):
     __tablename__: str = "agents"  # type: ignore # Explicit table name
+    __table_args__ = (
+        # inbound calls find their agent by the number they dialed
+        Index("ix_agents_agent_phone", text("(config->>'agent_phone')")),
+    )
 
     id: str = Field(default_factory=lambda: make_cuid("agent_"), primary_key=True)
 
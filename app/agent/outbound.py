@@ -0,0 +1,201 @@
+"""
+Preparing an outbound call while the callee's phone rings.
+
+Dialing blocks until the callee answers, which takes seconds. The agent and its
+provider connections are ready by then, so the greeting plays as soon as the call
+is answered. Agents can also opt in to having the greeting audio and the LLM's
+prompt cache ready, those are paid on every dial, answered or not.
+"""
+
+import asyncio
+import time
+
+from livekit import rtc
+from livekit.agents import (
+    DEFAULT_API_CONNECT_OPTIONS,
+    APIConnectOptions,
+    llm,
+    tokenize,
+    tts,
+    utils,
+)
+from loguru import logger
+
+
+class GreetingTTS(tts.TTS):
+    """
+    Replays a greeting synthesized ahead of time, while the call rings.
+
+    `prepare` synthesizes the text with the wrapped TTS and keeps the frames. The
+    first stream of the call replays them if it is asked for the same text, every
+    other request goes to the wrapped TTS.
+    """
+
+    def __init__(self, inner: tts.TTS) -> None:
+        if not inner.capabilities.streaming:
+            inner = tts.StreamAdapter(
+                tts=inner, sentence_tokenizer=tokenize.basic.SentenceTokenizer()
+            )
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=True),
+            sample_rate=inner.sample_rate,
+            num_channels=inner.num_channels,
+        )
+        self._inner = inner
+        self._text: str | None = None
+        self._audio: asyncio.Task[list[tts.SynthesizedAudio]] | None = None
+        # the prepared synthesis is reported once, by the stream replaying it
+        self._forward_metrics = True
+        inner.on("metrics_collected", self._on_metrics)
+
+        self.hit: bool | None = None
+
+    def _on_metrics(self, tts_metrics) -> None:
+        if self._forward_metrics:
+            self.emit("metrics_collected", tts_metrics)
+
+    def prepare(self, text: str) -> None:
+        self._text = text
+        self._audio = asyncio.create_task(self._synthesize(text))
+
+    async def _synthesize(self, text: str) -> list[tts.SynthesizedAudio]:
+        self._forward_metrics = False
+        stream = self._inner.stream()
+        try:
+            stream.push_text(text)
+            stream.end_input()
+            return [ev async for ev in stream]
+        finally:
+            await stream.aclose()
+            self._forward_metrics = True
+
+    async def take(self, text: str) -> list[tts.SynthesizedAudio] | None:
+        """The prepared audio if `text` is the greeting, only once"""
+        audio, self._audio = self._audio, None
+        if audio is None:
+            return None
+
+        self.hit = text.strip() == (self._text or "").strip()
+        if not self.hit:
+            audio.cancel()
+            return None
+
+        try:
+            return await audio
+        except Exception as e:
+            logger.warning(f"greeting synthesis failed, synthesizing again: {e}")
+            self.hit = False
+            return None
+
+    def synthesize(
+        self, text: str, *, conn_options: APIConnectOptions | None = None
+    ) -> tts.ChunkedStream:
+        return self._inner.synthesize(text, conn_options=conn_options)
+
+    def stream(
+        self, *, conn_options: APIConnectOptions | None = None
+    ) -> tts.SynthesizeStream:
+        if self._audio is None:
+            return self._inner.stream(conn_options=conn_options)
+        return _GreetingSynthesizeStream(tts=self, conn_options=conn_options)
+
+    async def aclose(self) -> None:
+        # the wrapped client belongs to the call's `ProviderClientRegistry`, which
+        # closes it
+        self._inner.off("metrics_collected", self._on_metrics)
+        if self._audio is not None:
+            await utils.aio.gracefully_cancel(self._audio)
+
+
+class _GreetingSynthesizeStream(tts.SynthesizeStream):
+    def __init__(
+        self, *, tts: GreetingTTS, conn_options: APIConnectOptions | None
+    ) -> None:
+        super().__init__(
+            tts=tts, conn_options=conn_options or DEFAULT_API_CONNECT_OPTIONS
+        )
+        self._greeting = tts
+
+    async def _run(self) -> None:
+        # `say` pushes the whole text at once, so waiting for the end costs nothing
+        text = ""
+        async for data in self._input_ch:
+            if isinstance(data, str):
+                text += data
+
+        audio = await self._greeting.take(text)
+        if audio is not None:
+            self._mark_started()
+            for ev in audio:
+                self._event_ch.send_nowait(ev)
+            return
+
+        stream = self._greeting._inner.stream()
+        try:
+            stream.push_text(text)
+            stream.end_input()
+            async for ev in stream:
+                self._event_ch.send_nowait(ev)
+        finally:
+            await stream.aclose()
+
+
+async def prime_prompt_cache(
+    llm_client: llm.LLM,
+    chat_ctx: llm.ChatContext,
+    fnc_ctx: llm.FunctionContext | None,
+) -> None:
+    """
+    Sends the prompt once and drops the answer after its first chunk, so the
+    provider has the prefix cached when the first turn comes.
+    """
+    started_at = time.perf_counter()
+    try:
+        stream = llm_client.chat(chat_ctx=chat_ctx.copy(), fnc_ctx=fnc_ctx)
+        try:
+            async for _ in stream:
+                break
+        finally:
+            await stream.aclose()
+        logger.debug(
+            f"primed the prompt cache in {time.perf_counter() - started_at:.2f}s"
+        )
+    except Exception as e:
+        logger.warning(f"could not prime the prompt cache: {e}")
+
+
+class AnswerToFirstAudio:
+    """Time from the callee answering to the agent's first audio, and the ring time"""
+
+    def __init__(self) -> None:
+        self.dialed_at = time.perf_counter()
+        self.answered_at: float | None = None
+        self.first_audio_at: float | None = None
+        self.greeting_prepared: bool | None = None
+
+    def answered(self) -> None:
+        self.answered_at = time.perf_counter()
+
+    def attach(self, agent: rtc.EventEmitter) -> None:
+        agent.once("agent_started_speaking", self._on_agent_started_speaking)
+
+    def _on_agent_started_speaking(self) -> None:
+        self.first_audio_at = time.perf_counter()
+
+    def log_report(self) -> None:
+        if self.answered_at is None:
+            logger.info("outbound call: not answered")
+            return
+
+        ring = self.answered_at - self.dialed_at
+        if self.first_audio_at is None:
+            logger.info(
+                f"outbound call: answered after {ring:.2f}s, agent never spoke"
+            )
+            return
+
+        logger.info(
+            f"outbound call: answered after {ring:.2f}s, answer-to-first-audio "
+            f"{self.first_audio_at - self.answered_at:.3f}s "
+            f"(greeting prepared: {self.greeting_prepared})"
+        )
@@ -0,0 +1,182 @@
+"""
+Prompt layout for provider-side prompt caching.
+
+OpenAI and Gemini only reuse a cached prompt when its prefix is byte identical, so
+everything that is the same for every call of an agent (system prompt, instructions,
+language) goes first, and the per-call parts (call start time) go last. Tool schemas
+are sent by the plugin ahead of the messages, in the stable order of the agent's
+function context.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from app.agent.schema import AgentSettings
+
+
+ADDITIONAL_INSTRUCTIONS = """[Additional Instructions]:
+ Remember that you're on a phone call, and your response will be converted to audio. Avoid producing lists and special characters like asterisks (*).
+Avoid producing time and date information in numerical formats like "9:00 AM" or "23:25." Instead, provide them in natural language
+such as "nine o’clock," "today," or "six forty-five in the morning.
+When mentioning email addresses, spell them out clearly. For example, "john.doe@example.com" should be pronounced as "john dot doe at example dot com.
+"""
+
+
+def prompt_config_hash(settings: "AgentSettings", include_greeting: bool) -> str:
+    """Hash of everything the static prefix depends on"""
+    config = {
+        "system_prompt": settings.system_prompt,
+        "greeting_message": settings.greeting_message if include_greeting else None,
+        "language_code": settings.language_code,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class PromptCompiler:
+    def __init__(self, maxsize: int = 256) -> None:
+        self._maxsize = maxsize
+        self._static: OrderedDict[str, str] = OrderedDict()
+
+    def static_prefix(self, settings: "AgentSettings", include_greeting: bool) -> str:
+        key = prompt_config_hash(settings, include_greeting)
+        if key in self._static:
+            self._static.move_to_end(key)
+            return self._static[key]
+
+        prompt = f"{settings.system_prompt}"
+
+        if include_greeting:
+            prompt += f"\nbegin by greeting the customer with the greeting message {settings.greeting_message}"
+
+        prompt += ADDITIONAL_INSTRUCTIONS
+
+        if settings.language_code is not None:
+            prompt += f"Always speak in {settings.language_name} even if the user speaks in another language or wants to use another language.\n"
+
+        self._static[key] = prompt
+        if len(self._static) > self._maxsize:
+            self._static.popitem(last=False)
+        return prompt
+
+    def dynamic_suffix(self, now: datetime | None = None) -> str:
+        now = now or datetime.now()
+        return f"\nThe call is starting at: {now.strftime('%Y-%m-%d %H:%M:%S')}.\n"
+
+    def compile(
+        self,
+        settings: "AgentSettings",
+        include_greeting: bool = True,
+        now: datetime | None = None,
+    ) -> str:
+        return self.static_prefix(settings, include_greeting) + self.dynamic_suffix(
+            now
+        )
+
+
+prompt_compiler = PromptCompiler()
+
+
+# ╔═╗┌─┐┌─┐┬ ┬┌─┐  ┬ ┬┌─┐┌─┐┌─┐┌─┐┬
+# ║  ├─┤│  ├─┤├┤   │ │└─┐├─┤│ ┬├┤ │
+# ╚═╝┴ ┴└─┘┴ ┴└─┘  └─┘└─┘┴ ┴└─┘└─┘o
+
+
+@dataclass
+class PromptCacheUsage:
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+
+    def record(self, prompt_tokens: int, cached_tokens: int) -> None:
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+
+    def log_report(self) -> None:
+        ratio = self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+        logger.info(
+            f"prompt cache: {self.cached_tokens}/{self.prompt_tokens} prompt tokens cached "
+            f"({ratio:.0%}) over {self.requests} requests"
+        )
+
+
+class _OpenAITrackedStream:
+    def __init__(self, stream, usage: PromptCacheUsage) -> None:
+        self._stream = stream
+        self._usage = usage
+
+    async def __aenter__(self):
+        await self._stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        return await self._stream.__aexit__(*exc)
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        async for chunk in self._stream:
+            if chunk.usage is not None:
+                details = chunk.usage.prompt_tokens_details
+                self._usage.record(
+                    chunk.usage.prompt_tokens,
+                    (details.cached_tokens or 0) if details else 0,
+                )
+            yield chunk
+
+    def __getattr__(self, name: str):
+        return getattr(self._stream, name)
+
+
+def track_prompt_cache_usage(llm_client: object) -> PromptCacheUsage:
+    """
+    The livekit plugins drop the cached token counts from the provider usage, this
+    wraps the provider sdk client of an openai or google LLM to record them.
+    """
+    usage = PromptCacheUsage()
+    client = getattr(llm_client, "_client", None)
+
+    if hasattr(client, "chat"):  # openai.AsyncClient
+        completions = client.chat.completions  # type: ignore
+        create = completions.create
+
+        async def _create(*args, **kwargs):
+            stream = await create(*args, **kwargs)
+            return _OpenAITrackedStream(stream, usage)
+
+        completions.create = _create
+
+    elif hasattr(client, "aio"):  # google.genai.Client
+        models = client.aio.models  # type: ignore
+        generate_content_stream = models.generate_content_stream
+
+        async def _generate_content_stream(*args, **kwargs):
+            stream = await generate_content_stream(*args, **kwargs)
+
+            async def _iter():
+                last_usage = None
+                try:
+                    async for response in stream:
+                        if response.usage_metadata is not None:
+                            last_usage = response.usage_metadata
+                        yield response
+                finally:
+                    if last_usage is not None:
+                        usage.record(
+                            last_usage.prompt_token_count or 0,
+                            last_usage.cached_content_token_count or 0,
+                        )
+
+            return _iter()
+
+        models.generate_content_stream = _generate_content_stream
+
+    return usage
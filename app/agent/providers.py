@@ -0,0 +1,553 @@
+"""
+Registry of the STT, LLM and TTS providers an agent can select.
+
+Provider plugins are heavy to import (grpc, onnxruntime, google cloud sdks...),
+so they are only imported the first time an agent actually selects them. This keeps
+them out of the FastAPI process entirely.
+"""
+
+import asyncio
+import functools
+import hashlib
+import importlib
+import json
+import os
+import time
+from types import ModuleType
+from typing import TYPE_CHECKING, Callable, Literal, TypeVar
+
+from livekit.agents import llm, stt, tokenize, tts
+from loguru import logger
+from openai import AsyncOpenAI
+
+from app.agent.fallback import (
+    ChainMember,
+    HedgedLLM,
+    HedgedTTS,
+    SharedBreakers,
+    failover_stt,
+)
+from app.agent.prompt import PromptCacheUsage, track_prompt_cache_usage
+from app.core.circuit_breaker import CircuitBreaker
+from app.core.config import settings
+
+if TYPE_CHECKING:
+    from app.agent.schema import AgentSettings
+
+
+credentials_file = "credentials.json"
+
+PROVIDER_PLUGINS: dict[str, str] = {
+    "google": "livekit.plugins.google",
+    "openai": "livekit.plugins.openai",
+    "deepgram": "livekit.plugins.deepgram",
+    "cartesia": "livekit.plugins.cartesia",
+    "elevenlabs": "livekit.plugins.elevenlabs",
+    "silero": "livekit.plugins.silero",
+    "turn_detector": "livekit.plugins.turn_detector",
+}
+
+
+@functools.cache
+def load_google_credentials() -> dict | None:
+    """Parses `credentials.json` once per process instead of once per client"""
+    try:
+        with open(credentials_file) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def load_plugin(name: str) -> ModuleType:
+    """Imports the livekit plugin of a provider on first use"""
+    if name not in PROVIDER_PLUGINS:
+        raise ValueError(f"Unknown provider plugin: {name}")
+    return importlib.import_module(PROVIDER_PLUGINS[name])
+
+
+def preload_plugins(names: list[str] | None = None) -> None:
+    """
+    livekit plugins must be registered on the main thread, call this from the main
+    thread before jobs run on threads, or before `download-files`.
+    """
+    for name in names or list(PROVIDER_PLUGINS):
+        load_plugin(name)
+
+
+ProviderFactory = Callable[["AgentSettings"], object]
+F = TypeVar("F", bound=ProviderFactory)
+
+_tts_providers: dict[str, ProviderFactory] = {}
+_llm_providers: dict[str, ProviderFactory] = {}
+_stt_providers: dict[str, ProviderFactory] = {}
+
+
+def _register(registry: dict[str, ProviderFactory], name: str):
+    def decorator(factory: F) -> F:
+        registry[name] = factory
+        return factory
+
+    return decorator
+
+
+def register_tts(name: str):
+    return _register(_tts_providers, name)
+
+
+def register_llm(name: str):
+    return _register(_llm_providers, name)
+
+
+def register_stt(name: str):
+    return _register(_stt_providers, name)
+
+
+# ╔╦╗╔╦╗╔═╗┬
+#  ║  ║ ╚═╗│
+#  ╩  ╩ ╚═╝o
+
+
+@register_tts("google")
+def _google_tts(agent_settings: "AgentSettings") -> tts.TTS:
+    google = load_plugin("google")
+    return google.TTS(
+        voice_name=agent_settings.voice.voice_name,
+        credentials_info=load_google_credentials(),
+        credentials_file=credentials_file,
+    )
+
+
+@register_tts("openai")
+def _openai_tts(agent_settings: "AgentSettings") -> tts.TTS:
+    openai = load_plugin("openai")
+    return openai.TTS(
+        api_key=agent_settings.open_api_key,
+        voice=agent_settings.voice.voice_name,
+        model=agent_settings.voice.model or "tts-1",
+    )
+
+
+# cartesia and elevenlabs stream the LLM tokens over a websocket as they come.
+# cartesia sends pcm at 16kHz, plenty for phone audio. the elevenlabs plugin
+# decodes every format as a container, its 22kHz mp3 has the lowest first byte
+
+
+@register_tts("cartesia")
+def _cartesia_tts(agent_settings: "AgentSettings") -> tts.TTS:
+    cartesia = load_plugin("cartesia")
+    return cartesia.TTS(
+        model=agent_settings.voice.model or "sonic-2",
+        voice=agent_settings.voice.voice_name,
+        language=agent_settings.language_code.split("-")[0],
+        sample_rate=16000,
+        api_key=os.environ["CARTESIA_API_KEY"],
+        base_url=os.getenv("CARTESIA_BASE_URL", "https://api.cartesia.ai"),
+    )
+
+
+@register_tts("elevenlabs")
+def _elevenlabs_tts(agent_settings: "AgentSettings") -> tts.TTS:
+    elevenlabs = load_plugin("elevenlabs")
+    return elevenlabs.TTS(
+        voice=elevenlabs.Voice(
+            id=agent_settings.voice.voice_name, name="", category=""
+        ),
+        model=agent_settings.voice.model or "eleven_flash_v2_5",
+        language=agent_settings.language_code.split("-")[0],
+        encoding="mp3_22050_32",
+        api_key=os.environ["ELEVEN_API_KEY"],
+        base_url=os.getenv("ELEVENLABS_BASE_URL"),
+    )
+
+
+# ╦  ╦  ╔╦╗┬
+# ║  ║  ║║║│
+# ╩═╝╩═╝╩ ╩o
+
+
+@register_llm("google")
+def _google_llm(agent_settings: "AgentSettings") -> llm.LLM:
+    google = load_plugin("google")
+    # `model` defaults to an openai model, keep the plugin's default for those
+    if agent_settings.model.startswith("gemini"):
+        return google.LLM(
+            model=agent_settings.model,
+            api_key=os.environ["GOOGLE_API_KEY"],
+            temperature=0.9,
+        )
+    return google.LLM(api_key=os.environ["GOOGLE_API_KEY"], temperature=0.9)
+
+
+@register_llm("openai")
+def _openai_llm(agent_settings: "AgentSettings") -> llm.LLM:
+    openai = load_plugin("openai")
+    return openai.LLM(
+        model=agent_settings.model,
+    )
+
+
+FAST_MODELS: dict[str, str] = {
+    "openai": "gpt-4o-mini",
+    "google": "gemini-2.0-flash-lite",
+}
+
+
+def fast_llm_settings(agent_settings: "AgentSettings") -> "AgentSettings":
+    """The agent settings with `model` swapped for the fast model of its provider"""
+    model = agent_settings.fast_model or FAST_MODELS[agent_settings.model_provider]
+    return agent_settings.model_copy(update={"model": model})
+
+
+# ╔═╗╔╦╗╔╦╗┬
+# ╚═╗ ║  ║ │
+# ╚═╝ ╩  ╩ o
+
+
+@register_stt("google")
+def _google_stt(agent_settings: "AgentSettings") -> stt.STT:
+    google = load_plugin("google")
+    return google.STT(
+        credentials_info=load_google_credentials(),
+        credentials_file=credentials_file,
+    )
+
+
+@register_stt("deepgram")
+def _deepgram_stt(agent_settings: "AgentSettings") -> stt.STT:
+    deepgram = load_plugin("deepgram")
+    return deepgram.STT(
+        api_key=os.environ["DEEPGRAM_API_KEY"], language="en-US", model="nova-3"
+    )
+
+
+@register_stt("openai")
+def _openai_stt(agent_settings: "AgentSettings") -> stt.STT:
+    openai = load_plugin("openai")
+    return openai.STT(api_key=agent_settings.open_api_key)
+
+
+def create_tts(agent_settings: "AgentSettings") -> tts.TTS:
+    factory = _tts_providers.get(agent_settings.synth_provider)
+    if factory is None:
+        raise ValueError(
+            f"Synth provider {agent_settings.synth_provider} not yet implemented"
+        )
+    return factory(agent_settings)  # type: ignore
+
+
+def create_llm(agent_settings: "AgentSettings") -> llm.LLM:
+    factory = _llm_providers.get(agent_settings.model_provider)
+    if factory is None:
+        raise ValueError(
+            f"LLM provider {agent_settings.model_provider} not yet implemented"
+        )
+    return factory(agent_settings)  # type: ignore
+
+
+def create_stt(agent_settings: "AgentSettings") -> stt.STT:
+    factory = _stt_providers.get(agent_settings.transcriber_provider)
+    if factory is None:
+        raise ValueError(
+            f"STT provider {agent_settings.transcriber_provider} not yet implemented"
+        )
+    return factory(agent_settings)  # type: ignore
+
+
+# ╦═╗┌─┐┌─┐┬ ┌┬┐┬┌┬┐┌─┐┬
+# ╠╦╝├┤ ├─┤│  │ ││││├┤ │
+# ╩╚═└─┘┴ ┴┴─┘┴ ┴┴ ┴└─┘o
+
+
+def create_realtime_model(agent_settings: "AgentSettings", instructions: str):
+    """Speech to speech model of an agent with `pipeline_mode` realtime, openai only"""
+    openai = load_plugin("openai")
+    return openai.realtime.RealtimeModel(
+        model=agent_settings.realtime_model,
+        voice=agent_settings.realtime_voice,
+        instructions=instructions,
+        # the realtime api only accepts temperatures from 0.6 to 1.2
+        temperature=min(max(agent_settings.temperature, 0.6), 1.2),
+        turn_detection=openai.realtime.ServerVadOptions(
+            threshold=0.6,
+            prefix_padding_ms=200,
+            silence_duration_ms=int(agent_settings.min_endpointing_delay * 1000),
+        ),
+        api_key=agent_settings.open_api_key,
+    )
+
+
+# ╔═╗┬  ┬┌─┐┌┐┌┌┬┐  ╦═╗┌─┐┌─┐┬┌─┐┌┬┐┬─┐┬ ┬┬
+# ║  │  │├┤ │││ │   ╠╦╝├┤ │ ┬│└─┐ │ ├┬┘└┬┘│
+# ╚═╝┴─┘┴└─┘┘└┘ ┴   ╩╚═└─┘└─┘┴└─┘ ┴ ┴└─ ┴ o
+
+ProviderKind = Literal["stt", "llm", "tts"]
+ClientKey = tuple[str, ...]
+
+
+def _fingerprint(secret: str | None) -> str:
+    """keys must tell credentials apart without keeping them readable in reports"""
+    return hashlib.sha256((secret or "").encode()).hexdigest()[:12]
+
+
+def _credentials(provider: str, agent_settings: "AgentSettings") -> str:
+    if provider == "openai":
+        return _fingerprint(agent_settings.open_api_key)
+    if provider == "google":
+        return _fingerprint(credentials_file + os.getenv("GOOGLE_API_KEY", ""))
+    if provider == "deepgram":
+        return _fingerprint(os.getenv("DEEPGRAM_API_KEY"))
+    if provider == "cartesia":
+        return _fingerprint(os.getenv("CARTESIA_API_KEY"))
+    if provider == "elevenlabs":
+        return _fingerprint(os.getenv("ELEVEN_API_KEY"))
+    return _fingerprint(None)
+
+
+def client_key(kind: ProviderKind, agent_settings: "AgentSettings") -> ClientKey:
+    """(kind, provider, model, voice, credentials) of the client an agent needs"""
+    if kind == "tts":
+        provider = agent_settings.synth_provider
+        model = agent_settings.voice.model or ""
+        voice = agent_settings.voice.voice_name
+    elif kind == "llm":
+        provider = agent_settings.model_provider
+        model, voice = agent_settings.model, ""
+    else:
+        provider = agent_settings.transcriber_provider
+        model, voice = "", ""
+    return (kind, provider, model, voice, _credentials(provider, agent_settings))
+
+
+def fallback_settings(
+    kind: ProviderKind, agent_settings: "AgentSettings"
+) -> list["AgentSettings"]:
+    """The agent settings followed by a copy for each of its fallbacks of a kind"""
+    if kind == "llm":
+        updates = [dict(f) for f in agent_settings.llm_fallbacks]
+    elif kind == "tts":
+        updates = [dict(f) for f in agent_settings.synth_fallbacks]
+    else:
+        updates = [
+            {"transcriber_provider": provider}
+            for provider in agent_settings.transcriber_fallbacks
+        ]
+    return [agent_settings] + [
+        agent_settings.model_copy(update=update) for update in updates
+    ]
+
+
+provider_breakers = SharedBreakers(settings.REDIS_URL)
+
+
+class ProviderClientRegistry:
+    """
+    The provider clients of a call, one per (provider, model, voice, credentials) so
+    the chains, the fast LLM and the summaries share a client and its connections.
+
+    The clients are bound to the event loop of the job that built them, so they
+    can't be shared across calls. Instead the call builds them and opens their
+    connections as soon as its agent is known, while the room and the dial are still
+    being set up, so the first turn doesn't pay for them. The call closes them with
+    `aclose` when it ends, a thread executor runs every call in one process and
+    would keep their connection pools otherwise.
+    """
+
+    _factories: dict[ProviderKind, Callable[["AgentSettings"], object]] = {
+        "tts": create_tts,
+        "llm": create_llm,
+        "stt": create_stt,
+    }
+
+    def __init__(self) -> None:
+        self._clients: dict[ClientKey, object] = {}
+        self._warmed: dict[ClientKey, float | None] = {}
+        """ seconds it took to open the connections, None if it failed """
+        self._prompt_cache_usage: dict[ClientKey, PromptCacheUsage] = {}
+        self._stream_adapters: dict[ClientKey, tts.StreamAdapter] = {}
+
+    def get(self, kind: ProviderKind, agent_settings: "AgentSettings") -> object:
+        key = client_key(kind, agent_settings)
+        if key in self._clients:
+            return self._clients[key]
+
+        client = self._factories[kind](agent_settings)
+        self._clients[key] = client
+        if kind == "llm":
+            self._prompt_cache_usage[key] = track_prompt_cache_usage(client)
+        return client
+
+    def get_tts(self, agent_settings: "AgentSettings") -> tts.TTS:
+        return self.get("tts", agent_settings)  # type: ignore
+
+    def get_llm(self, agent_settings: "AgentSettings") -> llm.LLM:
+        return self.get("llm", agent_settings)  # type: ignore
+
+    def get_stt(self, agent_settings: "AgentSettings") -> stt.STT:
+        return self.get("stt", agent_settings)  # type: ignore
+
+    def get_fast_llm(self, agent_settings: "AgentSettings") -> llm.LLM:
+        return self.get_llm(fast_llm_settings(agent_settings))
+
+    def breaker(self, key: ClientKey) -> CircuitBreaker:
+        """provider health is shared by every call, see `SharedBreakers`"""
+        return provider_breakers.get(
+            "/".join(key), name="/".join(part for part in key[:4] if part)
+        )
+
+    async def load_breakers(self, agent_settings: "AgentSettings") -> None:
+        """Loads the breakers of the agent's fallback chains, before its first turn"""
+        keys: list[ClientKey] = []
+        for kind in self._factories:
+            chain = fallback_settings(kind, agent_settings)  # type: ignore
+            if len(chain) > 1:
+                keys += [client_key(kind, member) for member in chain]  # type: ignore
+        for key in keys:
+            self.breaker(key)
+        await provider_breakers.load(["/".join(key) for key in keys])
+
+    def _member(
+        self, kind: ProviderKind, agent_settings: "AgentSettings"
+    ) -> ChainMember:
+        client = self.get(kind, agent_settings)
+        key = client_key(kind, agent_settings)
+        if isinstance(client, tts.TTS) and not client.capabilities.streaming:
+            if key not in self._stream_adapters:
+                self._stream_adapters[key] = tts.StreamAdapter(
+                    tts=client, sentence_tokenizer=tokenize.basic.SentenceTokenizer()
+                )
+            client = self._stream_adapters[key]
+        return ChainMember(client=client, breaker=self.breaker(key))
+
+    def llm_chain(self, agent_settings: "AgentSettings") -> llm.LLM:
+        """The agent's LLM, hedged with its `llm_fallbacks` if it has any"""
+        if not agent_settings.llm_fallbacks:
+            return self.get_llm(agent_settings)
+        return HedgedLLM(
+            [
+                self._member("llm", settings)
+                for settings in fallback_settings("llm", agent_settings)
+            ],
+            hedge_after=agent_settings.llm_hedge_after,
+        )
+
+    def tts_chain(self, agent_settings: "AgentSettings") -> tts.TTS:
+        """The agent's TTS, hedged with its `synth_fallbacks` if it has any"""
+        if not agent_settings.synth_fallbacks:
+            return self.get_tts(agent_settings)
+        return HedgedTTS(
+            [
+                self._member("tts", settings)
+                for settings in fallback_settings("tts", agent_settings)
+            ],
+            hedge_after=agent_settings.tts_hedge_after,
+        )
+
+    def stt_chain(self, agent_settings: "AgentSettings") -> stt.STT:
+        """The agent's STT, failing over to its `transcriber_fallbacks` if it has any"""
+        if not agent_settings.transcriber_fallbacks:
+            return self.get_stt(agent_settings)
+        return failover_stt(
+            [
+                self._member("stt", settings)
+                for settings in fallback_settings("stt", agent_settings)
+            ]
+        )
+
+    def prewarm(self, agent_settings: "AgentSettings") -> None:
+        """Builds the clients of the call's agent ahead of its first turn"""
+        if agent_settings.pipeline_mode == "realtime":
+            return
+        for kind in self._factories:
+            for settings in fallback_settings(kind, agent_settings):  # type: ignore
+                try:
+                    self.get(kind, settings)  # type: ignore
+                except Exception as e:
+                    logger.warning(
+                        f"could not prewarm {kind} client for agent {agent_settings.agent_id}: {e}"
+                    )
+        if agent_settings.llm_routing:
+            try:
+                self.get_fast_llm(agent_settings)
+            except Exception as e:
+                logger.warning(
+                    f"could not prewarm fast llm client for agent {agent_settings.agent_id}: {e}"
+                )
+
+    async def warm_connections(self, agent_settings: "AgentSettings") -> None:
+        """
+        Opens the connections of an agent's clients, must run on the job's event loop
+        since the underlying http sessions are bound to it.
+        """
+        keys = [
+            client_key(kind, settings)  # type: ignore
+            for kind in self._factories
+            for settings in fallback_settings(kind, agent_settings)  # type: ignore
+        ]
+        if agent_settings.llm_routing:
+            keys.append(client_key("llm", fast_llm_settings(agent_settings)))
+        await asyncio.gather(*(self._warm(key) for key in keys), return_exceptions=True)
+
+    async def _warm(self, key: ClientKey) -> None:
+        client = self._clients.get(key)
+        if client is None or key in self._warmed:
+            return
+        self._warmed[key] = None
+
+        started_at = time.perf_counter()
+        try:
+            if isinstance(client, tts.TTS):
+                # websocket based tts plugins pre-open their connection pool here
+                client.prewarm()
+                pool = getattr(client, "_pool", None)
+                if pool is not None and type(client).prewarm is tts.TTS.prewarm:
+                    # elevenlabs has a pool but doesn't expose its prewarm
+                    pool.prewarm()
+
+            # a cheap request opens the TLS connection that the first turn would
+            # otherwise pay for, the openai plugins hold an `AsyncOpenAI` client and
+            # the google llm a `genai.Client`, whose async api is under `aio`
+            sdk_client = getattr(client, "_client", None)
+            if isinstance(sdk_client, AsyncOpenAI):
+                await sdk_client.models.list()
+            elif hasattr(getattr(sdk_client, "aio", None), "models"):
+                await sdk_client.aio.models.list(config={"page_size": 1})
+            self._warmed[key] = time.perf_counter() - started_at
+        except Exception as e:
+            logger.warning(f"could not warm connection for {key[:2]}: {e}")
+
+    async def aclose(self) -> None:
+        """Closes the call's clients and their connection pools"""
+        # the stream adapters hold nothing of their own, just the wrapped client
+        clients = list(self._clients.values())
+        results = await asyncio.gather(
+            *(self._close(client) for client in clients), return_exceptions=True
+        )
+        for client, result in zip(clients, results):
+            if isinstance(result, Exception):
+                logger.warning(f"could not close {type(client).__name__}: {result}")
+
+    @staticmethod
+    async def _close(client: object) -> None:
+        await client.aclose()  # type: ignore
+        # the openai plugins don't close the http client of their `AsyncOpenAI`
+        sdk_client = getattr(client, "_client", None)
+        if isinstance(sdk_client, AsyncOpenAI):
+            await sdk_client.close()
+
+    def prompt_cache_usage(self, agent_settings: "AgentSettings") -> PromptCacheUsage:
+        return self._prompt_cache_usage.get(
+            client_key("llm", agent_settings), PromptCacheUsage()
+        )
+
+    def report(self) -> dict[str, float | None]:
+        return {
+            "/".join(part for part in key[:4] if part): self._warmed.get(key)
+            for key in self._clients
+        }
+
+    def log_report(self) -> None:
+        for key, warmed_in in self.report().items():
+            if warmed_in is None:
+                logger.info(f"provider client {key} was not warmed")
+            else:
+                logger.info(f"provider client {key} warmed in {warmed_in:.2f}s")
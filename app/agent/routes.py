@@ -3,6 +3,7 @@ from fastapi.responses import JSONResponse
 from loguru import logger
 
 from app.agent.deps import AssistantServiceType
+from app.agent.scheduler import OutboundQueueFullError, outbound_scheduler
 from app.agent.schema import AgentSettings, MakeOutboundCallInputs
 
 router = APIRouter(tags=["agent"], prefix="/agent")
@@ -40,18 +41,42 @@ async def find_all_agents(
     return agents
 
 
-@router.post("/{agent_id}/outbound_call")
+@router.post("/{agent_id}/outbound_call", status_code=202)
 async def make_call(
     agent_service: AssistantServiceType,
     inputs: MakeOutboundCallInputs,
     agent_id: str,
 ):
-    """use the agent to make an outbound call"""
+    """use the agent to make an outbound call, the call is queued and paced per trunk"""
     try:
-        await agent_service.make_outbound_call(agent_id, inputs)
+        call = await agent_service.make_outbound_call(agent_id, inputs)
         return {
-            "message": "call started successfully",
+            "message": "call queued successfully",
+            "call_id": call.call_id,
+            "estimated_wait": outbound_scheduler.estimated_wait(call.trunk_id),
         }
+    except OutboundQueueFullError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)})
     except Exception as e:
-        logger.exception(f"Failed to create agent: {e}")
+        logger.exception(f"Failed to queue outbound call: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@router.get("/outbound_call/{call_id}")
+async def outbound_call_status(call_id: str):
+    call = outbound_scheduler.get(call_id)
+    if not call:
+        raise HTTPException(status_code=404, detail="Call not found")
+    return {
+        "call_id": call.call_id,
+        "status": call.status,
+        "wait": call.wait,
+        "room": call.room,
+        "error": call.error,
+    }
+
+
+@router.get("/outbound_calls/status")
+async def outbound_queue_status():
+    """queue depth and wait times of the outbound calls, per trunk"""
+    return outbound_scheduler.status()
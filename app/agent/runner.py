@@ -1,7 +1,7 @@
+import asyncio
 import json
 from json import tool
-import os
-from typing import Any, TypedDict
+from typing import TypedDict
 
 from livekit.agents import (
     AutoSubscribe,
@@ -12,30 +12,30 @@ from livekit.agents import (
     stt,
     multimodal,
     tts,
-)
-from livekit.plugins import (
-    google,
-    silero,
+    utils,
 )
 from loguru import logger
 from livekit.agents.pipeline import VoicePipelineAgent
 
 from app.agent.schema import AgentSettings
+from app.agent.amd import AMDDecision, AMDOptions, detect_answering_machine
+from app.agent.context import ChatContextManager
+from app.agent.endpointing import AdaptiveEndpointing
+from app.agent.fallback import HedgedLLM, HedgedTTS
+from app.agent.llm_router import CascadingLLM, TurnClassifier
+from app.agent.outbound import AnswerToFirstAudio, GreetingTTS, prime_prompt_cache
 from app.agent.service import AssistantService
-from livekit import api
+from app.agent.speculative import SpeculativeGenerator
+from app.agent.tool_routing import ToolRouter, action_keywords
+from app.campaign.service import classify_dial_error, finish_attempt, mark_answered
+from app.core.config import settings
+from livekit import api, rtc
 
 # from app.agent.tools import create_assistant_tool
 from app.core.database import get_session_db
 from livekit.agents.pipeline import AgentTranscriptionOptions
 import app.agent.tools as tools
-
-
-from livekit.plugins import deepgram, openai
-
-credentials_file = "credentials.json"
-
-
-IS_MULTI_MODAL = False
+import app.agent.providers as providers
 
 
 class VoicePipelineAgentSettings(TypedDict):
@@ -46,79 +46,273 @@ class VoicePipelineAgentSettings(TypedDict):
 
 def get_pipeline_agent_settings(
     agent_settings: AgentSettings,
+    clients: providers.ProviderClientRegistry | None = None,
 ) -> VoicePipelineAgentSettings:
-    """Get the pipeline agent settings, works for google for now"""
-    stt: Any = None
-    llm: Any = None
-    tts: Any = None
-
-    # TTS
-    if agent_settings.synth_provider == "google":
-        tts = google.TTS(
-            voice_name=agent_settings.voice.voice_name,
-            credentials_file=credentials_file,
-        )
+    """Get the pipeline agent settings, provider plugins are imported on first use"""
+    clients = clients or providers.ProviderClientRegistry()
+    return {
+        "llm": clients.llm_chain(agent_settings),
+        "stt": clients.stt_chain(agent_settings),
+        "tts": clients.tts_chain(agent_settings),
+    }
+
+
+def default_before_llm_cb(
+    agent: VoicePipelineAgent, chat_ctx: llm.ChatContext
+) -> llm.LLMStream:
+    return agent.llm.chat(chat_ctx=chat_ctx, fnc_ctx=agent.fnc_ctx)
 
-    elif agent_settings.synth_provider == "openai":
-        tts = openai.TTS(
-            api_key=agent_settings.open_api_key,
-            voice=agent_settings.voice.voice_name,
-            model=agent_settings.voice.model or "tts-1",
+
+def create_pipeline_agent(
+    ctx: JobContext,
+    *,
+    agent_settings: AgentSettings,
+    clients: providers.ProviderClientRegistry,
+    fnc_ctx: llm.FunctionContext,
+    chat_ctx: llm.ChatContext,
+    prepare_greeting: bool = False,
+) -> VoicePipelineAgent:
+    """The cascaded STT -> LLM -> TTS agent, with its per call helpers attached"""
+    voice_pipeline_config = get_pipeline_agent_settings(
+        agent_settings=agent_settings, clients=clients
+    )
+    chains = [
+        client
+        for client in voice_pipeline_config.values()
+        if isinstance(client, (HedgedLLM, HedgedTTS))
+    ]
+    if chains:
+
+        async def log_fallback_report():
+            for chain in chains:
+                chain.log_report()
+
+        ctx.add_shutdown_callback(log_fallback_report)
+
+    # outbound calls synthesize the greeting while the phone rings
+    if prepare_greeting and agent_settings.greeting_message:
+        greeting_tts = GreetingTTS(voice_pipeline_config["tts"])
+        greeting_tts.prepare(agent_settings.greeting_message)
+        voice_pipeline_config["tts"] = greeting_tts
+
+        async def close_greeting_tts():
+            await greeting_tts.aclose()
+
+        ctx.add_shutdown_callback(close_greeting_tts)
+
+    summary_llm = voice_pipeline_config["llm"]
+    llm_router: CascadingLLM | None = None
+    fast_llm = (
+        clients.get_fast_llm(agent_settings) if agent_settings.llm_routing else None
+    )
+    if fast_llm is not None and fast_llm is voice_pipeline_config["llm"]:
+        # e.g. an agent already on gpt-4o-mini, both tiers would be one client
+        logger.info(
+            f"llm routing skipped for agent {agent_settings.agent_id}: "
+            "its model is already the fast one"
+        )
+    elif fast_llm is not None:
+        llm_router = CascadingLLM(
+            fast=fast_llm,
+            strong=voice_pipeline_config["llm"],
+            classifier=TurnClassifier(
+                action_keywords=set().union(
+                    *(action_keywords(action) for action in agent_settings.actions)
+                ),
+                long_turn_words=agent_settings.routing_long_turn_words,
+            ),
         )
-    else:
-        raise ValueError(
-            f"Synth provider {agent_settings.synth_provider} not yet implemented"
+        voice_pipeline_config["llm"] = llm_router
+        summary_llm = llm_router.fast
+
+        async def log_llm_routing_report():
+            llm_router.log_report()
+            await llm_router.aclose()
+
+        ctx.add_shutdown_callback(log_llm_routing_report)
+
+    # open the provider connections while the rest of the call is being set up
+    warm_task: asyncio.Task | None = None
+    if settings.PREWARM_PROVIDER_CLIENTS:
+        warm_task = asyncio.create_task(clients.warm_connections(agent_settings))
+
+    tool_router: ToolRouter | None = None
+    if agent_settings.tool_routing:
+        tool_router = ToolRouter(
+            fnc_ctx=fnc_ctx,
+            actions=agent_settings.actions,
+            max_tools=agent_settings.max_tools_per_turn,
         )
 
-    # LLM
-    if agent_settings.model_provider == "google":
-        llm = google.LLM(api_key=os.environ["GOOGLE_API_KEY"], temperature=0.9)
-    elif agent_settings.model_provider == "openai":
-        llm = openai.LLM(
-            model="gpt-4o-mini",
+        async def log_tool_routing_report():
+            tool_router.log_report()
+
+        ctx.add_shutdown_callback(log_tool_routing_report)
+
+    agent_stt = voice_pipeline_config["stt"]
+    speculative: SpeculativeGenerator | None = None
+    if agent_settings.speculative_generation:
+        speculative = SpeculativeGenerator(
+            llm=voice_pipeline_config["llm"],
+            match_threshold=agent_settings.speculative_match_threshold,
+            tool_router=tool_router,
         )
-        if False:
-            llm = AssistantLLM(
-                api_key=agent_settings.open_api_key,
-                assistant_opts=AssistantOptions(
-                    create_options=AssistantCreateOptions(
-                        model=typing.cast(ChatModels, agent_settings.model),
-                        instructions=agent_settings.build_prompt(),
-                        name=f"Assistant {agent_settings.agent_name}",
-                        temperature=agent_settings.temperature,
-                    )
-                ),
-            )
-    else:
-        raise ValueError(
-            f"STT provider {agent_settings.model_provider} not yet implemented"
+        agent_stt = speculative.wrap_stt(agent_stt)
+
+    turn_detector = None
+    if agent_settings.use_turn_detector and settings.TURN_DETECTOR:
+        turn_detector = providers.load_plugin("turn_detector").EOUModel()
+    elif agent_settings.use_turn_detector:
+        logger.warning("use_turn_detector is on but TURN_DETECTOR is off on the worker")
+
+    agent = VoicePipelineAgent(
+        vad=ctx.proc.userdata["vad"],
+        stt=agent_stt,
+        llm=voice_pipeline_config["llm"],
+        tts=voice_pipeline_config["tts"],
+        turn_detector=turn_detector,
+        allow_interruptions=agent_settings.allow_interruptions,
+        interrupt_speech_duration=agent_settings.interrupt_speech_duration,
+        interrupt_min_words=agent_settings.interrupt_min_words,
+        min_endpointing_delay=agent_settings.min_endpointing_delay,
+        max_endpointing_delay=agent_settings.max_endpointing_delay,
+        transcription=AgentTranscriptionOptions(),
+        chat_ctx=chat_ctx,
+        fnc_ctx=fnc_ctx,
+        before_llm_cb=(
+            speculative.before_llm_cb
+            if speculative is not None
+            else tool_router.before_llm_cb
+            if tool_router is not None
+            else default_before_llm_cb
+        ),
+    )
+
+    context_manager = ChatContextManager(
+        llm=summary_llm,
+        token_budget=agent_settings.context_token_budget,
+        keep_recent_messages=agent_settings.context_keep_recent_messages,
+    )
+    context_manager.attach(agent)
+
+    if agent_settings.adaptive_endpointing:
+        endpointing = AdaptiveEndpointing(
+            min_endpointing_delay=agent_settings.min_endpointing_delay,
+            max_endpointing_delay=agent_settings.max_endpointing_delay,
+            interrupt_speech_duration=agent_settings.interrupt_speech_duration,
         )
+        endpointing.attach(agent)
+
+        async def log_endpointing_report():
+            endpointing.log_report()
 
-    # STT
-    if agent_settings.transcriber_provider == "google":
-        stt = google.STT(credentials_file=credentials_file)
-    elif agent_settings.transcriber_provider == "deepgram":
-        stt = deepgram.STT(
-            api_key=os.environ["DEEPGRAM_API_KEY"], language="en-US", model="nova-3"
+        ctx.add_shutdown_callback(log_endpointing_report)
+
+    if speculative is not None:
+        speculative.attach(agent)
+
+        async def log_speculation_report():
+            speculative.log_report()
+
+        ctx.add_shutdown_callback(log_speculation_report)
+
+    async def log_provider_clients_report():
+        if warm_task is not None:
+            warm_task.cancel()
+        clients.log_report()
+        clients.prompt_cache_usage(agent_settings).log_report()
+
+    ctx.add_shutdown_callback(log_provider_clients_report)
+
+    return agent
+
+
+def create_realtime_agent(
+    *,
+    agent_settings: AgentSettings,
+    fnc_ctx: llm.FunctionContext,
+    instructions: str,
+) -> multimodal.MultimodalAgent:
+    """A speech to speech agent, the prompt goes in the session's instructions"""
+    return multimodal.MultimodalAgent(
+        model=providers.create_realtime_model(
+            agent_settings, instructions=instructions
+        ),
+        fnc_ctx=fnc_ctx,
+    )
+
+
+def sip_participant_identity(metadict: dict) -> str:
+    return metadict.get("agent_name", "Default Agent Name")
+
+
+async def dial_outbound(ctx: JobContext, metadict: dict) -> None:
+    """`create_sip_participant` dials the callee and returns once they answer"""
+    logger.info(f"starting outbound call: {metadict}")
+    attempt_id = metadict.get("attempt_id", None)
+    try:
+        await ctx.api.sip.create_sip_participant(
+            api.CreateSIPParticipantRequest(
+                room_name=ctx.room.name,
+                sip_trunk_id=metadict["sip_trunk_id"],
+                sip_call_to=metadict["customer_phone"],
+                participant_identity=sip_participant_identity(metadict),
+                wait_until_answered=True,
+            )
+        )
+    except Exception as e:
+        # campaign calls record why the dial failed, busy and no answer are retried
+        if attempt_id is not None:
+            await asyncio.to_thread(
+                finish_attempt, attempt_id, classify_dial_error(e), ctx.room.name
+            )
+        raise
+
+    if attempt_id is not None:
+        await asyncio.to_thread(mark_answered, attempt_id, ctx.room.name)
+
+
+async def cancel_dial(
+    ctx: JobContext, metadict: dict, dial_task: asyncio.Task
+) -> None:
+    """Hangs up an outbound call whose agent couldn't be set up while it rang"""
+    await utils.aio.gracefully_cancel(dial_task)
+    if not dial_task.cancelled() and dial_task.exception() is not None:
+        return  # the dial failed on its own, `dial_outbound` recorded it
+
+    # cancelling the request doesn't stop the ringing, the sip participant is
+    # in the room from the start of the dial
+    try:
+        await ctx.api.room.remove_participant(
+            api.RoomParticipantIdentity(
+                room=ctx.room.name, identity=sip_participant_identity(metadict)
+            )
         )
-    elif agent_settings.transcriber_provider == "openai":
-        stt = openai.STT(api_key=agent_settings.open_api_key)
-    else:
-        raise ValueError(
-            f"STT provider {agent_settings.transcriber_provider} not yet implemented"
+    except Exception as e:
+        logger.warning(
+            f"could not hang up the call to {metadict['customer_phone']}: {e}"
         )
 
-    return {
-        "llm": llm,
-        "stt": stt,
-        "tts": tts,
-    }
+    attempt_id = metadict.get("attempt_id", None)
+    if attempt_id is not None:
+        await asyncio.to_thread(finish_attempt, attempt_id, "failed", ctx.room.name)
 
 
 class VoiceAgent:
     @staticmethod
     def prewarm(proc: JobProcess):
-        proc.userdata["vad"] = silero.VAD.load()
+        # the vad module pulls in onnxruntime, keep it out of the api process
+        from app.agent.vad import BatchedVAD
+
+        silero = providers.load_plugin("silero")
+
+        if settings.VAD_BATCHING:
+            proc.userdata["vad"] = BatchedVAD.load(
+                max_batch_size=settings.VAD_BATCH_MAX_SIZE,
+                max_batch_delay=settings.VAD_BATCH_MAX_DELAY_MS / 1000,
+            )
+        else:
+            proc.userdata["vad"] = silero.VAD.load()
 
     @staticmethod
     async def entrypoint(ctx: JobContext):
@@ -130,43 +324,46 @@ class VoiceAgent:
 
         metadict = json.loads(ctx.job.metadata or ctx.room.metadata or "{}")
 
-        # `create_sip_participant` starts dialing the user
-        if (
+        is_outbound = (
             metadict.get("direction", None) == "outbound"
             and metadict.get("sip_trunk_id", None) is not None
             and metadict.get("customer_phone", None) is not None
-        ):
-            logger.info(f"starting outbound call: {metadict}")
-            await ctx.api.sip.create_sip_participant(
-                api.CreateSIPParticipantRequest(
-                    room_name=ctx.room.name,
-                    sip_trunk_id=metadict["sip_trunk_id"],
-                    sip_call_to=metadict["customer_phone"],
-                    participant_identity=metadict.get(
-                        "agent_name", "Default Agent Name"
-                    ),
-                    wait_until_answered=True,
-                )
-            )
+        )
 
-        # Wait for the first agent participant to connect
-        participant = await ctx.wait_for_participant()
+        # an outbound call is prepared while the callee's phone rings, its agent is
+        # found from the job metadata since nobody has joined the room yet
+        prepare_while_ringing = (
+            is_outbound and metadict.get("agent_phone", None) is not None
+        )
+        participant: rtc.RemoteParticipant | None = None
 
-        agent_attributes = participant.attributes or {}
+        if prepare_while_ringing:
+            agent_phone = metadict["agent_phone"]
+            customer_phone = metadict["customer_phone"]
+        else:
+            if is_outbound:
+                await dial_outbound(ctx, metadict)
 
-        logger.info(f"starting voice assistant for participant {participant.identity}")
+            # Wait for the first agent participant to connect
+            participant = await ctx.wait_for_participant()
 
-        agent_phone = agent_attributes.get(
-            "sip.trunkPhoneNumber",
-            agent_attributes.get("agent_phone", metadict.get("agent_phone", None)),
-        )
+            agent_attributes = participant.attributes or {}
 
-        customer_phone = agent_attributes.get(
-            "sip.phoneNumber",
-            agent_attributes.get(
-                "customer_phone", metadict.get("customer_phone", None)
-            ),
-        )
+            logger.info(
+                f"starting voice assistant for participant {participant.identity}"
+            )
+
+            agent_phone = agent_attributes.get(
+                "sip.trunkPhoneNumber",
+                agent_attributes.get("agent_phone", metadict.get("agent_phone", None)),
+            )
+
+            customer_phone = agent_attributes.get(
+                "sip.phoneNumber",
+                agent_attributes.get(
+                    "customer_phone", metadict.get("customer_phone", None)
+                ),
+            )
 
         logger.info(
             f"info: agent phone: {agent_phone}, customer phone: {customer_phone}"
@@ -179,85 +376,171 @@ class VoiceAgent:
             ctx.shutdown()
             return
 
-        agent = await service.find_agent_by(
+        agent_settings = await service.find_agent_settings(
             phone_number=agent_phone,
         )
 
-        if not agent:
+        if not agent_settings:
             logger.error("Could not find agent, shutting down room...")
             ctx.shutdown()
             return
 
-        agent_settings = AgentSettings.model_validate(agent.config)
+        dial_task: asyncio.Task | None = None
+        if prepare_while_ringing:
+            answer_latency = AnswerToFirstAudio()
+            dial_task = asyncio.create_task(dial_outbound(ctx, metadict))
 
-        # build the full prompt including date/time and additional intructions
-        full_prompt = agent_settings.build_prompt(include_greeting=False)
+        try:
+            # the process serves this call only, build just what its agent needs
+            clients = providers.ProviderClientRegistry()
 
-        logger.debug(
-            f"\n\nFull Adjusted Prompt: \n{'---' * 20} \n {full_prompt} \n {'---' * 20}\n\n"
-        )
+            async def close_provider_clients():
+                await clients.aclose()
 
-        # Add the prompt to the context
-        initial_ctx = llm.ChatContext().append(
-            role="system",
-            text=full_prompt,
-        )
+            ctx.add_shutdown_callback(close_provider_clients)
+            clients.prewarm(agent_settings)
+            await clients.load_breakers(agent_settings)
+            realtime = agent_settings.pipeline_mode == "realtime"
 
-        voice_pipeline_config = get_pipeline_agent_settings(
-            agent_settings=agent_settings
-        )
+            # build the full prompt including date/time and additional intructions, a
+            # realtime model greets from the prompt since it can't `say` a fixed text
+            full_prompt = agent_settings.build_prompt(include_greeting=realtime)
 
-        # initialize the agent
-        enabled_functions = [
-            "end_call",
-            "detected_answering_machine",
-        ]
+            logger.debug(
+                f"\n\nFull Adjusted Prompt: \n{'---' * 20} \n {full_prompt} \n {'---' * 20}\n\n"
+            )
 
-        logger.info(f"created {len(agent_settings.actions)} dynamic functions")
-        DynamicCallActionsCls = tools.create_call_actions_class(
-            enabled_functions=enabled_functions, dynamic_schemas=agent_settings.actions
-        )
-        fnc_ctx = DynamicCallActionsCls(
-            api=ctx.api,
-            participant=participant,
-            room=ctx.room,
-            ctx=ctx,
-        )
+            # Add the prompt to the context
+            initial_ctx = llm.ChatContext().append(
+                role="system",
+                text=full_prompt,
+            )
 
-        if IS_MULTI_MODAL:
-            agent = multimodal.MultimodalAgent(
-                model=openai.realtime.RealtimeModel(
-                    voice="alloy",
-                    temperature=0.8,
-                    instructions=(
-                        "You are a helpful assistant, greet the user and help them with their trip planning. "
-                        "When performing function calls, let user know that you are checking the weather."
-                    ),
-                    turn_detection=openai.realtime.ServerVadOptions(
-                        threshold=0.6, prefix_padding_ms=200, silence_duration_ms=500
-                    ),
-                ),  # type: ignore
-                fnc_ctx=fnc_ctx,
-                chat_ctx=initial_ctx,
+            # initialize the agent
+            enabled_functions = [
+                "end_call",
+                "detected_answering_machine",
+            ]
+
+            logger.info(f"created {len(agent_settings.actions)} dynamic functions")
+            DynamicCallActionsCls = tools.create_call_actions_class(
+                enabled_functions=enabled_functions,
+                dynamic_schemas=agent_settings.actions,
             )
-        else:
-            agent = VoicePipelineAgent(
-                vad=ctx.proc.userdata["vad"],
-                stt=voice_pipeline_config["stt"],
-                llm=voice_pipeline_config["llm"],
-                tts=voice_pipeline_config["tts"],
-                allow_interruptions=True,
-                transcription=AgentTranscriptionOptions(),
-                chat_ctx=initial_ctx,
-                fnc_ctx=fnc_ctx,
+            # an outbound call's participant is set once the callee answers
+            fnc_ctx = DynamicCallActionsCls(
+                api=ctx.api,
+                participant=participant,  # type: ignore
+                room=ctx.room,
+                ctx=ctx,
+                max_tool_output_tokens=agent_settings.max_tool_output_tokens,
+            )
+
+            if realtime:
+                agent = create_realtime_agent(
+                    agent_settings=agent_settings,
+                    fnc_ctx=fnc_ctx,
+                    instructions=full_prompt,
+                )
+            else:
+                agent = create_pipeline_agent(
+                    ctx,
+                    agent_settings=agent_settings,
+                    clients=clients,
+                    fnc_ctx=fnc_ctx,
+                    chat_ctx=initial_ctx,
+                    prepare_greeting=(
+                        prepare_while_ringing and agent_settings.prepare_greeting
+                    ),
+                )
+
+            usage_collector = metrics.UsageCollector()
+
+            from app.agent.vad import get_vad_batcher
+
+            vad_batcher = get_vad_batcher(sample_rate=16000)
+            if vad_batcher is not None:
+
+                async def log_vad_report():
+                    vad_batcher.log_report()
+
+                ctx.add_shutdown_callback(log_vad_report)
+
+            @agent.on("metrics_collected")
+            def on_metrics_collected(agent_metrics: metrics.AgentMetrics):
+                metrics.log_metrics(agent_metrics)
+                usage_collector.collect(agent_metrics)
+        except Exception as e:
+            if dial_task is None:
+                raise
+            logger.exception(f"could not set up the call to {customer_phone}: {e}")
+            await cancel_dial(ctx, metadict, dial_task)
+            ctx.shutdown()
+            return
+
+        if dial_task is not None:
+            prime_task: asyncio.Task | None = None
+            if (
+                isinstance(agent, VoicePipelineAgent)
+                and agent_settings.prime_prompt_cache
+            ):
+                prime_task = asyncio.create_task(
+                    prime_prompt_cache(agent.llm, initial_ctx, agent.fnc_ctx)
+                )
+
+            answer_latency.attach(agent)
+            voice_agent = agent
+
+            async def log_answer_latency():
+                if prime_task is not None:
+                    prime_task.cancel()
+                if isinstance(voice_agent, VoicePipelineAgent) and isinstance(
+                    voice_agent.tts, GreetingTTS
+                ):
+                    answer_latency.greeting_prepared = voice_agent.tts.hit
+                answer_latency.log_report()
+
+            ctx.add_shutdown_callback(log_answer_latency)
+
+            try:
+                await dial_task
+            except Exception as e:
+                logger.error(f"outbound call to {customer_phone} failed: {e}")
+                ctx.shutdown()
+                return
+
+            answer_latency.answered()
+            participant = await ctx.wait_for_participant()
+            fnc_ctx.participant = participant
+            logger.info(
+                f"starting voice assistant for participant {participant.identity}"
             )
 
-        usage_collector = metrics.UsageCollector()
+        amd_decision: AMDDecision | None = None
+        attempt_id = metadict.get("attempt_id", None)
+        if attempt_id is not None:
 
-        @agent.on("metrics_collected")
-        def on_metrics_collected(agent_metrics: metrics.AgentMetrics):
-            metrics.log_metrics(agent_metrics)
-            usage_collector.collect(agent_metrics)
+            async def finish_campaign_attempt():
+                machine = amd_decision is not None and amd_decision.result == "machine"
+                await asyncio.to_thread(
+                    finish_attempt, attempt_id, "machine" if machine else "answered"
+                )
+
+            ctx.add_shutdown_callback(finish_campaign_attempt)
+
+        if is_outbound and agent_settings.answering_machine_detection:
+            # the agent starts and greets once the callee is known to be a person, a
+            # person answering our greeting would otherwise sound like a machine
+            async def on_answering_machine(decision: AMDDecision):
+                await fnc_ctx.hangup()
+
+            amd_decision = await detect_answering_machine(
+                participant,
+                on_machine=on_answering_machine,
+                options=AMDOptions(timeout=agent_settings.amd_timeout),
+            )
+            if amd_decision.result == "machine":
+                return
 
         agent.start(ctx.room, participant)
 
@@ -266,5 +549,5 @@ class VoiceAgent:
         else:
             await agent.say(
                 source=agent_settings.greeting_message,
-                allow_interruptions=True,
+                allow_interruptions=agent_settings.allow_interruptions,
             )
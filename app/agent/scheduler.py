@@ -0,0 +1,292 @@
+"""
+Pacing of outbound calls.
+
+Carriers cap the calls per second of a SIP trunk and reject the calls above it, so
+a burst of outbound call requests is queued here instead of dispatched at once.
+Every outbound trunk has its own queue and worker, the queue is bounded across
+trunks and a full queue rejects new calls.
+
+Every API process runs a scheduler, so the trunk's rate is kept in the database: a
+call reserves the trunk's next dispatch slot on its `outbound_trunks` row before it
+is dispatched, whichever process it was queued in. A trunk that isn't in the
+database, or a database without the shared state, falls back to a token bucket of
+the process.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Literal
+
+from livekit import api
+from loguru import logger
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.core.clients import api_clients
+from app.core.config import settings
+from app.core.database import engine
+from app.utils import make_cuid
+
+CallStatus = Literal["queued", "dispatching", "dispatched", "failed", "cancelled"]
+
+# a generic cell rate algorithm on the trunk's row, `next_dispatch_at` is when the
+# trunk is free again, a burst lets a call go that much earlier
+RESERVE_SLOT = text(
+    """
+    WITH clock AS (SELECT clock_timestamp() AT TIME ZONE 'utc' AS now)
+    UPDATE outbound_trunks AS t SET
+        next_dispatch_at = GREATEST(t.next_dispatch_at, clock.now)
+            + make_interval(secs => :interval)
+    FROM clock
+    WHERE t.livekit_sip_trunk_id = :trunk_id
+    RETURNING GREATEST(
+        0,
+        EXTRACT(EPOCH FROM t.next_dispatch_at - clock.now) - :interval * :burst
+    )
+    """
+)
+
+
+class OutboundQueueFullError(ValueError):
+    pass
+
+
+@dataclass
+class OutboundCall:
+    call_id: str
+    trunk_id: str
+    payload: dict
+    status: CallStatus = "queued"
+    queued_at: float = field(default_factory=time.time)
+    dispatched_at: float | None = None
+    room: str | None = None
+    error: str | None = None
+
+    @property
+    def wait(self) -> float:
+        """seconds spent in the queue, so far if still queued"""
+        return (self.dispatched_at or time.time()) - self.queued_at
+
+
+def check_rate(calls_per_second: float) -> float:
+    if not calls_per_second > 0:
+        raise ValueError(f"calls per second must be > 0, got {calls_per_second}")
+    return calls_per_second
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = check_rate(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token, returns the seconds to wait before it can be used"""
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+        self._tokens -= 1
+        return max(0.0, -self._tokens / self.rate)
+
+
+@dataclass
+class _Trunk:
+    bucket: TokenBucket
+    queue: asyncio.Queue[OutboundCall] = field(default_factory=asyncio.Queue)
+    waits: deque[float] = field(default_factory=lambda: deque(maxlen=100))
+    dispatched: int = 0
+    failed: int = 0
+    worker: asyncio.Task | None = None
+
+
+class OutboundCallScheduler:
+    """
+    Queues outbound calls per trunk and dispatches them to the agent workers at the
+    trunk's calls per second. The calls are kept in memory only, the last
+    `history_size` can be looked up by id.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_queue_size: int,
+        calls_per_second: float,
+        burst: int = 1,
+        history_size: int = 1000,
+    ) -> None:
+        self._max_queue_size = max_queue_size
+        self._calls_per_second = check_rate(calls_per_second)
+        self._burst = burst
+        self._history_size = history_size
+
+        self._trunks: dict[str, _Trunk] = {}
+        self._calls: OrderedDict[str, OutboundCall] = OrderedDict()
+        self._queued = 0
+
+    def submit(
+        self, *, trunk_id: str, payload: dict, calls_per_second: float | None = None
+    ) -> OutboundCall:
+        if calls_per_second is not None:
+            check_rate(calls_per_second)
+        if self._queued >= self._max_queue_size:
+            raise OutboundQueueFullError(
+                f"outbound call queue is full ({self._queued} calls waiting), retry later"
+            )
+
+        trunk = self._trunks.get(trunk_id)
+        if trunk is None:
+            trunk = _Trunk(TokenBucket(self._calls_per_second, self._burst))
+            self._trunks[trunk_id] = trunk
+        if calls_per_second is not None:
+            trunk.bucket.rate = calls_per_second
+        if trunk.worker is None or trunk.worker.done():
+            trunk.worker = asyncio.create_task(self._worker(trunk))
+
+        call_id = make_cuid("outcall_")
+        call = OutboundCall(
+            call_id=call_id,
+            trunk_id=trunk_id,
+            payload={**payload, "call_id": call_id},
+        )
+        self._remember(call)
+        trunk.queue.put_nowait(call)
+        self._queued += 1
+        return call
+
+    def _remember(self, call: OutboundCall) -> None:
+        self._calls[call.call_id] = call
+        while len(self._calls) > self._history_size:
+            oldest = next(iter(self._calls.values()))
+            if oldest.status in ("queued", "dispatching"):
+                break
+            self._calls.popitem(last=False)
+
+    def get(self, call_id: str) -> OutboundCall | None:
+        return self._calls.get(call_id)
+
+    def cancel(self, call_id: str) -> bool:
+        """
+        Drops a call that is still queued. False once its worker has taken it, the
+        call may be dialed then.
+        """
+        call = self._calls.get(call_id)
+        if call is None or call.status != "queued":
+            return False
+        call.status = "cancelled"
+        return True
+
+    def estimated_wait(self, trunk_id: str) -> float:
+        trunk = self._trunks.get(trunk_id)
+        if trunk is None:
+            return 0.0
+        return trunk.queue.qsize() / trunk.bucket.rate
+
+    def _reserve_slot(self, trunk_id: str, bucket: TokenBucket) -> float | None:
+        """Seconds to wait for the trunk's next slot, None if the trunk isn't in the db"""
+        with Session(engine) as session:
+            wait = session.execute(
+                RESERVE_SLOT,
+                {
+                    "trunk_id": trunk_id,
+                    "interval": 1 / bucket.rate,
+                    "burst": bucket.burst,
+                },
+            ).scalar()
+            session.commit()
+        return None if wait is None else float(wait)
+
+    async def _wait_for_slot(self, call: OutboundCall, trunk: _Trunk) -> float:
+        wait = None
+        if engine.dialect.name == "postgresql":
+            try:
+                wait = await asyncio.to_thread(
+                    self._reserve_slot, call.trunk_id, trunk.bucket
+                )
+            except Exception as e:
+                logger.warning(f"pacing trunk {call.trunk_id} in process only: {e}")
+        return trunk.bucket.take() if wait is None else wait
+
+    async def _worker(self, trunk: _Trunk) -> None:
+        while True:
+            call = await trunk.queue.get()
+            if call.status == "cancelled":
+                self._queued -= 1
+                continue
+            # from here the call can't be cancelled, it goes out after its slot
+            call.status = "dispatching"
+            try:
+                try:
+                    await asyncio.sleep(await self._wait_for_slot(call, trunk))
+                except asyncio.CancelledError:
+                    call.status = "queued"  # never dialed, it can still be released
+                    raise
+                await self._dispatch(call)
+                trunk.dispatched += 1
+            except Exception as e:
+                logger.exception(f"failed to dispatch outbound call {call.call_id}")
+                call.status = "failed"
+                call.error = str(e)
+                trunk.failed += 1
+            finally:
+                self._queued -= 1
+                trunk.waits.append(call.wait)
+
+    async def _dispatch(self, call: OutboundCall) -> None:
+        room = make_cuid("call-")
+        dispatch = await api_clients.livekit.agent_dispatch.create_dispatch(
+            api.CreateAgentDispatchRequest(
+                agent_name=settings.LIVEKIT_AGENT_NAME,
+                room=room,
+                metadata=json.dumps(call.payload),
+            )
+        )
+        call.status = "dispatched"
+        call.dispatched_at = time.time()
+        call.room = room
+        logger.debug(
+            f"dispatched outbound call {call.call_id} after {call.wait:.2f}s: {dispatch}"
+        )
+
+    def status(self) -> dict:
+        queued = [call for call in self._calls.values() if call.status == "queued"]
+        trunks = {}
+        for trunk_id, trunk in self._trunks.items():
+            oldest = next(
+                (call.wait for call in queued if call.trunk_id == trunk_id), 0.0
+            )
+            avg_wait = sum(trunk.waits) / len(trunk.waits) if trunk.waits else 0.0
+            trunks[trunk_id] = {
+                "queued": trunk.queue.qsize(),
+                "calls_per_second": trunk.bucket.rate,
+                "dispatched": trunk.dispatched,
+                "failed": trunk.failed,
+                "oldest_wait": oldest,
+                "avg_wait": avg_wait,
+                "estimated_wait": self.estimated_wait(trunk_id),
+            }
+        return {
+            "queued": self._queued,
+            "max_queue_size": self._max_queue_size,
+            "trunks": trunks,
+        }
+
+    async def aclose(self) -> None:
+        workers = [t.worker for t in self._trunks.values() if t.worker is not None]
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if self._queued:
+            logger.warning(f"dropping {self._queued} queued outbound calls")
+
+
+outbound_scheduler = OutboundCallScheduler(
+    max_queue_size=settings.OUTBOUND_QUEUE_SIZE,
+    calls_per_second=settings.OUTBOUND_CALLS_PER_SECOND,
+    burst=settings.OUTBOUND_CALL_BURST,
+)
@@ -1,13 +1,13 @@
-from datetime import datetime
 import os
 from typing import Literal
 from pydantic import BaseModel, Field, computed_field
 from loguru import logger
 
+from app.agent.prompt import prompt_compiler
 from app.agent.tools import ToolConfig
 
 
-AgentVoiceProvider = Literal["openai", "google"]
+AgentVoiceProvider = Literal["openai", "google", "cartesia", "elevenlabs"]
 AgentLLMProvider = Literal["openai", "google"]
 AgentTranscriberProvider = Literal["deepgram", "google", "openai"]
 
@@ -44,6 +44,85 @@ class AgentLLMProviderSettings(BaseModel):
     model: str = "gpt-4o-mini"
     temperature: float = 0.7
 
+    llm_routing: bool = False
+    """ send simple conversational turns to `fast_model`, tool-heavy or ambiguous ones to `model` """
+    fast_model: str | None = None
+    """ defaults to the provider's fast model, gpt-4o-mini or gemini-2.0-flash-lite """
+    routing_long_turn_words: int = 30
+    """ caller turns with at least this many words go to `model` """
+
+
+class AgentRealtimeSettings(BaseModel):
+    pipeline_mode: Literal["cascaded", "realtime"] = "cascaded"
+    """ realtime replaces STT -> LLM -> TTS with one speech to speech model, openai only """
+    realtime_model: str = "gpt-4o-realtime-preview"
+    realtime_voice: str = "alloy"
+
+
+class AgentTurnSettings(BaseModel):
+    allow_interruptions: bool = True
+    interrupt_speech_duration: float = 0.5
+    """ seconds of caller speech needed to interrupt the agent """
+    interrupt_min_words: int = 0
+    """ transcribed words needed to interrupt the agent """
+    min_endpointing_delay: float = 0.5
+    """ silence after the caller's last word before the agent replies """
+    max_endpointing_delay: float = 6.0
+    """ silence to wait for when the turn detector thinks the caller isn't done """
+    use_turn_detector: bool = False
+    """ wait longer when the turn detector model thinks the caller isn't done, needs `TURN_DETECTOR` on the worker """
+    adaptive_endpointing: bool = True
+    """ tune the endpointing delay per call from the caller's pauses and cut-offs """
+
+    speculative_generation: bool = False
+    """ start the LLM on stable interim transcripts, needs a streaming STT (deepgram, google) """
+    speculative_match_threshold: float = 0.9
+    """ how similar the final transcript must be to the speculated one to keep its reply """
+
+
+class AgentContextSettings(BaseModel):
+    context_token_budget: int = 6000
+    """ older turns are summarized once the chat context grows past this """
+    context_keep_recent_messages: int = 8
+    """ most recent messages that are always kept verbatim """
+    max_tool_output_tokens: int = 1000
+    """ webhook responses longer than this are truncated """
+    tool_routing: bool = False
+    """ only send the tools relevant to the current turn with each LLM request """
+    max_tools_per_turn: int = 6
+    """ tools sent per request when tool routing is on, built-in functions included """
+
+
+class AgentOutboundSettings(BaseModel):
+    answering_machine_detection: bool = False
+    """ detect voicemail from the audio on outbound calls and hang up, without the LLM, the greeting waits for the decision """
+    amd_timeout: float = 5.0
+    """ seconds of audio after which the callee is assumed to be a person and greeted """
+    max_concurrent_calls: int = 5
+    """ campaign calls of this agent in progress at once """
+    prime_prompt_cache: bool = False
+    """ send the prompt to the LLM while an outbound call rings, so it is cached by the first turn, paid on every dial even when nobody answers """
+    prepare_greeting: bool = False
+    """ synthesize the greeting while an outbound call rings, paid on every dial even when nobody answers """
+
+
+class AgentLLMFallback(BaseModel):
+    model_provider: AgentLLMProvider
+    model: str
+
+
+class AgentFallbackSettings(BaseModel):
+    llm_fallbacks: list[AgentLLMFallback] = []
+    """ tried in order after the agent's own LLM, on errors or when it is slow """
+    synth_fallbacks: list[AgentSynthSettings] = []
+    """ tried in order after the agent's own voice """
+    transcriber_fallbacks: list[AgentTranscriberProvider] = []
+    """ failed over to in order, streaming providers only """
+    llm_hedge_after: float = 1.5
+    """ seconds without a first token before the next LLM is asked as well """
+    tts_hedge_after: float = 1.0
+    """ seconds without a first audio byte before the next voice is asked as well """
+
 
 class CustomerInfo(BaseModel):
     customer_name: str | None = "N/A"
@@ -67,6 +146,11 @@ class AgentSettings(
     AgentSynthSettings,
     AgentTranscriberSettings,
     AgentLLMProviderSettings,
+    AgentRealtimeSettings,
+    AgentTurnSettings,
+    AgentContextSettings,
+    AgentFallbackSettings,
+    AgentOutboundSettings,
     AgentSecretSettings,
     # CustomerInfo,
     ToolsInfo,
@@ -101,25 +185,5 @@ class AgentSettings(
             return "English"
 
     def build_prompt(self, include_greeting: bool = True) -> str:
-        now = datetime.now()
-        prompt = f"{self.system_prompt}"
-
-        if include_greeting:
-            prompt += f"\nbegin by greeting the customer with the greeting message {self.greeting_message}"
-
-        prompt += "[Additional Instructions]: \n Remember that you're on a phone call, and your response will be converted to audio. Avoid producing lists and special characters like asterisks (*).\n"
-
-        prompt += f"""
-The call is starting at: {now.strftime("%Y-%m-%d %H:%M:%S")}.
-Avoid producing time and date information in numerical formats like "9:00 AM" or "23:25." Instead, provide them in natural language
-such as "nine o’clock," "today," or "six forty-five in the morning. 
-When mentioning email addresses, spell them out clearly. For example, "john.doe@example.com" should be pronounced as "john dot doe at example dot com. 
-"""
-
-        if self.language_code is not None:
-            prompt += f"Always speak in {self.language_name} even if the user speaks in another language or wants to use another language.\n"
-
-        # if self.customer_email or self.customer_email or self.customer_phone:
-        #     prompt += f"\n {'--' * 10} \n\n ## [Customer Information]:  \n Customer name: {self.customer_name} \n Customer email: {self.customer_email} \n Customer phone: {self.customer_phone}\n\n - Never ask of customer details since you already know them, but always ask for confirmation"
-
-        return prompt
+        """static, cacheable instructions first and the per-call parts last, see `app.agent.prompt`"""
+        return prompt_compiler.compile(self, include_greeting=include_greeting)
@@ -1,22 +1,23 @@
-import json
+from datetime import datetime, timezone
+
 from loguru import logger
 from sqlmodel import Session, select
 
+from app.agent.cache import CachedAgent, agent_cache
 from app.agent.models import AgentModel
+from app.agent.scheduler import OutboundCall, outbound_scheduler
 from app.agent.schema import AgentSettings, MakeOutboundCallInputs
 from openai import OpenAI
 
+from app.core.clients import api_clients
 from app.lk_connector.models import InboundTrunk, OutboundTrunk, PhoneNumber
 from app.utils import make_cuid
-from livekit import api
-
-from app.core.config import settings
 
 
 class AssistantService:
-    def __init__(self, session: Session) -> None:
+    def __init__(self, session: Session, client: OpenAI | None = None) -> None:
         self.session = session
-        self.client = OpenAI()
+        self.client = client or api_clients.openai
 
     async def create_agent(self, settings: AgentSettings) -> AgentModel:
         logger.debug(f"Creating agent with settings: {settings}")
@@ -56,6 +57,7 @@ class AssistantService:
                     f"Phone number {settings.agent_phone} is not connected to any account, use the `/api/connector/connect` endpoint first, then connect that number to this agent"
                 )
 
+        old_phone = None
         if not settings.agent_id:
             logger.info("Creating new agent")
             settings.agent_id = make_cuid("agent_")
@@ -70,24 +72,48 @@ class AssistantService:
             self.session.refresh(new_agent)
         else:
             logger.info(f"updating agent: {settings.agent_id}")
-            new_agent = await self.find_agent(settings.agent_id)
+            new_agent = self.session.get(AgentModel, settings.agent_id)
             if not new_agent:
                 raise ValueError(f"Agent {settings.agent_id} not found")
 
+            old_phone = new_agent.config.get("agent_phone")
             new_agent.is_active = True
             new_agent.config = settings.model_dump()
+            new_agent.updated_at = datetime.now(timezone.utc)
             self.session.add(new_agent)
             self.session.commit()
             self.session.refresh(new_agent)
 
+        # every process drops its copy, the next lookup reads the new config
+        await agent_cache.invalidate(
+            new_agent.id,
+            old_phone,
+            settings.agent_phone,
+            updated_at=new_agent.updated_at,
+        )
         return new_agent
 
     async def find_agent(self, agent_id: str) -> AgentModel | None:
-        return self.session.get(AgentModel, agent_id)
+        """The agent from the config cache, read only"""
+        return await self.find_agent_by(id=agent_id)
 
     async def find_agent_by(
         self, id: str | None = None, phone_number: str | None = None
     ) -> AgentModel | None:
+        """The agent from the config cache, read only"""
+        cached = await self._find_cached(id=id, phone_number=phone_number)
+        return cached.agent if cached else None
+
+    async def find_agent_settings(
+        self, id: str | None = None, phone_number: str | None = None
+    ) -> AgentSettings | None:
+        """The agent's validated settings, validated once per process"""
+        cached = await self._find_cached(id=id, phone_number=phone_number)
+        return cached.settings if cached else None
+
+    async def _find_cached(
+        self, id: str | None = None, phone_number: str | None = None
+    ) -> CachedAgent | None:
         statement = select(AgentModel)
         if id:
             statement = statement.where(AgentModel.id == id)
@@ -98,17 +124,25 @@ class AssistantService:
         else:
             raise ValueError("Either id or phone_number must be provided")
 
-        results = self.session.exec(statement)
-        return results.first()
+        async def load() -> AgentModel | None:
+            agent = self.session.exec(statement).first()
+            if agent is not None:
+                self.session.expunge(agent)
+            return agent
+
+        return await agent_cache.get(
+            agent_id=id, phone_number=None if id else phone_number, load=load
+        )
 
     async def find_agents(self) -> list[AgentModel]:
         statement = select(AgentModel)
         results = self.session.exec(statement)
         return results.fetchmany()  # type: ignore
 
-    async def make_outbound_call(
+    async def outbound_call_payload(
         self, agent_id: str, inputs: MakeOutboundCallInputs
-    ) -> bool:
+    ) -> tuple[OutboundTrunk, dict]:
+        """The trunk to dial from and the job metadata of an outbound call"""
         agent = await self.find_agent(agent_id)
         if not agent:
             raise ValueError(f"Agent {agent_id} not found")
@@ -137,16 +171,17 @@ class AssistantService:
             "customer_phone": inputs.to_number,
             "direction": "outbound",
         }
-        logger.debug(f"Making outbound call: {payload}")
-
-        lkapi = api.LiveKitAPI()
-        dispatch = await lkapi.agent_dispatch.create_dispatch(
-            api.CreateAgentDispatchRequest(
-                agent_name=settings.LIVEKIT_AGENT_NAME,
-                room=make_cuid("call-"),
-                metadata=json.dumps(payload),
-            )
+        return outbound_trunk, payload
+
+    async def make_outbound_call(
+        self, agent_id: str, inputs: MakeOutboundCallInputs
+    ) -> OutboundCall:
+        """Queues the call, it is dispatched at the trunk's calls per second"""
+        outbound_trunk, payload = await self.outbound_call_payload(agent_id, inputs)
+        logger.debug(f"Queueing outbound call: {payload}")
+
+        return outbound_scheduler.submit(
+            trunk_id=outbound_trunk.livekit_sip_trunk_id,
+            payload=payload,
+            calls_per_second=outbound_trunk.calls_per_second,
         )
-        logger.debug(f"created dispatch: {dispatch}")
-        await lkapi.aclose()
-        return True
@@ -0,0 +1,321 @@
+import asyncio
+import difflib
+import re
+from dataclasses import dataclass, field
+
+from livekit.agents import (
+    DEFAULT_API_CONNECT_OPTIONS,
+    APIConnectOptions,
+    llm,
+    stt,
+    utils,
+)
+from livekit.agents.pipeline import VoicePipelineAgent
+from livekit.agents.utils import AudioBuffer
+from loguru import logger
+
+from app.agent.tool_routing import ToolRouter
+
+
+def normalize_transcript(text: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s']", "", text.lower())).strip()
+
+
+def transcript_similarity(a: str, b: str) -> float:
+    a, b = normalize_transcript(a), normalize_transcript(b)
+    if a == b:
+        return 1.0
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+# ╔═╗╔╦╗╔╦╗  ┌┬┐┌─┐┌─┐┬
+# ╚═╗ ║  ║    │ ├─┤├─┘│
+# ╚═╝ ╩  ╩    ┴ ┴ ┴┴  o
+
+
+class InterimTapSTT(stt.STT):
+    """Forwards a streaming STT untouched, calling `on_interim` with every interim transcript"""
+
+    def __init__(self, inner: stt.STT, on_interim) -> None:
+        super().__init__(capabilities=inner.capabilities)
+        self._inner = inner
+        self._on_interim = on_interim
+        self._label = inner.label
+
+    async def _recognize_impl(
+        self,
+        buffer: AudioBuffer,
+        *,
+        language: str | None,
+        conn_options: APIConnectOptions,
+    ) -> stt.SpeechEvent:
+        return await self._inner.recognize(
+            buffer, language=language, conn_options=conn_options
+        )
+
+    def stream(
+        self,
+        *,
+        language: str | None = None,
+        conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS,
+    ) -> stt.RecognizeStream:
+        return _InterimTapStream(
+            stt=self,
+            inner=self._inner.stream(language=language, conn_options=conn_options),
+        )
+
+
+class _InterimTapStream(stt.RecognizeStream):
+    def __init__(self, *, stt: InterimTapSTT, inner: stt.RecognizeStream) -> None:
+        # the inner stream does its own retries
+        super().__init__(stt=stt, conn_options=APIConnectOptions(max_retry=0))
+        self._tap = stt
+        self._inner = inner
+
+    async def _run(self) -> None:
+        async def _forward_input():
+            async for data in self._input_ch:
+                if isinstance(data, self._FlushSentinel):
+                    self._inner.flush()
+                else:
+                    self._inner.push_frame(data)
+            self._inner.end_input()
+
+        forward_task = asyncio.create_task(_forward_input())
+        try:
+            async for ev in self._inner:
+                if (
+                    ev.type == stt.SpeechEventType.INTERIM_TRANSCRIPT
+                    and ev.alternatives
+                ):
+                    self._tap._on_interim(ev.alternatives[0].text)
+                self._event_ch.send_nowait(ev)
+        finally:
+            await utils.aio.gracefully_cancel(forward_task)
+            await self._inner.aclose()
+
+
+# ╦  ╦  ╔╦╗  ┌─┐┌─┐┌─┐┌─┐┬ ┬┬  ┌─┐┌┬┐┬┌─┐┌┐┌┬
+# ║  ║  ║║║  └─┐├─┘├┤ │  │ ││  ├─┤ │ ││ ││││
+# ╩═╝╩═╝╩ ╩  └─┘┴  └─┘└─┘└─┘┴─┘┴ ┴ ┴ ┴└─┘┘└┘o
+
+
+@dataclass
+class _Speculation:
+    text: str
+    num_messages: int
+    stream: llm.LLMStream
+    chunks: list[llm.ChatChunk] = field(default_factory=list)
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    done: bool = False
+    error: BaseException | None = None
+    task: asyncio.Task | None = None
+
+
+@dataclass
+class SpeculationStats:
+    started: int = 0
+    hits: int = 0
+    misses: int = 0
+    wasted_completion_tokens: int = 0
+    wasted_prompt_tokens: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        turns = self.hits + self.misses
+        return self.hits / turns if turns else 0.0
+
+
+class SpeculativeGenerator:
+    """
+    Starts the LLM on stable interim transcripts, before the final transcript and
+    end of turn. When the turn is committed, `before_llm_cb` hands the speculative
+    stream to the agent if the final transcript matches, otherwise it is cancelled
+    and a regular completion starts.
+
+    Function calls are only collected by the speculative stream, the agent executes
+    them once the stream has been accepted, so a miss never has side effects.
+    """
+
+    def __init__(
+        self,
+        *,
+        llm: llm.LLM,
+        match_threshold: float = 0.9,
+        min_stable_interims: int = 2,
+        tool_router: ToolRouter | None = None,
+    ) -> None:
+        self._llm = llm
+        self._tool_router = tool_router
+        self._match_threshold = match_threshold
+        self._min_stable_interims = min_stable_interims
+
+        self._agent: VoicePipelineAgent | None = None
+        self._last_interim = ""
+        self._stable_count = 0
+        self._current: _Speculation | None = None
+
+        self.stats = SpeculationStats()
+
+    def wrap_stt(self, inner: stt.STT) -> stt.STT:
+        if not (inner.capabilities.streaming and inner.capabilities.interim_results):
+            logger.warning(
+                f"{inner.label} has no streaming interim results, speculative generation is disabled"
+            )
+            return inner
+        return InterimTapSTT(inner, self.on_interim)
+
+    def attach(self, agent: VoicePipelineAgent) -> None:
+        self._agent = agent
+
+    def on_interim(self, text: str) -> None:
+        normalized = normalize_transcript(text)
+        if not normalized:
+            return
+
+        if normalized == self._last_interim:
+            self._stable_count += 1
+        else:
+            self._last_interim, self._stable_count = normalized, 1
+
+        if self._stable_count < self._min_stable_interims:
+            return
+        if self._current is not None and self._current.text == normalized:
+            return
+
+        self._speculate(text)
+
+    def _speculate(self, text: str) -> None:
+        if self._agent is None:
+            return
+
+        self._discard()
+
+        chat_ctx = self._agent.chat_ctx.copy()
+        chat_ctx.append(role="user", text=text)
+        speculation = _Speculation(
+            text=normalize_transcript(text),
+            num_messages=len(chat_ctx.messages),
+            stream=self._llm.chat(
+                chat_ctx=chat_ctx, fnc_ctx=self._fnc_ctx(self._agent, chat_ctx)
+            ),
+        )
+        speculation.task = asyncio.create_task(self._buffer(speculation))
+        self._current = speculation
+        self.stats.started += 1
+
+    async def _buffer(self, speculation: _Speculation) -> None:
+        try:
+            async for chunk in speculation.stream:
+                speculation.chunks.append(chunk)
+                speculation.changed.set()
+        except Exception as e:
+            speculation.error = e
+        finally:
+            speculation.done = True
+            speculation.changed.set()
+
+    def _discard(self) -> None:
+        speculation, self._current = self._current, None
+        if speculation is None:
+            return
+
+        self.stats.misses += 1
+        usage = next(
+            (chunk.usage for chunk in speculation.chunks if chunk.usage is not None),
+            None,
+        )
+        if usage is not None:
+            self.stats.wasted_completion_tokens += usage.completion_tokens
+            self.stats.wasted_prompt_tokens += usage.prompt_tokens
+        else:
+            # usage only comes with the last chunk, count deltas as tokens
+            self.stats.wasted_completion_tokens += sum(
+                1 for chunk in speculation.chunks if chunk.choices
+            )
+        asyncio.create_task(speculation.stream.aclose())
+
+    def before_llm_cb(
+        self, agent: VoicePipelineAgent, chat_ctx: llm.ChatContext
+    ) -> llm.LLMStream:
+        speculation, self._current = self._current, None
+        self._last_interim, self._stable_count = "", 0
+
+        final_text = chat_ctx.messages[-1].content if chat_ctx.messages else ""
+        if (
+            speculation is not None
+            and speculation.error is None
+            and isinstance(final_text, str)
+            and speculation.num_messages == len(chat_ctx.messages)
+            and transcript_similarity(speculation.text, final_text)
+            >= self._match_threshold
+        ):
+            self.stats.hits += 1
+            return _SpeculativeLLMStream(
+                self._llm, speculation=speculation, chat_ctx=chat_ctx
+            )
+
+        self._current = speculation
+        self._discard()
+        return agent.llm.chat(
+            chat_ctx=chat_ctx, fnc_ctx=self._fnc_ctx(agent, chat_ctx)
+        )
+
+    def _fnc_ctx(
+        self, agent: VoicePipelineAgent, chat_ctx: llm.ChatContext
+    ) -> llm.FunctionContext | None:
+        if self._tool_router is None:
+            return agent.fnc_ctx
+        return self._tool_router.route(chat_ctx)
+
+    def log_report(self) -> None:
+        stats = self.stats
+        logger.info(
+            f"speculative generation: {stats.started} started, {stats.hits} hits, "
+            f"{stats.misses} misses, hit rate {stats.hit_rate:.0%}, "
+            f"wasted {stats.wasted_completion_tokens} completion / {stats.wasted_prompt_tokens} prompt tokens"
+        )
+
+
+class _SpeculativeLLMStream(llm.LLMStream):
+    """Replays the chunks already generated by a speculation, then follows it live"""
+
+    def __init__(
+        self,
+        llm: llm.LLM,
+        *,
+        speculation: _Speculation,
+        chat_ctx: llm.ChatContext,
+    ) -> None:
+        super().__init__(
+            llm,
+            chat_ctx=chat_ctx,
+            fnc_ctx=speculation.stream.fnc_ctx,
+            conn_options=APIConnectOptions(max_retry=0),
+        )
+        self._speculation = speculation
+        # filled in by the speculative stream as it parses tool calls
+        self._function_calls_info = speculation.stream._function_calls_info
+
+    async def _run(self) -> None:
+        speculation = self._speculation
+        sent = 0
+        while True:
+            if sent < len(speculation.chunks):
+                self._event_ch.send_nowait(speculation.chunks[sent])
+                sent += 1
+                continue
+
+            if speculation.done:
+                break
+
+            speculation.changed.clear()
+            if sent == len(speculation.chunks) and not speculation.done:
+                await speculation.changed.wait()
+
+        if speculation.error is not None:
+            raise speculation.error
+
+    async def aclose(self) -> None:
+        await super().aclose()
+        await self._speculation.stream.aclose()
@@ -0,0 +1,182 @@
+import re
+from dataclasses import dataclass
+
+from livekit.agents import llm
+from livekit.agents.pipeline import VoicePipelineAgent
+from loguru import logger
+
+from app.agent.context import _content_text, estimate_tokens
+from app.agent.tools import ToolConfig
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from",
+    "get", "given", "has", "have", "i", "in", "is", "it", "me", "my", "of", "on",
+    "or", "please", "the", "this", "to", "use", "want", "when", "with", "you", "your",
+}  # fmt: skip
+
+
+def keywords(text: str) -> set[str]:
+    words = re.findall(r"[a-z0-9]+", text.lower().replace("_", " "))
+    return {_stem(word) for word in words if word not in STOPWORDS and len(word) > 1}
+
+
+def _stem(word: str) -> str:
+    # crude, but enough for "bookings" to match "booking"
+    for suffix in ("ing", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)]
+    return word
+
+
+def action_keywords(action: ToolConfig) -> set[str]:
+    return keywords(
+        " ".join(
+            [action.name, action.description, *action.keywords]
+            + [f"{k} {v.description}" for k, v in action.properties.items()]
+        )
+    )
+
+
+def schema_tokens(fnc: llm.FunctionInfo) -> int:
+    """rough size of the json schema the plugins send for a function"""
+    text = fnc.name + fnc.description
+    for arg in fnc.arguments.values():
+        text += arg.name + arg.description + '{"type": "string"}'
+    return estimate_tokens(text)
+
+
+class _RoutedFunctions(dict):
+    """
+    The plugins build the tool schemas from the values of this dict, and resolve
+    the tool calls of the LLM with `in` and `[]`. Lookups fall through to every tool
+    of the call, so a hidden tool called anyway still runs instead of failing the turn.
+    """
+
+    def __init__(self, visible: dict, all_functions: dict, on_hidden) -> None:
+        super().__init__(visible)
+        self._all = all_functions
+        self._on_hidden = on_hidden
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._all
+
+    def __missing__(self, name: str) -> llm.FunctionInfo:
+        fnc = self._all[name]
+        self._on_hidden(name)
+        return fnc
+
+
+class RoutedFunctionContext(llm.FunctionContext):
+    """A view of the call's function context exposing a subset of its tools"""
+
+    def __init__(
+        self, fnc_ctx: llm.FunctionContext, names: set[str], on_hidden
+    ) -> None:
+        super().__init__()
+        all_functions = fnc_ctx.ai_functions
+        self._fncs = _RoutedFunctions(
+            {name: fnc for name, fnc in all_functions.items() if name in names},
+            all_functions,
+            on_hidden,
+        )
+
+
+@dataclass
+class ToolRoutingStats:
+    requests: int = 0
+    exposed_tools: int = 0
+    total_tools: int = 0
+    schema_tokens_saved: int = 0
+    hidden_calls: int = 0
+
+
+class ToolRouter:
+    """
+    Picks the tools worth sending with each LLM request of a call.
+
+    The webhook actions are scored against the keywords of the last few messages,
+    matching their name, description, inputs and configured keywords. The built-in
+    functions, the best matches and the tools already used in the call are sent, the
+    rest are left out. A hidden tool the LLM calls anyway still runs, and is then
+    sent on every later turn.
+    """
+
+    def __init__(
+        self,
+        *,
+        fnc_ctx: llm.FunctionContext,
+        actions: list[ToolConfig],
+        max_tools: int = 6,
+        lookback_messages: int = 3,
+    ) -> None:
+        self._fnc_ctx = fnc_ctx
+        self._max_tools = max_tools
+        self._lookback_messages = lookback_messages
+
+        self._keywords = {action.name: action_keywords(action) for action in actions}
+        # end_call, detected_answering_machine... are always available
+        self._always = {
+            name for name in fnc_ctx.ai_functions if name not in self._keywords
+        }
+        self._used: set[str] = set()
+
+        self.stats = ToolRoutingStats()
+
+    def select(self, chat_ctx: llm.ChatContext) -> set[str]:
+        recent = chat_ctx.messages[-self._lookback_messages :]
+        words = keywords(
+            " ".join(
+                _content_text(msg.content) for msg in recent if msg.role != "system"
+            )
+        )
+        for msg in chat_ctx.messages:
+            for call in msg.tool_calls or []:
+                self._used.add(call.function_info.name)
+
+        scores = {
+            name: len(tool_words & words) for name, tool_words in self._keywords.items()
+        }
+        matches = sorted(
+            (
+                name
+                for name, score in scores.items()
+                if score > 0 and name not in self._used
+            ),
+            key=lambda name: scores[name],
+            reverse=True,
+        )
+        selected = self._always | (self._used & self._keywords.keys())
+        return selected | set(matches[: max(0, self._max_tools - len(selected))])
+
+    def route(self, chat_ctx: llm.ChatContext) -> llm.FunctionContext:
+        all_functions = self._fnc_ctx.ai_functions
+        if len(all_functions) <= self._max_tools:
+            return self._fnc_ctx
+
+        names = self.select(chat_ctx)
+        self.stats.requests += 1
+        self.stats.exposed_tools += len(names)
+        self.stats.total_tools += len(all_functions)
+        self.stats.schema_tokens_saved += sum(
+            schema_tokens(fnc)
+            for name, fnc in all_functions.items()
+            if name not in names
+        )
+        return RoutedFunctionContext(self._fnc_ctx, names, self._on_hidden)
+
+    def _on_hidden(self, name: str) -> None:
+        self.stats.hidden_calls += 1
+        self._used.add(name)
+        logger.warning(f"LLM called tool {name} that was not sent this turn")
+
+    def before_llm_cb(
+        self, agent: VoicePipelineAgent, chat_ctx: llm.ChatContext
+    ) -> llm.LLMStream:
+        return agent.llm.chat(chat_ctx=chat_ctx, fnc_ctx=self.route(chat_ctx))
+
+    def log_report(self) -> None:
+        stats = self.stats
+        logger.info(
+            f"tool routing: {stats.exposed_tools}/{stats.total_tools} tools sent over {stats.requests} requests, "
+            f"~{stats.schema_tokens_saved} schema tokens saved, {stats.hidden_calls} hidden tool calls"
+        )
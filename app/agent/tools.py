@@ -6,6 +6,8 @@ import aiohttp
 from loguru import logger
 from pydantic import BaseModel
 
+from app.agent.context import truncate_payload
+
 
 class ToolInput(BaseModel):
     required: bool = False
@@ -24,6 +26,9 @@ class ToolConfig(BaseModel):
     method: str = "GET"
     headers: dict[str, str] = dict()
 
+    # Extra words that should get this tool sent to the LLM, see `app.agent.tool_routing`
+    keywords: list[str] = []
+
 
 def create_dynamic_function(config: ToolConfig):
     """Creates a dynamic async function based on ToolConfig"""
@@ -52,7 +57,7 @@ async def dynamic_function(self, {", ".join(params)}):
                 return {{"error": str(e)}}
 
             logger.info(f"Function response: {{data}}")
-            return data
+            return self.limit_tool_output(data)
         """
 
     # Create function namespace
@@ -89,12 +94,20 @@ class CallActions(llm.FunctionContext):
         participant: rtc.RemoteParticipant,
         room: rtc.Room,
         ctx: JobContext,
+        max_tool_output_tokens: int | None = None,
     ):
         super().__init__()
         self.api = api
         self.participant = participant
         self.room = room
         self.ctx = ctx
+        self.max_tool_output_tokens = max_tool_output_tokens
+
+    def limit_tool_output(self, data):
+        """Webhook responses are sent back with every later LLM request, keep them small"""
+        if self.max_tool_output_tokens is None:
+            return data
+        return truncate_payload(data, self.max_tool_output_tokens)
 
     async def hangup(self):
         """Ends the call."""
@@ -0,0 +1,242 @@
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+import numpy as np
+import onnxruntime  # type: ignore
+from livekit.plugins import silero
+from livekit.plugins.silero.vad import VADStream
+from loguru import logger
+
+
+@dataclass
+class _VADRequest:
+    input: np.ndarray
+    """ context + window samples, shape (context_size + window_size,) """
+    state: np.ndarray
+    """ the rnn state of the calling stream, shape (2, 1, 128) """
+    future: Future
+    enqueued_at: float
+
+
+@dataclass
+class _ConcurrencyStats:
+    batches: int = 0
+    windows: int = 0
+    cpu_seconds: float = 0.0
+    wait_seconds: float = 0.0
+
+
+class VADBatcher:
+    """
+    Gathers the pending silero windows of every active call in this process and
+    runs them as one stacked ONNX inference.
+
+    Each `VADStream` calls the model from its own executor thread, so `infer` simply
+    blocks that thread until the batch containing its window has been flushed.
+    A batch is flushed as soon as every active stream has submitted, the batch is
+    full, or the oldest window has waited `max_delay` (never more than one frame).
+    """
+
+    def __init__(
+        self,
+        session: onnxruntime.InferenceSession,
+        *,
+        sample_rate: int,
+        max_batch_size: int = 64,
+        max_delay: float = 0.005,
+    ) -> None:
+        self._sess = session
+        self._sample_rate_nd = np.array(sample_rate, dtype=np.int64)
+
+        # same windowing as silero's own OnnxModel
+        self.window_size_samples = 256 if sample_rate == 8000 else 512
+        self.context_size = 32 if sample_rate == 8000 else 64
+        self.sample_rate = sample_rate
+        self.window_duration = self.window_size_samples / sample_rate
+
+        self._max_batch_size = max_batch_size
+        self._max_delay = min(max_delay, self.window_duration)
+
+        self._cond = threading.Condition()
+        self._pending: list[_VADRequest] = []
+        self._active_streams = 0
+        self._thread: threading.Thread | None = None
+
+        self._stats: dict[int, _ConcurrencyStats] = {}
+
+    def acquire(self) -> None:
+        with self._cond:
+            self._active_streams += 1
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="vad-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def release(self) -> None:
+        with self._cond:
+            self._active_streams = max(0, self._active_streams - 1)
+            self._cond.notify()
+
+    def infer(self, x: np.ndarray, state: np.ndarray) -> tuple[float, np.ndarray]:
+        """Blocks until the window has been scored, returns (probability, new rnn state)"""
+        future: Future = Future()
+        with self._cond:
+            self._pending.append(
+                _VADRequest(
+                    input=x, state=state, future=future, enqueued_at=time.monotonic()
+                )
+            )
+            self._cond.notify()
+        return future.result()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+
+                while True:
+                    waited = time.monotonic() - self._pending[0].enqueued_at
+                    if (
+                        len(self._pending) >= self._max_batch_size
+                        or len(self._pending) >= self._active_streams
+                        or waited >= self._max_delay
+                    ):
+                        break
+                    self._cond.wait(self._max_delay - waited)
+
+                batch = self._pending[: self._max_batch_size]
+                self._pending = self._pending[self._max_batch_size :]
+                concurrency = max(self._active_streams, len(batch))
+
+            self._flush(batch, concurrency)
+
+    def _flush(self, batch: list[_VADRequest], concurrency: int) -> None:
+        started_at = time.monotonic()
+        cpu_start = time.thread_time()
+        try:
+            ort_inputs = {
+                "input": np.stack([req.input for req in batch]),
+                "state": np.concatenate([req.state for req in batch], axis=1),
+                "sr": self._sample_rate_nd,
+            }
+            out, state = self._sess.run(None, ort_inputs)
+        except Exception as e:
+            for req in batch:
+                req.future.set_exception(e)
+            return
+
+        for i, req in enumerate(batch):
+            req.future.set_result((float(out[i, 0]), state[:, i : i + 1, :].copy()))
+
+        stats = self._stats.setdefault(concurrency, _ConcurrencyStats())
+        stats.batches += 1
+        stats.windows += len(batch)
+        stats.cpu_seconds += time.thread_time() - cpu_start
+        stats.wait_seconds += sum(started_at - req.enqueued_at for req in batch)
+
+    def report(self) -> list[dict]:
+        """CPU cost per call, grouped by the number of concurrent calls at inference time"""
+        rows = []
+        for concurrency, stats in sorted(self._stats.items()):
+            audio_seconds = stats.windows * self.window_duration
+            rows.append(
+                {
+                    "concurrency": concurrency,
+                    "batches": stats.batches,
+                    "avg_batch_size": stats.windows / stats.batches,
+                    "cpu_ms_per_window": stats.cpu_seconds / stats.windows * 1000,
+                    # fraction of one core spent per real-time call
+                    "cpu_per_call": stats.cpu_seconds / audio_seconds,
+                    "avg_wait_ms": stats.wait_seconds / stats.windows * 1000,
+                }
+            )
+        return rows
+
+    def log_report(self) -> None:
+        for row in self.report():
+            logger.info(
+                "vad batching @ {concurrency} calls: {batches} batches, avg batch {avg_batch_size:.1f}, "
+                "{cpu_ms_per_window:.3f}ms cpu/window, {cpu_per_call:.2%} cpu/call, "
+                "{avg_wait_ms:.2f}ms avg wait".format(**row)
+            )
+
+
+class _BatchedOnnxModel:
+    """Drop-in replacement of silero's `OnnxModel` that scores through a `VADBatcher`"""
+
+    def __init__(self, batcher: VADBatcher) -> None:
+        self._batcher = batcher
+        self._context = np.zeros(batcher.context_size, dtype=np.float32)
+        self._rnn_state = np.zeros((2, 1, 128), dtype=np.float32)
+
+    @property
+    def sample_rate(self) -> int:
+        return self._batcher.sample_rate
+
+    @property
+    def window_size_samples(self) -> int:
+        return self._batcher.window_size_samples
+
+    @property
+    def context_size(self) -> int:
+        return self._batcher.context_size
+
+    def __call__(self, x: np.ndarray) -> float:
+        inputs = np.concatenate([self._context, x])
+        p, self._rnn_state = self._batcher.infer(inputs, self._rnn_state)
+        self._context = inputs[-self.context_size :]
+        return p
+
+
+_batchers: dict[int, VADBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def get_vad_batcher(sample_rate: int) -> VADBatcher | None:
+    return _batchers.get(sample_rate)
+
+
+class BatchedVAD(silero.VAD):
+    """
+    Silero VAD whose streams share one process-wide `VADBatcher`.
+
+    Only useful when several calls run in the same process, i.e. with the
+    thread job executor.
+    """
+
+    _batcher: VADBatcher
+
+    @classmethod
+    def load(  # type: ignore[override]
+        cls,
+        *,
+        max_batch_size: int = 64,
+        max_batch_delay: float = 0.005,
+        **kwargs,
+    ) -> "BatchedVAD":
+        vad = super().load(**kwargs)
+        sample_rate = vad._opts.sample_rate
+
+        with _batchers_lock:
+            if sample_rate not in _batchers:
+                _batchers[sample_rate] = VADBatcher(
+                    vad._onnx_session,
+                    sample_rate=sample_rate,
+                    max_batch_size=max_batch_size,
+                    max_delay=max_batch_delay,
+                )
+            vad._batcher = _batchers[sample_rate]
+
+        return vad  # type: ignore
+
+    def stream(self) -> VADStream:
+        batcher = self._batcher
+        stream = VADStream(self, self._opts, _BatchedOnnxModel(batcher))  # type: ignore
+        batcher.acquire()
+        stream._task.add_done_callback(lambda _: batcher.release())
+        self._streams.add(stream)
+        return stream
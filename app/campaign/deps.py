@@ -0,0 +1,11 @@
+from typing_extensions import Annotated
+from app.campaign.service import CampaignService
+from app.core.database import DatabaseSessionType
+from fastapi import Depends
+
+
+def create_campaign_service(session: DatabaseSessionType) -> CampaignService:
+    return CampaignService(session)
+
+
+CampaignServiceType = Annotated[CampaignService, Depends(create_campaign_service)]
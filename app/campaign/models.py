@@ -0,0 +1,56 @@
+from datetime import datetime
+from typing import Literal
+
+from sqlalchemy import Index, UniqueConstraint
+from sqlalchemy.dialects import postgresql
+from sqlmodel import Column, Field
+
+from app.core.database import BaseTable
+from app.utils import make_cuid
+
+CampaignStatus = Literal["active", "paused", "completed"]
+AttemptStatus = Literal["pending", "dialing", "completed", "failed"]
+AttemptResult = Literal["answered", "machine", "no_answer", "busy", "failed", "lost"]
+
+
+class Campaign(BaseTable, table=True):
+    __tablename__: str = "campaigns"  # type: ignore # Explicit table name
+
+    id: str = Field(default_factory=lambda: make_cuid("camp_"), primary_key=True)
+    name: str
+    agent_id: str = Field(foreign_key="agents.id", index=True)
+    status: str = Field(default="active")
+    """ `CampaignStatus`, only active campaigns are dialed """
+
+    max_attempts: int = Field(default=3)
+    """ dials per number, retried when the callee was busy or didn't answer """
+    retry_backoff_seconds: int = Field(default=600)
+    """ wait before the first retry, doubled for every later one """
+
+
+class CallAttempt(BaseTable, table=True):
+    """A number of a campaign, with the state of its latest dial"""
+
+    __tablename__: str = "call_attempts"  # type: ignore # Explicit table name
+    __table_args__ = (
+        UniqueConstraint("campaign_id", "phone_number"),
+        # the workers claim the due attempts of a campaign in this order
+        Index("ix_call_attempts_due", "campaign_id", "status", "next_attempt_at"),
+    )
+
+    id: str = Field(default_factory=lambda: make_cuid("att_"), primary_key=True)
+    campaign_id: str = Field(foreign_key="campaigns.id")
+    phone_number: str
+    variables: dict = Field(sa_column=Column(postgresql.JSON), default_factory=dict)
+    """ the other columns of the imported row, passed to the call """
+
+    status: str = Field(default="pending")
+    """ `AttemptStatus` """
+    attempts: int = Field(default=0)
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+
+    claimed_by: str | None = Field(default=None)
+    claimed_at: datetime | None = Field(default=None)
+    last_result: str | None = Field(default=None)
+    """ `AttemptResult` of the latest dial """
+    room: str | None = Field(default=None)
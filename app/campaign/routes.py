@@ -0,0 +1,62 @@
+from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from loguru import logger
+
+from app.campaign.deps import CampaignServiceType
+from app.campaign.schema import CreateCampaignInputs, UpdateCampaignStatusInputs
+from app.campaign.service import parse_import
+
+router = APIRouter(tags=["campaign"], prefix="/campaign")
+
+
+@router.post("", status_code=201)
+async def create_campaign(
+    campaign_service: CampaignServiceType, inputs: CreateCampaignInputs
+):
+    try:
+        campaign = await campaign_service.create_campaign(inputs)
+        return {"message": "campaign created successfully", "campaign": campaign}
+    except Exception as e:
+        logger.exception(f"Failed to create campaign: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@router.post("/{campaign_id}/import")
+async def import_numbers(
+    campaign_service: CampaignServiceType,
+    campaign_id: str,
+    file: UploadFile = File(...),
+):
+    """import the numbers to dial from a csv with a `phone_number` column, or a json list"""
+    try:
+        rows = parse_import(file.filename or "", await file.read())
+        return await campaign_service.import_numbers(campaign_id, rows)
+    except Exception as e:
+        logger.exception(f"Failed to import numbers: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@router.get("/{campaign_id}")
+async def find_campaign(campaign_service: CampaignServiceType, campaign_id: str):
+    campaign = await campaign_service.find_campaign(campaign_id)
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return {
+        "campaign": campaign,
+        **(await campaign_service.campaign_stats(campaign_id)),
+    }
+
+
+@router.patch("/{campaign_id}/status")
+async def set_campaign_status(
+    campaign_service: CampaignServiceType,
+    campaign_id: str,
+    inputs: UpdateCampaignStatusInputs,
+):
+    """pause or resume a campaign, calls already dialing are not affected"""
+    try:
+        campaign = await campaign_service.set_status(campaign_id, inputs.status)
+        return {"message": f"campaign {inputs.status}", "campaign": campaign}
+    except Exception as e:
+        logger.exception(f"Failed to update campaign: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
@@ -0,0 +1,14 @@
+from typing import Literal
+
+from pydantic import BaseModel
+
+
+class CreateCampaignInputs(BaseModel):
+    name: str
+    agent_id: str
+    max_attempts: int = 3
+    retry_backoff_seconds: int = 600
+
+
+class UpdateCampaignStatusInputs(BaseModel):
+    status: Literal["active", "paused"]
@@ -0,0 +1,203 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from loguru import logger
+from livekit import api
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlmodel import Session, func, select
+
+from app.agent.models import AgentModel
+from app.campaign.models import AttemptResult, CallAttempt, Campaign
+from app.campaign.schema import CreateCampaignInputs
+from app.core.database import engine
+from app.utils import make_cuid
+
+PHONE_COLUMNS = ("phone_number", "phone", "to_number")
+IMPORT_CHUNK_SIZE = 1000
+
+# SIP status codes of a dial that can be tried again later
+BUSY_SIP_CODES = {"486", "600"}
+NO_ANSWER_SIP_CODES = {"408", "480", "487"}
+
+
+def parse_import(filename: str, data: bytes) -> list[dict]:
+    """Rows of a csv file, or of a json list of objects or phone numbers"""
+    content = data.decode("utf-8-sig")
+    if filename.lower().endswith(".json"):
+        rows = json.loads(content)
+        if not isinstance(rows, list):
+            raise ValueError("json imports must be a list of rows")
+        return [row if isinstance(row, dict) else {"phone_number": row} for row in rows]
+    return list(csv.DictReader(io.StringIO(content)))
+
+
+def _phone_number(row: dict) -> str | None:
+    for column in PHONE_COLUMNS:
+        value = row.get(column)
+        if value:
+            return str(value).strip()
+    return None
+
+
+class CampaignService:
+    def __init__(self, session: Session) -> None:
+        self.session = session
+
+    async def create_campaign(self, inputs: CreateCampaignInputs) -> Campaign:
+        if not self.session.get(AgentModel, inputs.agent_id):
+            raise ValueError(f"Agent {inputs.agent_id} not found")
+
+        campaign = Campaign(**inputs.model_dump())
+        self.session.add(campaign)
+        self.session.commit()
+        self.session.refresh(campaign)
+        return campaign
+
+    async def find_campaign(self, campaign_id: str) -> Campaign | None:
+        return self.session.get(Campaign, campaign_id)
+
+    async def import_numbers(self, campaign_id: str, rows: list[dict]) -> dict:
+        """Adds the rows as pending attempts, numbers already in the campaign are skipped"""
+        if not self.session.get(Campaign, campaign_id):
+            raise ValueError(f"Campaign {campaign_id} not found")
+
+        now = datetime.utcnow()
+        attempts = []
+        invalid = 0
+        for row in rows:
+            phone_number = _phone_number(row)
+            if phone_number is None:
+                invalid += 1
+                continue
+            attempts.append(
+                {
+                    "id": make_cuid("att_"),
+                    "campaign_id": campaign_id,
+                    "phone_number": phone_number,
+                    "variables": {
+                        k: v for k, v in row.items() if k not in PHONE_COLUMNS
+                    },
+                    "status": "pending",
+                    "attempts": 0,
+                    "next_attempt_at": now,
+                    "created_at": now,
+                    "updated_at": now,
+                }
+            )
+
+        imported = 0
+        for i in range(0, len(attempts), IMPORT_CHUNK_SIZE):
+            statement = (
+                postgresql.insert(CallAttempt)
+                .values(attempts[i : i + IMPORT_CHUNK_SIZE])
+                .on_conflict_do_nothing(index_elements=["campaign_id", "phone_number"])
+            )
+            imported += self.session.execute(statement).rowcount  # type: ignore
+        self.session.commit()
+
+        logger.info(f"imported {imported} numbers into campaign {campaign_id}")
+        return {
+            "imported": imported,
+            "duplicates": len(attempts) - imported,
+            "invalid": invalid,
+        }
+
+    async def campaign_stats(self, campaign_id: str) -> dict:
+        counts = self.session.exec(
+            select(CallAttempt.status, CallAttempt.last_result, func.count())
+            .where(CallAttempt.campaign_id == campaign_id)
+            .group_by(CallAttempt.status, CallAttempt.last_result)
+        ).all()
+
+        by_status: dict[str, int] = {}
+        by_result: dict[str, int] = {}
+        for status, result, count in counts:
+            by_status[status] = by_status.get(status, 0) + count
+            if result is not None:
+                by_result[result] = by_result.get(result, 0) + count
+        return {"attempts": by_status, "results": by_result}
+
+    async def set_status(self, campaign_id: str, status: str) -> Campaign:
+        campaign = self.session.get(Campaign, campaign_id)
+        if not campaign:
+            raise ValueError(f"Campaign {campaign_id} not found")
+
+        campaign.status = status
+        self.session.add(campaign)
+        self.session.commit()
+        self.session.refresh(campaign)
+        return campaign
+
+
+# ╔═╗┌┬┐┌┬┐┌─┐┌┬┐┌─┐┌┬┐  ┬─┐┌─┐┌─┐┬ ┬┬ ┌┬┐┌─┐┬
+# ╠═╣ │  │ ├┤ │││├─┘ │   ├┬┘├┤ └─┐│ ││  │ └─┐│
+# ╩ ╩ ┴  ┴ └─┘┴ ┴┴   ┴   ┴└─└─┘└─┘└─┘┴─┘┴ └─┘o
+
+
+def classify_dial_error(e: Exception) -> AttemptResult:
+    if isinstance(e, api.TwirpError):
+        code = e.metadata.get("sip_status_code")
+        if code in BUSY_SIP_CODES:
+            return "busy"
+        if code in NO_ANSWER_SIP_CODES:
+            return "no_answer"
+    return "failed"
+
+
+def mark_answered(attempt_id: str, room: str) -> None:
+    """An answered call is never dialed again, even if its job dies before the end"""
+    with Session(engine) as session:
+        session.execute(
+            text(
+                "UPDATE call_attempts SET last_result = 'answered', room = :room, "
+                "updated_at = :now WHERE id = :id AND status = 'dialing'"
+            ),
+            {"id": attempt_id, "room": room, "now": datetime.utcnow()},
+        )
+        session.commit()
+
+
+def finish_attempt(
+    attempt_id: str, result: AttemptResult, room: str | None = None
+) -> None:
+    """
+    Records the result of a dial. Busy and unanswered numbers go back to pending
+    with an exponential backoff, until the campaign's `max_attempts`.
+    """
+    with Session(engine) as session:
+        session.execute(
+            text(
+                """
+                UPDATE call_attempts AS a SET
+                    last_result = :result,
+                    room = COALESCE(:room, a.room),
+                    updated_at = :now,
+                    status = CASE
+                        WHEN :result IN ('no_answer', 'busy')
+                            AND a.attempts < c.max_attempts THEN 'pending'
+                        WHEN :result IN ('answered', 'machine') THEN 'completed'
+                        ELSE 'failed'
+                    END,
+                    next_attempt_at = CASE
+                        WHEN :result IN ('no_answer', 'busy')
+                            AND a.attempts < c.max_attempts
+                        THEN :now + make_interval(
+                            secs => c.retry_backoff_seconds * power(2, a.attempts - 1)
+                        )
+                        ELSE a.next_attempt_at
+                    END
+                FROM campaigns AS c
+                WHERE a.id = :id AND c.id = a.campaign_id AND a.status = 'dialing'
+                """
+            ),
+            {
+                "id": attempt_id,
+                "result": result,
+                "room": room,
+                "now": datetime.utcnow(),
+            },
+        )
+        session.commit()
@@ -0,0 +1,350 @@
+"""
+Dials the numbers of the active campaigns.
+
+Every API process runs a worker, they share the work through the database. For
+each agent with due numbers, a worker locks the agent's row with SKIP LOCKED, so
+two workers never claim for the same agent at once and its `max_concurrent_calls`
+holds. It then flips a batch of due attempts to `dialing` with a single
+`UPDATE ... FOR UPDATE SKIP LOCKED RETURNING` and hands them to the outbound call
+scheduler of its process. The schedulers pace every trunk through its
+`outbound_trunks` row, so N processes still dial a trunk at its calls per second.
+The agent job records the result.
+
+A claimed attempt counts as dialed, a failed dispatch too, so a number that can't be
+dialed runs out of attempts. Only attempts that never left the process, when the
+queue is full or the worker stops, are given back uncounted. After a crash, attempts left `dialing` for
+longer than `stale_after` are marked `lost` rather than dialed again, an answered
+call is never dialed twice.
+"""
+
+import asyncio
+import os
+import socket
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from loguru import logger
+from sqlalchemy import TextClause, bindparam, text
+from sqlmodel import Session
+
+from app.agent.scheduler import (
+    OutboundCall,
+    OutboundCallScheduler,
+    OutboundQueueFullError,
+)
+from app.agent.schema import AgentOutboundSettings, MakeOutboundCallInputs
+from app.agent.service import AssistantService
+from app.core.database import engine
+
+DEFAULT_MAX_CONCURRENT_CALLS = AgentOutboundSettings.model_fields[
+    "max_concurrent_calls"
+].default
+
+DUE_AGENTS = text(
+    """
+    SELECT DISTINCT c.agent_id FROM campaigns AS c
+    WHERE c.status = 'active' AND EXISTS (
+        SELECT 1 FROM call_attempts AS a
+        WHERE a.campaign_id = c.id AND a.status = 'pending'
+            AND a.next_attempt_at <= :now
+    )
+    """
+)
+
+LOCK_AGENT = text(
+    """
+    SELECT COALESCE((config->>'max_concurrent_calls')::int, :default_cap)
+    FROM agents WHERE id = :agent_id FOR UPDATE SKIP LOCKED
+    """
+)
+
+IN_FLIGHT = text(
+    """
+    SELECT count(*) FROM call_attempts AS a
+    JOIN campaigns AS c ON c.id = a.campaign_id
+    WHERE c.agent_id = :agent_id AND a.status = 'dialing'
+    """
+)
+
+CLAIM = text(
+    """
+    UPDATE call_attempts SET
+        status = 'dialing',
+        attempts = attempts + 1,
+        claimed_by = :worker_id,
+        claimed_at = :now,
+        updated_at = :now
+    WHERE id IN (
+        SELECT a.id FROM call_attempts AS a
+        JOIN campaigns AS c ON c.id = a.campaign_id
+        WHERE c.agent_id = :agent_id AND c.status = 'active'
+            AND a.status = 'pending' AND a.next_attempt_at <= :now
+        ORDER BY a.next_attempt_at
+        LIMIT :limit
+        FOR UPDATE OF a SKIP LOCKED
+    )
+    RETURNING id, campaign_id, phone_number, variables
+    """
+)
+
+RELEASE = text(
+    """
+    UPDATE call_attempts SET
+        status = 'pending',
+        attempts = attempts - 1,
+        claimed_by = NULL,
+        claimed_at = NULL,
+        next_attempt_at = :next_attempt_at,
+        updated_at = :now
+    WHERE id IN :ids AND status = 'dialing'
+    """
+).bindparams(bindparam("ids", expanding=True))
+
+# a failed dispatch still counts as a dial, so a number that can't be dialed at all
+# runs out of attempts and its campaign completes
+RETRY_LATER = text(
+    """
+    UPDATE call_attempts AS a SET
+        status = CASE WHEN a.attempts < c.max_attempts THEN 'pending' ELSE 'failed' END,
+        last_result = 'failed',
+        claimed_by = NULL,
+        claimed_at = NULL,
+        next_attempt_at = :next_attempt_at,
+        updated_at = :now
+    FROM campaigns AS c
+    WHERE a.id IN :ids AND c.id = a.campaign_id AND a.status = 'dialing'
+    """
+).bindparams(bindparam("ids", expanding=True))
+
+RECOVER_STALE = text(
+    """
+    UPDATE call_attempts SET
+        status = CASE WHEN last_result = 'answered' THEN 'completed' ELSE 'failed' END,
+        last_result = COALESCE(last_result, 'lost'),
+        updated_at = :now
+    WHERE status = 'dialing' AND claimed_at < :stale_before
+    """
+)
+
+COMPLETE_CAMPAIGNS = text(
+    """
+    UPDATE campaigns SET status = 'completed', updated_at = :now
+    WHERE status = 'active' AND NOT EXISTS (
+        SELECT 1 FROM call_attempts AS a
+        WHERE a.campaign_id = campaigns.id AND a.status IN ('pending', 'dialing')
+    )
+    """
+)
+
+
+@dataclass
+class ClaimedAttempt:
+    id: str
+    campaign_id: str
+    phone_number: str
+    variables: dict
+
+
+class CampaignWorker:
+    def __init__(
+        self,
+        *,
+        scheduler: OutboundCallScheduler,
+        batch_size: int = 50,
+        poll_interval: float = 2.0,
+        stale_after: timedelta = timedelta(minutes=15),
+        maintenance_every: int = 30,
+    ) -> None:
+        self._scheduler = scheduler
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._stale_after = stale_after
+        self._maintenance_every = maintenance_every
+
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._queued: dict[str, OutboundCall] = {}
+        """ claimed attempts waiting in the scheduler, by attempt id """
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        # whatever the scheduler hasn't dispatched yet goes back to the queue
+        waiting = [
+            attempt_id
+            for attempt_id, call in self._queued.items()
+            if self._scheduler.cancel(call.call_id)
+        ]
+        if waiting:
+            await asyncio.to_thread(self._release, waiting, datetime.utcnow())
+            logger.info(f"released {len(waiting)} undialed campaign attempts")
+        self._queued.clear()
+
+    async def _run(self) -> None:
+        ticks = 0
+        while True:
+            try:
+                if ticks % self._maintenance_every == 0:
+                    await asyncio.to_thread(self._maintenance)
+                ticks += 1
+
+                await self._track_dispatched()
+                claimed = await asyncio.to_thread(self._claim_all)
+                for agent_id, attempts in claimed.items():
+                    await self._dispatch(agent_id, attempts)
+            except Exception:
+                logger.exception("campaign worker tick failed")
+            await asyncio.sleep(self._poll_interval)
+
+    # ┌─┐┬  ┌─┐┬┌┬┐┬┌┐┌┌─┐
+    # │  │  ├─┤│││││││││ ┬
+    # └─┘┴─┘┴ ┴┴┴ ┴┴┘└┘└─┘
+
+    def _claim_all(self) -> dict[str, list[ClaimedAttempt]]:
+        now = datetime.utcnow()
+        with Session(engine) as session:
+            agent_ids = session.execute(DUE_AGENTS, {"now": now}).scalars().all()
+
+            claimed = {}
+            for agent_id in agent_ids:
+                attempts = self._claim(session, agent_id, now)
+                if attempts:
+                    claimed[agent_id] = attempts
+            return claimed
+
+    def _claim(
+        self, session: Session, agent_id: str, now: datetime
+    ) -> list[ClaimedAttempt]:
+        """Claims the agent's due attempts in one transaction, up to its free slots"""
+        try:
+            cap = session.execute(
+                LOCK_AGENT,
+                {"agent_id": agent_id, "default_cap": DEFAULT_MAX_CONCURRENT_CALLS},
+            ).scalar()
+            if cap is None:  # another worker is claiming for this agent
+                session.rollback()
+                return []
+
+            in_flight = session.execute(IN_FLIGHT, {"agent_id": agent_id}).scalar()
+            limit = min(self._batch_size, cap - (in_flight or 0))
+            if limit <= 0:
+                session.rollback()
+                return []
+
+            rows = session.execute(
+                CLAIM,
+                {
+                    "agent_id": agent_id,
+                    "worker_id": self.worker_id,
+                    "now": now,
+                    "limit": limit,
+                },
+            ).all()
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+        return [ClaimedAttempt(*row) for row in rows]
+
+    def _release(self, attempt_ids: list[str], next_attempt_at: datetime) -> None:
+        """Puts back attempts that never left this process, they aren't counted"""
+        self._requeue(RELEASE, attempt_ids, next_attempt_at)
+
+    def _retry_later(self, attempt_ids: list[str], next_attempt_at: datetime) -> None:
+        """Puts back attempts whose dispatch failed, counted as a failed dial"""
+        self._requeue(RETRY_LATER, attempt_ids, next_attempt_at)
+
+    def _requeue(
+        self, statement: TextClause, attempt_ids: list[str], next_attempt_at: datetime
+    ) -> None:
+        with Session(engine) as session:
+            session.execute(
+                statement,
+                {
+                    "ids": attempt_ids,
+                    "next_attempt_at": next_attempt_at,
+                    "now": datetime.utcnow(),
+                },
+            )
+            session.commit()
+
+    def _maintenance(self) -> None:
+        now = datetime.utcnow()
+        with Session(engine) as session:
+            stale = session.execute(
+                RECOVER_STALE, {"now": now, "stale_before": now - self._stale_after}
+            ).rowcount  # type: ignore
+            completed = session.execute(COMPLETE_CAMPAIGNS, {"now": now}).rowcount  # type: ignore
+            session.commit()
+
+        if stale:
+            logger.warning(f"marked {stale} stale campaign attempts as lost")
+        if completed:
+            logger.info(f"{completed} campaigns completed")
+
+    # ┌┬┐┬┌─┐┬  ┬┌┐┌┌─┐
+    #  │││├─┤│  │││││ ┬
+    # ─┴┘┴┴ ┴┴─┘┴┘└┘└─┘
+
+    async def _dispatch(self, agent_id: str, attempts: list[ClaimedAttempt]) -> None:
+        try:
+            with Session(engine) as session:
+                # one lookup per batch, the attempts only differ by number
+                trunk, base_payload = await AssistantService(
+                    session
+                ).outbound_call_payload(
+                    agent_id, MakeOutboundCallInputs(to_number="")
+                )
+        except Exception as e:
+            logger.error(f"cannot dial the campaigns of agent {agent_id}: {e}")
+            await asyncio.to_thread(
+                self._retry_later,
+                [attempt.id for attempt in attempts],
+                datetime.utcnow() + self._stale_after,
+            )
+            return
+
+        rejected = []
+        for attempt in attempts:
+            payload = {
+                **base_payload,
+                "customer_phone": attempt.phone_number,
+                "campaign_id": attempt.campaign_id,
+                "attempt_id": attempt.id,
+                "variables": attempt.variables,
+            }
+            try:
+                self._queued[attempt.id] = self._scheduler.submit(
+                    trunk_id=trunk.livekit_sip_trunk_id,
+                    payload=payload,
+                    calls_per_second=trunk.calls_per_second,
+                )
+            except OutboundQueueFullError:
+                rejected.append(attempt.id)
+
+        if rejected:
+            logger.warning(
+                f"outbound queue full, released {len(rejected)} campaign attempts"
+            )
+            await asyncio.to_thread(self._release, rejected, datetime.utcnow())
+
+    async def _track_dispatched(self) -> None:
+        """Forgets the dispatched calls, the ones the scheduler failed to dispatch are retried"""
+        failed = []
+        for attempt_id, call in list(self._queued.items()):
+            if call.status in ("queued", "dispatching"):
+                continue
+            del self._queued[attempt_id]
+            if call.status == "failed":
+                failed.append(attempt_id)
+
+        if failed:
+            await asyncio.to_thread(
+                self._retry_later, failed, datetime.utcnow() + timedelta(minutes=1)
+            )
@@ -0,0 +1,95 @@
+"""
+Circuit breakers of the remote services: a service that keeps failing is skipped
+for a while instead of holding up every call that needs it.
+"""
+
+import time
+from typing import Callable, Literal
+
+from loguru import logger
+from tenacity import RetryCallState, wait_exponential
+from tenacity.wait import wait_base
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures, the service is then skipped
+    until the cooldown has passed. Every failure while open or right after it re-opens
+    the breaker with a longer cooldown, following the tenacity `wait` strategy.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_threshold: int = 3,
+        wait: wait_base = wait_exponential(multiplier=5, max=120),
+    ) -> None:
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._wait = wait
+        self.failures = 0
+        self.openings = 0
+        self.open_until = 0.0
+        """ wall clock time, so it means the same in every process """
+        self.on_change: Callable[["CircuitBreaker"], None] | None = None
+        """ called when the breaker opens or closes """
+
+    @property
+    def state(self) -> Literal["closed", "open", "half_open"]:
+        if self.openings == 0:
+            return "closed"
+        if time.time() < self.open_until:
+            return "open"
+        return "half_open"
+
+    def available(self) -> bool:
+        return self.state != "open"
+
+    def check(self) -> None:
+        """Raises `CircuitOpenError` while the breaker is open"""
+        if not self.available():
+            raise CircuitOpenError(f"{self.name} is unavailable, circuit open")
+
+    def restore(self, *, openings: int, open_until: float) -> None:
+        """Takes the state of the same breaker in another process, if it's newer"""
+        if open_until > self.open_until:
+            self.openings = max(self.openings, openings)
+            self.open_until = open_until
+
+    def record_success(self) -> None:
+        if self.openings:
+            logger.info(f"circuit breaker for {self.name} closed")
+            self.failures = 0
+            self.openings = 0
+            self.open_until = 0.0
+            if self.on_change is not None:
+                self.on_change(self)
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures < self._failure_threshold and self.openings == 0:
+            return
+
+        self.openings += 1
+        retry_state = RetryCallState(None, None, (), {})  # type: ignore
+        retry_state.attempt_number = self.openings
+        cooldown = self._wait(retry_state)
+        self.open_until = time.time() + cooldown
+        logger.warning(
+            f"circuit breaker for {self.name} opened for {cooldown:.0f}s after {self.failures} failures"
+        )
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "openings": self.openings,
+        }
@@ -0,0 +1,77 @@
+"""
+Long-lived api clients of the web app.
+
+The clients are created once, on first use, and closed with the app's lifespan. The
+LiveKit client keeps a pooled aiohttp session and the OpenAI client its httpx pool,
+so requests reuse open TLS connections instead of opening new ones every time. The
+Twilio http client is shared by the twilio clients of every account.
+Routes get the OpenAI client injected through `OpenAIClientType`, the connector jobs
+and the outbound scheduler use `api_clients.livekit` directly.
+"""
+
+import aiohttp
+from fastapi import Depends
+from livekit import api
+from openai import OpenAI
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from typing_extensions import Annotated
+
+from app.core.config import settings
+
+
+class ApiClients:
+    def __init__(self) -> None:
+        self._livekit: api.LiveKitAPI | None = None
+        self._session: aiohttp.ClientSession | None = None
+        self._openai: OpenAI | None = None
+        self._twilio_http: AsyncTwilioHttpClient | None = None
+
+    @property
+    def livekit(self) -> api.LiveKitAPI:
+        """bound to the event loop it is first used on, the app's loop"""
+        if self._livekit is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=60),
+                connector=aiohttp.TCPConnector(
+                    limit=settings.LIVEKIT_API_MAX_CONNECTIONS,
+                    keepalive_timeout=60,
+                ),
+            )
+            self._livekit = api.LiveKitAPI(session=self._session)
+        return self._livekit
+
+    @property
+    def openai(self) -> OpenAI:
+        if self._openai is None:
+            self._openai = OpenAI()
+        return self._openai
+
+    @property
+    def twilio_http(self) -> AsyncTwilioHttpClient:
+        if self._twilio_http is None:
+            self._twilio_http = AsyncTwilioHttpClient(timeout=30)
+        return self._twilio_http
+
+    async def aclose(self) -> None:
+        if self._livekit is not None:
+            await self._livekit.aclose()
+            self._livekit = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._openai is not None:
+            self._openai.close()
+            self._openai = None
+        if self._twilio_http is not None:
+            await self._twilio_http.close()
+            self._twilio_http = None
+
+
+api_clients = ApiClients()
+
+
+def get_openai_client() -> OpenAI:
+    return api_clients.openai
+
+
+OpenAIClientType = Annotated[OpenAI, Depends(get_openai_client)]
@@ -64,6 +64,10 @@ class __Settings(BaseSettings):
 
     REDIS_URL: str = Field("redis://127.0.0.1:6379")
 
+    # validated agent configs kept per process, in front of their copy in redis
+    AGENT_CACHE_SIZE: int = Field(512)
+    AGENT_CACHE_TTL: float = Field(60.0)
+
     # ╦  ┌─┐┌┬┐┌─┐┌┐┌  ╔═╗┌─┐ ┬ ┬┌─┐┌─┐┌─┐┬ ┬┬
     # ║  ├┤ ││││ ││││  ╚═╗│─┼┐│ │├┤ ├┤ ┌─┘└┬┘│
     # ╩═╝└─┘┴ ┴└─┘┘└┘  ╚═╝└─┘└└─┘└─┘└─┘└─┘ ┴ o
@@ -75,6 +79,36 @@ class __Settings(BaseSettings):
     LEMON_FREE_PLAN_ID: str = Field("")
 
     LIVEKIT_AGENT_NAME: str = "navi-inbound-agent"
+    # connections the web app keeps open to the LiveKit api
+    LIVEKIT_API_MAX_CONNECTIONS: int = Field(20)
+
+    # batch silero VAD across all calls of a worker process, runs jobs on threads
+    VAD_BATCHING: bool = Field(False)
+    VAD_BATCH_MAX_SIZE: int = Field(64)
+    VAD_BATCH_MAX_DELAY_MS: float = Field(5.0)
+
+    # load the turn detector model in the worker, for agents with `use_turn_detector`,
+    # its model files must be fetched with `download-files` first
+    TURN_DETECTOR: bool = Field(False)
+
+    # open the provider connections of a call's agent as soon as it is known
+    PREWARM_PROVIDER_CLIENTS: bool = Field(True)
+
+    # outbound calls are queued and dispatched at each trunk's calls per second
+    OUTBOUND_CALLS_PER_SECOND: float = Field(1.0, gt=0)
+    OUTBOUND_CALL_BURST: int = Field(1)
+    OUTBOUND_QUEUE_SIZE: int = Field(1000)
+
+    # connecting twilio numbers runs in the background, one job per account at a time
+    CONNECTOR_WORKERS: int = Field(4)
+    CONNECTOR_QUEUE_SIZE: int = Field(500)
+    # numbers put on a twilio trunk at once by a bulk connect
+    TWILIO_CONCURRENCY: int = Field(8)
+
+    # dial the numbers of active campaigns from this process
+    CAMPAIGN_WORKER: bool = Field(True)
+    CAMPAIGN_BATCH_SIZE: int = Field(50)
+    CAMPAIGN_POLL_INTERVAL: float = Field(2.0)
 
 
 # all ways use this settings rather than using __Settings()
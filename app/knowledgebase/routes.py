@@ -1,22 +1,23 @@
 from fastapi import APIRouter, File, HTTPException, UploadFile
 from loguru import logger
-from openai import OpenAI
 from sqlmodel import select
 
+from app.core.clients import OpenAIClientType
 from app.core.database import DatabaseSessionType
 from app.knowledgebase.models import Knowledgebase
 
 
 router = APIRouter(tags=["knowledgebase"], prefix="/knowledgebase")
 
-client = OpenAI()
-
 VECTOR_STORE_NAME = "Assistant Knowledgebase"
 
 
 @router.post("/{account_id}/upload")
 async def upload_knowledgebase(
-    session: DatabaseSessionType, account_id: str, files: list[UploadFile] = File(...)
+    session: DatabaseSessionType,
+    client: OpenAIClientType,
+    account_id: str,
+    files: list[UploadFile] = File(...),
 ):
     logger.info("Uploading knowledgebase...")
 
@@ -74,7 +75,9 @@ async def get_knowledgebase(session: DatabaseSessionType, account_id: str):
 
 
 @router.delete("/{id}")
-async def remove_knowledgebase(session: DatabaseSessionType, id: str):
+async def remove_knowledgebase(
+    session: DatabaseSessionType, client: OpenAIClientType, id: str
+):
     """Deletes the knowledgebase by id from db and from openai"""
     stmt = select(Knowledgebase).where(Knowledgebase.id == id)
     kb = session.exec(stmt).first()
@@ -0,0 +1,219 @@
+"""
+Background provisioning of Twilio numbers on LiveKit.
+
+Connecting a number talks to Twilio and LiveKit for several seconds, so the
+connect endpoint only queues a job and returns its id. A bounded pool of workers
+runs the jobs. The jobs of an account run one after the other, since they edit the
+same trunks, while different accounts are provisioned in parallel. Every job
+records the steps it went through, for the status endpoint. A bulk job connects
+many numbers of an account with a single LiveKit update.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Literal
+
+from loguru import logger
+from sqlmodel import Session
+
+from app.core.clients import api_clients
+from app.core.config import settings
+from app.core.database import engine
+from app.utils import make_cuid
+from lk_twilio_connector import (
+    BulkConnectParams,
+    ConnectParams,
+    connect_twilio_numbers_to_livekit,
+)
+
+JobStatus = Literal["queued", "running", "succeeded", "failed"]
+
+
+class ProvisioningQueueFullError(ValueError):
+    pass
+
+
+@dataclass
+class JobStep:
+    name: str
+    started_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+
+
+@dataclass
+class ProvisioningJob:
+    job_id: str
+    params: BulkConnectParams
+    status: JobStatus = "queued"
+    steps: list[JobStep] = field(default_factory=list)
+    queued_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    error: str | None = None
+    failed: dict[str, str] = field(default_factory=dict)
+    """ the numbers that couldn't be connected, with their error """
+
+    def step(self, name: str) -> None:
+        """Finishes the current step and starts the next one"""
+        self._finish_step()
+        self.steps.append(JobStep(name))
+        logger.debug(f"provisioning job {self.job_id}: {name}")
+
+    def _finish_step(self) -> None:
+        if self.steps and self.steps[-1].finished_at is None:
+            self.steps[-1].finished_at = time.time()
+
+    def finish(self, error: str | None = None) -> None:
+        self._finish_step()
+        self.finished_at = time.time()
+        self.status = "failed" if error else "succeeded"
+        self.error = error
+
+    def to_dict(self) -> dict:
+        # the params hold the account's twilio credentials, they're never returned
+        return {
+            "job_id": self.job_id,
+            "account_id": self.params.account_id,
+            "phone_numbers": self.params.phone_numbers,
+            "status": self.status,
+            "step": self.steps[-1].name if self.steps else None,
+            "steps": [
+                {
+                    "name": step.name,
+                    "duration": (step.finished_at or time.time()) - step.started_at,
+                    "done": step.finished_at is not None,
+                }
+                for step in self.steps
+            ],
+            "queued_at": self.queued_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "failed": self.failed,
+        }
+
+
+class ProvisioningJobRunner:
+    """
+    Runs the provisioning jobs on `workers` workers, one job per account at a time.
+    Jobs are kept in memory only, the last `history_size` can be looked up by id.
+    """
+
+    def __init__(
+        self, *, workers: int, max_queue_size: int, history_size: int = 1000
+    ) -> None:
+        self._workers_count = workers
+        self._max_queue_size = max_queue_size
+        self._history_size = history_size
+
+        self._pending: dict[str, deque[ProvisioningJob]] = {}
+        """ the waiting jobs of every account with a job queued or running """
+        self._ready: asyncio.Queue[str] = asyncio.Queue()
+        """ accounts with a waiting job and none running """
+        self._jobs: OrderedDict[str, ProvisioningJob] = OrderedDict()
+        self._queued = 0
+        self._workers: list[asyncio.Task] = []
+
+    def submit(self, params: ConnectParams | BulkConnectParams) -> ProvisioningJob:
+        if isinstance(params, ConnectParams):
+            params = BulkConnectParams(
+                **params.model_dump(exclude={"phone_number"}),
+                phone_numbers=[params.phone_number],
+            )
+        if self._queued >= self._max_queue_size:
+            raise ProvisioningQueueFullError(
+                f"provisioning queue is full ({self._queued} jobs waiting), retry later"
+            )
+        if not self._workers:
+            self._workers = [
+                asyncio.create_task(self._worker())
+                for _ in range(self._workers_count)
+            ]
+
+        job = ProvisioningJob(job_id=make_cuid("prov_"), params=params)
+        self._remember(job)
+        self._queued += 1
+
+        account_jobs = self._pending.get(params.account_id)
+        if account_jobs is None:
+            self._pending[params.account_id] = deque([job])
+            self._ready.put_nowait(params.account_id)
+        else:
+            # the account is already queued or running, the worker picks this up next
+            account_jobs.append(job)
+        return job
+
+    def _remember(self, job: ProvisioningJob) -> None:
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > self._history_size:
+            oldest = next(iter(self._jobs.values()))
+            if oldest.finished_at is None:
+                break
+            self._jobs.popitem(last=False)
+
+    def get(self, job_id: str) -> ProvisioningJob | None:
+        return self._jobs.get(job_id)
+
+    async def _worker(self) -> None:
+        while True:
+            account_id = await self._ready.get()
+            job = self._pending[account_id].popleft()
+            self._queued -= 1
+            try:
+                await self._run(job)
+            finally:
+                if self._pending[account_id]:
+                    self._ready.put_nowait(account_id)
+                else:
+                    del self._pending[account_id]
+
+    async def _run(self, job: ProvisioningJob) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            with Session(engine) as session:
+                job.failed = await connect_twilio_numbers_to_livekit(
+                    session, job.params, api_clients.livekit, on_step=job.step
+                )
+            if len(job.failed) == len(set(job.params.phone_numbers)):
+                job.finish(
+                    error=next(iter(job.failed.values()))
+                    if len(job.failed) == 1
+                    else "no number could be connected"
+                )
+            else:
+                job.finish()
+            duration = time.time() - job.started_at
+            logger.info(
+                f"provisioned {len(job.params.phone_numbers)} numbers for "
+                f"{job.params.account_id} in {duration:.2f}s, "
+                f"{len(job.failed)} failed"
+            )
+        except Exception as e:
+            logger.exception(f"provisioning job {job.job_id} failed")
+            job.finish(error=str(e))
+
+    def status(self) -> dict:
+        running = sum(1 for job in self._jobs.values() if job.status == "running")
+        return {
+            "queued": self._queued,
+            "running": running,
+            "accounts": len(self._pending),
+            "workers": self._workers_count,
+            "max_queue_size": self._max_queue_size,
+        }
+
+    async def aclose(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        if self._queued:
+            logger.warning(f"dropping {self._queued} queued provisioning jobs")
+
+
+provisioning_jobs = ProvisioningJobRunner(
+    workers=settings.CONNECTOR_WORKERS,
+    max_queue_size=settings.CONNECTOR_QUEUE_SIZE,
+)
@@ -1,11 +1,15 @@
 import base64
 from datetime import datetime
 from sqlmodel import Field, SQLModel
-from sqlalchemy import event
+from sqlalchemy import CheckConstraint, Index, event
 
 
 class InboundTrunk(SQLModel, table=True):
     __tablename__ = "inbound_trunks"  # type: ignore
+    __table_args__ = (
+        # the account's trunks, and the connector's lookup of a cached twilio trunk
+        Index("ix_inbound_trunks_account_id_twilio_sid", "account_id", "twilio_sid"),
+    )
     trunk_id: str = Field(primary_key=True)
 
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -20,6 +24,8 @@ class InboundTrunk(SQLModel, table=True):
 
     twilio_sid: str | None = Field(default=None)
     twilio_auth_token: str | None = Field(default=None)
+    twilio_domain_name: str | None = Field(default=None)
+    """ the twilio trunk's SIP domain, where the outbound trunk sends calls """
 
     sip_username: str | None = Field(default=None)
     sip_password: str | None = Field(default=None)
@@ -27,6 +33,11 @@ class InboundTrunk(SQLModel, table=True):
 
 class OutboundTrunk(SQLModel, table=True):
     __tablename__ = "outbound_trunks"  # type: ignore
+    __table_args__ = (
+        CheckConstraint(
+            "calls_per_second > 0", name="ck_outbound_trunks_calls_per_second"
+        ),
+    )
 
     inbound_trunk_id: str = Field(default=None, foreign_key="inbound_trunks.trunk_id")
     livekit_sip_trunk_id: str = Field(primary_key=True)
@@ -35,13 +46,22 @@ class OutboundTrunk(SQLModel, table=True):
     updated_at: datetime = Field(
         default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow}
     )
-    account_id: str = Field()
+    account_id: str = Field(index=True)
+
+    calls_per_second: float | None = Field(default=None, gt=0)
+    """ the carrier's limit for this trunk, `OUTBOUND_CALLS_PER_SECOND` if not set """
+    next_dispatch_at: datetime | None = Field(default=None)
+    """ when the trunk's next outbound call can go, shared by the schedulers of every process """
 
 
 class PhoneNumber(SQLModel, table=True):
     __tablename__ = "phone_numbers"  # type: ignore
     phone_number: str = Field(primary_key=True)
-    trunk_id: str = Field(default=None, foreign_key="inbound_trunks.trunk_id")
+    trunk_id: str = Field(
+        default=None, foreign_key="inbound_trunks.trunk_id", index=True
+    )
+    twilio_sid: str | None = Field(default=None)
+    """ the number's sid on twilio, set once it's on the twilio trunk """
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(
         default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow}
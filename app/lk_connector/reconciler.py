@@ -0,0 +1,421 @@
+"""
+Keeps the LiveKit SIP trunks and dispatch rule in line with the database.
+
+The desired state is built from the trunks and phone numbers in the database and
+diffed against what LiveKit lists: missing trunks are created, trunks whose numbers
+or settings drifted are updated in place, duplicates are deleted and everything
+else is left alone. Updating in place keeps the trunk ids, so inbound calls keep
+working while a number is added. Running it again without changes in the
+database makes no calls besides the listings.
+"""
+
+import asyncio
+import json
+from dataclasses import dataclass, field
+from typing import Awaitable
+
+from livekit import api
+from loguru import logger
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.lk_connector.models import InboundTrunk, OutboundTrunk, PhoneNumber
+
+INBOUND_TRUNK_NAME = "Inbound LiveKit Trunk"
+OUTBOUND_TRUNK_NAME = "Livekit Outbound Trunk"
+DISPATCH_RULE_NAME = "Inbound Dispatch Rule"
+DISPATCH_ROOM_PREFIX = "call-"
+
+
+@dataclass
+class DesiredInboundTrunk:
+    account_id: str
+    numbers: set[str]
+
+    @property
+    def metadata(self) -> str:
+        return json.dumps({"account_id": self.account_id})
+
+
+@dataclass
+class DesiredOutboundTrunk:
+    account_id: str
+    address: str | None
+    """ the twilio trunk's domain, None to keep the address of the live trunk """
+    numbers: set[str]
+    auth_username: str | None
+    auth_password: str | None
+
+    @property
+    def metadata(self) -> str:
+        return json.dumps({"account_id": self.account_id})
+
+
+@dataclass
+class ReconcileReport:
+    created: list[str] = field(default_factory=list)
+    updated: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+    inbound_trunk_ids: dict[str, str] = field(default_factory=dict)
+    outbound_trunk_ids: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.created or self.updated or self.deleted)
+
+
+def _account_id(metadata: str) -> str | None:
+    try:
+        return json.loads(metadata or "{}").get("account_id", None)
+    except json.JSONDecodeError:
+        return None
+
+
+def _keep(trunks: list, known_id: str | None):
+    """The trunk to keep among an account's trunks, the one the database knows first"""
+    return next(
+        (trunk for trunk in trunks if trunk.sip_trunk_id == known_id), trunks[0]
+    )
+
+
+class SIPReconciler:
+    def __init__(self, livekit_api: api.LiveKitAPI, session: Session) -> None:
+        self.livekit_api = livekit_api
+        self.session = session
+
+    # ┌┬┐┌─┐┌─┐┬┬─┐┌─┐┌┬┐  ┌─┐┌┬┐┌─┐┌┬┐┌─┐
+    #  ││├┤ └─┐│├┬┘├┤  ││  └─┐ │ ├─┤ │ ├┤
+    # ─┴┘└─┘└─┘┴┴└─└─┘─┴┘  └─┘ ┴ ┴ ┴ ┴ └─┘
+
+    def _inbound_trunks(self, account_ids: list[str]) -> list[InboundTrunk]:
+        return list(
+            self.session.exec(
+                select(InboundTrunk).where(
+                    InboundTrunk.account_id.in_(account_ids)  # type: ignore
+                )
+            ).all()
+        )
+
+    def desired_state(
+        self, account_ids: list[str]
+    ) -> tuple[dict[str, DesiredInboundTrunk], dict[str, DesiredOutboundTrunk]]:
+        trunks = self._inbound_trunks(account_ids)
+        trunk_ids = [trunk.trunk_id for trunk in trunks]
+        phone_numbers = self.session.exec(
+            select(PhoneNumber).where(PhoneNumber.trunk_id.in_(trunk_ids))  # type: ignore
+        ).all()
+
+        inbound: dict[str, DesiredInboundTrunk] = {}
+        outbound: dict[str, DesiredOutboundTrunk] = {}
+        for trunk in trunks:
+            numbers = {
+                number.phone_number
+                for number in phone_numbers
+                if number.trunk_id == trunk.trunk_id
+            }
+            account = inbound.setdefault(
+                trunk.account_id, DesiredInboundTrunk(trunk.account_id, set())
+            )
+            account.numbers |= numbers
+
+            # one outbound trunk per account, through its twilio trunk
+            desired = outbound.get(trunk.account_id)
+            if desired is None:
+                outbound[trunk.account_id] = DesiredOutboundTrunk(
+                    account_id=trunk.account_id,
+                    address=trunk.twilio_domain_name,
+                    numbers=set(numbers),
+                    auth_username=trunk.sip_username,
+                    auth_password=trunk.sip_password,
+                )
+            else:
+                desired.numbers |= numbers
+        return inbound, outbound
+
+    # ┬─┐┌─┐┌─┐┌─┐┌┐┌┌─┐┬┬  ┌─┐
+    # ├┬┘├┤ │  │ │││││  ││  ├┤
+    # ┴└─└─┘└─┘└─┘┘└┘└─┘┴┴─┘└─┘
+
+    async def reconcile(self, account_ids: list[str]) -> ReconcileReport:
+        """Reconciles the trunks of the given accounts, and the shared dispatch rule"""
+        inbound, outbound = self.desired_state(account_ids)
+        sip = self.livekit_api.sip
+        listed_inbound, listed_outbound, listed_rules = await asyncio.gather(
+            sip.list_inbound_trunk(api.ListSIPInboundTrunkRequest()),
+            sip.list_outbound_trunk(api.ListSIPOutboundTrunkRequest()),
+            sip.list_dispatch_rule(api.ListSIPDispatchRuleRequest()),
+        )
+
+        report = ReconcileReport()
+        # removals go first, a number moving between accounts must leave its old
+        # trunk before LiveKit accepts it on the new one, callers pass both accounts
+        removals: list[Awaitable] = []
+        changes: list[Awaitable] = []
+
+        for account_id in account_ids:
+            self._diff_inbound(
+                inbound.get(account_id, DesiredInboundTrunk(account_id, set())),
+                [
+                    t
+                    for t in listed_inbound.items
+                    if _account_id(t.metadata) == account_id
+                ],
+                report,
+                removals,
+                changes,
+            )
+            if account_id in outbound:
+                self._diff_outbound(
+                    outbound[account_id],
+                    [
+                        t
+                        for t in listed_outbound.items
+                        if _account_id(t.metadata) == account_id
+                    ],
+                    report,
+                    removals,
+                    changes,
+                )
+        self._diff_dispatch_rule(list(listed_rules.items), report, removals, changes)
+
+        await asyncio.gather(*removals)
+        await asyncio.gather(*changes)
+        self._save_trunk_ids(account_ids, report)
+
+        if report.changed:
+            logger.info(
+                f"reconciled SIP state of {account_ids}: created {report.created}, "
+                f"updated {report.updated}, deleted {report.deleted}"
+            )
+        else:
+            logger.info(f"SIP state of {account_ids} is up to date")
+        return report
+
+    def _delete_trunk(self, trunk_id: str, report: ReconcileReport) -> Awaitable:
+        report.deleted.append(trunk_id)
+        return self.livekit_api.sip.delete_trunk(
+            api.DeleteSIPTrunkRequest(sip_trunk_id=trunk_id)
+        )
+
+    def _diff_inbound(
+        self,
+        desired: DesiredInboundTrunk,
+        listed: list[api.SIPInboundTrunkInfo],
+        report: ReconcileReport,
+        removals: list[Awaitable],
+        changes: list[Awaitable],
+    ) -> None:
+        account_id = desired.account_id
+        if not desired.numbers:
+            # LiveKit needs at least one number, an account without any has no trunk
+            for trunk in listed:
+                removals.append(self._delete_trunk(trunk.sip_trunk_id, report))
+            return
+
+        if not listed:
+
+            async def create():
+                trunk = await self.livekit_api.sip.create_inbound_trunk(
+                    api.CreateSIPInboundTrunkRequest(
+                        trunk=api.SIPInboundTrunkInfo(
+                            name=INBOUND_TRUNK_NAME,
+                            numbers=sorted(desired.numbers),
+                            krisp_enabled=True,
+                            metadata=desired.metadata,
+                        )
+                    )
+                )
+                report.created.append(trunk.sip_trunk_id)
+                report.inbound_trunk_ids[account_id] = trunk.sip_trunk_id
+
+            changes.append(create())
+            return
+
+        known = self.session.exec(
+            select(InboundTrunk.livekit_sip_trunk_id).where(
+                InboundTrunk.account_id == account_id
+            )
+        ).first()
+        trunk = _keep(listed, known)
+        report.inbound_trunk_ids[account_id] = trunk.sip_trunk_id
+        for duplicate in listed:
+            if duplicate is not trunk:
+                removals.append(self._delete_trunk(duplicate.sip_trunk_id, report))
+
+        current = set(trunk.numbers)
+        remove = current - desired.numbers
+        add = desired.numbers - current
+        if remove or add or trunk.name != INBOUND_TRUNK_NAME:
+            report.updated.append(trunk.sip_trunk_id)
+        if remove:
+            removals.append(
+                self.livekit_api.sip.update_inbound_trunk_fields(
+                    trunk.sip_trunk_id, numbers=api.ListUpdate(remove=sorted(remove))
+                )
+            )
+        if add or trunk.name != INBOUND_TRUNK_NAME:
+            changes.append(
+                self.livekit_api.sip.update_inbound_trunk_fields(
+                    trunk.sip_trunk_id,
+                    numbers=api.ListUpdate(add=sorted(add)),
+                    name=INBOUND_TRUNK_NAME,
+                )
+            )
+
+    def _diff_outbound(
+        self,
+        desired: DesiredOutboundTrunk,
+        listed: list[api.SIPOutboundTrunkInfo],
+        report: ReconcileReport,
+        removals: list[Awaitable],
+        changes: list[Awaitable],
+    ) -> None:
+        account_id = desired.account_id
+        if not listed:
+            if not desired.address:
+                logger.warning(
+                    f"no SIP domain known for the trunk of {account_id}, reconnect a "
+                    "number to create its outbound trunk"
+                )
+                return
+
+            async def create():
+                trunk = await self.livekit_api.sip.create_outbound_trunk(
+                    api.CreateSIPOutboundTrunkRequest(
+                        trunk=api.SIPOutboundTrunkInfo(
+                            name=OUTBOUND_TRUNK_NAME,
+                            address=desired.address,
+                            numbers=sorted(desired.numbers),
+                            auth_username=desired.auth_username,
+                            auth_password=desired.auth_password,
+                            metadata=desired.metadata,
+                        )
+                    )
+                )
+                report.created.append(trunk.sip_trunk_id)
+                report.outbound_trunk_ids[account_id] = trunk.sip_trunk_id
+
+            changes.append(create())
+            return
+
+        known = self.session.exec(
+            select(OutboundTrunk.livekit_sip_trunk_id).where(
+                OutboundTrunk.account_id == account_id
+            )
+        ).all()
+        trunk = next(
+            (trunk for trunk in listed if trunk.sip_trunk_id in known), listed[0]
+        )
+        report.outbound_trunk_ids[account_id] = trunk.sip_trunk_id
+        for duplicate in listed:
+            if duplicate is not trunk:
+                removals.append(self._delete_trunk(duplicate.sip_trunk_id, report))
+
+        fields = {}
+        if set(trunk.numbers) != desired.numbers:
+            fields["numbers"] = sorted(desired.numbers)
+        if desired.address and trunk.address != desired.address:
+            fields["address"] = desired.address
+        if desired.auth_username and trunk.auth_username != desired.auth_username:
+            fields["auth_username"] = desired.auth_username
+            fields["auth_password"] = desired.auth_password
+        if fields:
+            report.updated.append(trunk.sip_trunk_id)
+            changes.append(
+                self.livekit_api.sip.update_outbound_trunk_fields(
+                    trunk.sip_trunk_id, **fields
+                )
+            )
+
+    def _diff_dispatch_rule(
+        self,
+        listed: list[api.SIPDispatchRuleInfo],
+        report: ReconcileReport,
+        removals: list[Awaitable],
+        changes: list[Awaitable],
+    ) -> None:
+        """One rule dispatching the agent for every trunk, other rules are left alone"""
+        desired = api.SIPDispatchRuleInfo(
+            name=DISPATCH_RULE_NAME,
+            rule=api.SIPDispatchRule(
+                dispatch_rule_individual=api.SIPDispatchRuleIndividual(
+                    room_prefix=DISPATCH_ROOM_PREFIX,
+                )
+            ),
+            room_config=api.RoomConfiguration(
+                agents=[api.RoomAgentDispatch(agent_name=settings.LIVEKIT_AGENT_NAME)]
+            ),
+        )
+
+        ours = [rule for rule in listed if rule.name == DISPATCH_RULE_NAME]
+        if not ours:
+
+            async def create():
+                rule = await self.livekit_api.sip.create_dispatch_rule(
+                    api.CreateSIPDispatchRuleRequest(
+                        name=desired.name,
+                        rule=desired.rule,
+                        room_config=desired.room_config,
+                    )
+                )
+                report.created.append(rule.sip_dispatch_rule_id)
+
+            changes.append(create())
+            return
+
+        rule, duplicates = ours[0], ours[1:]
+        for duplicate in duplicates:
+            report.deleted.append(duplicate.sip_dispatch_rule_id)
+            removals.append(
+                self.livekit_api.sip.delete_dispatch_rule(
+                    api.DeleteSIPDispatchRuleRequest(
+                        sip_dispatch_rule_id=duplicate.sip_dispatch_rule_id
+                    )
+                )
+            )
+
+        if (
+            rule.rule != desired.rule
+            or rule.room_config != desired.room_config
+            or list(rule.trunk_ids)
+        ):
+            report.updated.append(rule.sip_dispatch_rule_id)
+            changes.append(
+                self.livekit_api.sip.update_dispatch_rule(
+                    rule.sip_dispatch_rule_id, desired
+                )
+            )
+
+    def _save_trunk_ids(self, account_ids: list[str], report: ReconcileReport) -> None:
+        inbound_trunks = self._inbound_trunks(account_ids)
+        for trunk in inbound_trunks:
+            trunk_id = report.inbound_trunk_ids.get(trunk.account_id)
+            if trunk_id and trunk.livekit_sip_trunk_id != trunk_id:
+                trunk.livekit_sip_trunk_id = trunk_id
+                self.session.add(trunk)
+
+        for account_id, trunk_id in report.outbound_trunk_ids.items():
+            rows = self.session.exec(
+                select(OutboundTrunk).where(OutboundTrunk.account_id == account_id)
+            ).all()
+            if any(row.livekit_sip_trunk_id == trunk_id for row in rows):
+                stale = [row for row in rows if row.livekit_sip_trunk_id != trunk_id]
+            else:
+                inbound_trunk = next(
+                    trunk for trunk in inbound_trunks if trunk.account_id == account_id
+                )
+                self.session.add(
+                    OutboundTrunk(
+                        inbound_trunk_id=inbound_trunk.trunk_id,
+                        account_id=account_id,
+                        livekit_sip_trunk_id=trunk_id,
+                        calls_per_second=next(
+                            (r.calls_per_second for r in rows if r.calls_per_second),
+                            None,
+                        ),
+                    )
+                )
+                stale = rows
+            for row in stale:
+                self.session.delete(row)
+        self.session.commit()
@@ -1,23 +1,58 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
 from fastapi.responses import JSONResponse
 from loguru import logger
 
-from app.core.database import DatabaseSessionType
-from lk_twilio_connector import connect_custom_twilio_to_livekit, ConnectParams
+from app.lk_connector.jobs import ProvisioningQueueFullError, provisioning_jobs
+from lk_twilio_connector import BulkConnectParams, ConnectParams
 
 router = APIRouter(tags=["connector"], prefix="/connector")
 
 
-@router.patch("/connect", status_code=200)
-async def connect_twilio(session: DatabaseSessionType, inputs: ConnectParams):
+@router.patch("/connect", status_code=202)
+async def connect_twilio(inputs: ConnectParams):
+    """queues the provisioning of the number, poll the job for its progress"""
     try:
-        await connect_custom_twilio_to_livekit(session, inputs)
-        return {"message": f"{inputs.phone_number} is connected successfully"}
+        job = provisioning_jobs.submit(inputs)
+        return {
+            "message": f"{inputs.phone_number} is queued for connection",
+            "job_id": job.job_id,
+        }
+    except ProvisioningQueueFullError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)})
     except Exception as e:
-        logger.exception(f"Failed to connect account: {e}")
+        logger.exception(f"Failed to queue account connection: {e}")
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
+@router.post("/connect/bulk", status_code=202)
+async def connect_twilio_bulk(inputs: BulkConnectParams):
+    """queues the provisioning of many numbers of an account as a single job"""
+    try:
+        job = provisioning_jobs.submit(inputs)
+        return {
+            "message": f"{len(inputs.phone_numbers)} numbers are queued for connection",
+            "job_id": job.job_id,
+        }
+    except ProvisioningQueueFullError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)})
+    except Exception as e:
+        logger.exception(f"Failed to queue account connection: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+@router.get("/jobs/status")
+async def provisioning_queue_status():
+    return provisioning_jobs.status()
+
+
+@router.get("/jobs/{job_id}")
+async def provisioning_job_status(job_id: str):
+    job = provisioning_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
 @router.delete("/disconnect", status_code=200)
 async def disconnect_twilio(inputs: ConnectParams):
     try:
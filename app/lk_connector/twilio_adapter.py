@@ -0,0 +1,71 @@
+"""
+Async access to the Twilio api for the connector.
+
+The twilio client's `*_async` methods run over one pooled aiohttp session shared by
+every account, so a Twilio call never blocks the event loop and reuses open
+connections. Listings are paged and stop at the first match instead of pulling
+every trunk of the account.
+"""
+
+import os
+
+from loguru import logger
+from twilio.base.exceptions import TwilioRestException
+from twilio.rest import Client
+from twilio.rest.trunking.v1.trunk import TrunkInstance
+
+from app.core.clients import api_clients
+
+TWILIO_TRUNK_NAME = "LiveKit Trunk"
+PAGE_SIZE = 50
+
+
+class TwilioAdapter:
+    def __init__(self, account_sid: str, auth_token: str) -> None:
+        self.client = Client(
+            account_sid, auth_token, http_client=api_clients.twilio_http
+        )
+
+    async def find_trunk(self, friendly_name: str) -> TrunkInstance | None:
+        async for trunk in await self.client.trunking.v1.trunks.stream_async(
+            page_size=PAGE_SIZE
+        ):
+            if trunk.friendly_name == friendly_name:
+                return trunk
+        return None
+
+    async def create_trunk(self, friendly_name: str, sip_uri: str) -> TrunkInstance:
+        logger.info(f"Creating LiveKit Trunk on Twilio: {sip_uri}")
+        domain_name = f"livekit-trunk-{os.urandom(4).hex()}.pstn.twilio.com"
+        trunk = await self.client.trunking.v1.trunks.create_async(
+            friendly_name=friendly_name,
+            domain_name=domain_name,
+        )
+        await trunk.origination_urls.create_async(
+            sip_url=sip_uri,
+            weight=1,
+            priority=1,
+            enabled=True,
+            friendly_name="LiveKit SIP URI",
+        )
+        logger.info("Created new LiveKit Trunk.")
+        return trunk
+
+    async def find_phone_number_sid(self, phone_number: str) -> str:
+        numbers = await self.client.incoming_phone_numbers.list_async(
+            phone_number=phone_number, limit=1
+        )
+        if not numbers:
+            raise ValueError(
+                f"Phone number {phone_number} not found in your Twilio account."
+            )
+        return str(numbers[0].sid)
+
+    async def add_phone_number(self, trunk_sid: str, phone_number_sid: str) -> None:
+        await self.client.trunking.v1.trunks(trunk_sid).phone_numbers.create_async(
+            phone_number_sid=phone_number_sid
+        )
+
+
+def is_not_found(e: Exception) -> bool:
+    return isinstance(e, TwilioRestException) and e.status == 404
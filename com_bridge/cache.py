@@ -0,0 +1,94 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+_NOT_FOUND = object()
+
+
+class LookupCache:
+    """
+    Bounded TTL cache for remote lookups, with single-flight loading.
+
+    Concurrent misses for the same key share one load instead of sending identical
+    requests. A load returning None is a not-found and is cached for
+    `negative_ttl`, a load raising is not cached at all.
+    """
+
+    def __init__(
+        self, *, max_size: int = 1024, ttl: float = 60.0, negative_ttl: float = 15.0
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_load(
+        self, key: Hashable, load: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if time.monotonic() < expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return None if value is _NOT_FOUND else value
+            del self._entries[key]
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled():
+                    raise
+                # the caller loading it was cancelled, load it ourselves
+                return await self.get_or_load(key, load)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await load()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # the waiters get the error, nobody else needs to retrieve it
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            self._put(key, value)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    def _put(self, key: Hashable, value: Any) -> None:
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._entries[key] = (
+            time.monotonic() + ttl,
+            _NOT_FOUND if value is None else value,
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
@@ -1,9 +1,13 @@
+import copy
 import os
 from dotenv import load_dotenv
 import httpx
 from loguru import logger
+from tenacity import wait_fixed
 
 from app.agent.schema import AgentSettings
+from app.core.circuit_breaker import CircuitBreaker, CircuitOpenError
+from com_bridge.cache import LookupCache
 from com_bridge.schemas import AgentLookupInputs, CustomerInfo
 from mock_db.mock_agent_data import find_test_agent
 from utils.singleton import Singleton
@@ -11,41 +15,123 @@ from utils.singleton import Singleton
 load_dotenv(dotenv_path=".env.local")
 
 
+def _http2_enabled() -> bool:
+    if os.getenv("VOICECAB_HTTP2", "").lower() not in ("1", "true", "yes"):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("VOICECAB_HTTP2 is set but `h2` isn't installed, using HTTP/1.1")
+        return False
+    return True
+
+
 class VoiceCabDialer(Singleton):
+    """
+    Client of the VoiceCab API. Creating it makes no request, `start` opens the
+    connection pool and checks the API's health from the app's lifespan, and a
+    circuit breaker fails the lookups fast while the API is down.
+    """
+
     def __init__(self):
         self.test_mode = os.getenv("VOICECAB_API_TEST_MODE", False)
-        self.BASE_URL = os.environ["VOICECAB_API_URL"]
-        self.client = httpx.AsyncClient(base_url=self.BASE_URL)
-        self.ping()
+        self.BASE_URL = os.getenv("VOICECAB_API_URL", "")
+        self._client: httpx.AsyncClient | None = None
 
-    def ping(self):
-        logger.info("Pinging VoiceCab API, making sure it's healthy...")
+        # repeat callers and retries look up the same numbers, a not found is
+        # remembered for a shorter time so a new customer shows up quickly
+        cache_options = dict(
+            max_size=int(os.getenv("VOICECAB_CACHE_SIZE", 1024)),
+            ttl=float(os.getenv("VOICECAB_CACHE_TTL", 60)),
+            negative_ttl=float(os.getenv("VOICECAB_NEGATIVE_CACHE_TTL", 15)),
+        )
+        self.customers = LookupCache(**cache_options)
+        self.agents = LookupCache(**cache_options)
+        self.breaker = CircuitBreaker(
+            "VoiceCab API",
+            failure_threshold=int(os.getenv("VOICECAB_FAILURE_THRESHOLD", 5)),
+            wait=wait_fixed(float(os.getenv("VOICECAB_RESET_TIMEOUT", 30))),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            if not self.BASE_URL:
+                raise CircuitOpenError("VOICECAB_API_URL is not set")
+            self._client = httpx.AsyncClient(
+                base_url=self.BASE_URL,
+                http2=_http2_enabled(),
+                # a lookup runs during call setup, a slow API must not hold it up
+                timeout=httpx.Timeout(
+                    float(os.getenv("VOICECAB_TIMEOUT", 2.0)), connect=1.0
+                ),
+                limits=httpx.Limits(
+                    max_connections=int(os.getenv("VOICECAB_MAX_CONNECTIONS", 50)),
+                    max_keepalive_connections=20,
+                    keepalive_expiry=30,
+                ),
+            )
+        return self._client
+
+    async def start(self):
+        """Opens the connection pool and checks the API, for the app's lifespan"""
         if self.test_mode:
             return
+        if not self.BASE_URL:
+            logger.warning("VOICECAB_API_URL is not set, VoiceCab lookups are off")
+            return
+        await self.ping()
 
+    async def ping(self):
+        logger.info("Pinging VoiceCab API, making sure it's healthy...")
         try:
-            with httpx.Client(base_url=self.BASE_URL) as client:
-                res = client.get("/health")
-                res.raise_for_status()
-                logger.info("VoiceCab API is healthy")
-        except Exception:
+            res = await self._request("GET", "/health")
+            res.raise_for_status()
+            logger.info("VoiceCab API is healthy")
+        except Exception as e:
             logger.error(
-                "VoiceCab API is not healthy, subsequent calls will fail, server will not startup!"
+                f"VoiceCab API is not healthy, lookups fail until it recovers: {e}"
             )
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Sends the request through the circuit breaker. Transport errors and 5xx are
+        failures, a cancelled request says nothing about the API and isn't counted.
+        """
+        self.breaker.check()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            self.breaker.record_failure()
             raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
 
     async def lookup_customer(self, phone_number: str) -> CustomerInfo | None:
         logger.info(f"Looking up customer with phone number: {phone_number}")
         try:
-            response = await self.client.get(f"/customers/{phone_number}")
-            response.raise_for_status()
-            return CustomerInfo.model_validate(response.json())
+            customer = await self.customers.get_or_load(
+                phone_number, lambda: self._fetch_customer(phone_number)
+            )
+            return customer.model_copy() if customer else None
         except httpx.HTTPStatusError as e:
             logger.error(f"Failed to lookup customer: {e.response.text}")
         except httpx.RequestError as e:
             logger.error(f"Network error during customer lookup: {e}")
+        except CircuitOpenError as e:
+            logger.warning(f"Skipping customer lookup: {e}")
         return None
 
+    async def _fetch_customer(self, phone_number: str) -> CustomerInfo | None:
+        response = await self._request("GET", f"/customers/{phone_number}")
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return CustomerInfo.model_validate(response.json())
+
     async def lookup_agent_with(
         self, inputs: AgentLookupInputs
     ) -> AgentSettings | None:
@@ -57,15 +143,35 @@ class VoiceCabDialer(Singleton):
             return await self._test_lookup_agent_with(inputs)
 
         try:
-            response = await self.client.post("/agents/lookup", json=inputs.__dict__)
-            response.raise_for_status()
-            return response.json()
+            agent = await self.agents.get_or_load(
+                tuple(sorted(inputs.model_dump().items())),
+                lambda: self._fetch_agent(inputs),
+            )
+            return copy.deepcopy(agent)
         except httpx.HTTPStatusError as e:
             logger.error(f"Failed to lookup agent: {e.response.text}")
         except httpx.RequestError as e:
             logger.error(f"Network error during agent lookup: {e}")
+        except CircuitOpenError as e:
+            logger.warning(f"Skipping agent lookup: {e}")
         return None
 
+    async def _fetch_agent(self, inputs: AgentLookupInputs):
+        response = await self._request(
+            "POST", "/agents/lookup", json=inputs.__dict__
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def stats(self) -> dict:
+        return {
+            "customers": self.customers.stats(),
+            "agents": self.agents.stats(),
+            "circuit": self.breaker.stats(),
+        }
+
     async def _test_lookup_agent_with(self, inputs: AgentLookupInputs):
         logger.info(f"Looking up agent on TEST_MODE with criteria: {inputs}")
         return await find_test_agent(
@@ -75,7 +181,9 @@ class VoiceCabDialer(Singleton):
         )
 
     async def close(self):
-        await self.client.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
 
 voicecab_dailer = VoiceCabDialer()
@@ -1,336 +1,281 @@
 import asyncio
-import json
 import os
 import random
 import string
+from datetime import datetime
+from typing import Callable
 from dotenv import load_dotenv
 from loguru import logger
 from pydantic import BaseModel
+from pydantic import Field as PydanticField
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlmodel import SQLModel, Session, create_engine, select
-from twilio.rest import Client
-from twilio.rest.trunking.v1.trunk import TrunkInstance
-from app.core.config import settings
 
 from livekit import api
-from livekit.protocol.sip import ListSIPInboundTrunkRequest
-from livekit.protocol.sip import CreateSIPOutboundTrunkRequest, SIPOutboundTrunkInfo
 from tenacity import retry, stop_after_attempt, wait_exponential
-from app.lk_connector.models import InboundTrunk, OutboundTrunk, PhoneNumber
+from app.core.config import settings
+from app.lk_connector.models import InboundTrunk, PhoneNumber
+from app.lk_connector.reconciler import SIPReconciler
+from app.lk_connector.twilio_adapter import (
+    TWILIO_TRUNK_NAME,
+    TwilioAdapter,
+    is_not_found,
+)
 
 
 load_dotenv(dotenv_path=".env.local")
 
 
-class ConnectParams(BaseModel):
-    phone_number: str
+class TwilioAccountParams(BaseModel):
     twilio_auth_token: str
     twilio_account_sid: str
     account_id: str
 
 
-def generate_random_password(length=12):
-    chars = string.ascii_letters + string.digits + "!@#$%^&*"
-    return "".join(random.choice(chars) for _ in range(length))
-
-
-def create_twilio_trunk(
-    session: Session, client: Client, sip_uri: str
-) -> TrunkInstance:
+class ConnectParams(TwilioAccountParams):
+    phone_number: str
 
-    logger.info(f"Creating LiveKit Trunk on Twilio: {sip_uri}")
-    domain_name = f"livekit-trunk-{os.urandom(4).hex()}.pstn.twilio.com"
-    trunk = client.trunking.v1.trunks.create(
-        friendly_name="LiveKit Trunk",
-        domain_name=domain_name,
-    )
-    trunk.origination_urls.create(
-        sip_url=sip_uri,
-        weight=1,
-        priority=1,
-        enabled=True,
-        friendly_name="LiveKit SIP URI",
-    )
 
-    logger.info("Created new LiveKit Trunk.")
+class BulkConnectParams(TwilioAccountParams):
+    phone_numbers: list[str] = PydanticField(min_length=1)
 
-    return trunk
 
+def generate_random_password(length=12):
+    chars = string.ascii_letters + string.digits + "!@#$%^&*"
+    return "".join(random.choice(chars) for _ in range(length))
 
-async def _cleanup_lk_inbound_trunks(params: ConnectParams):
-    livekit_api = api.LiveKitAPI()
-    logger.info(f"Cleaning up existing inbound trunks for {params.account_id}...")
 
-    rules = await livekit_api.sip.list_sip_inbound_trunk(ListSIPInboundTrunkRequest())
+async def sync_twilio_trunk(
+    session: Session,
+    twilio: TwilioAdapter,
+    params: TwilioAccountParams,
+    sip_uri: str,
+) -> InboundTrunk:
+    """Finds or creates the account's twilio trunk and saves its sid and domain"""
+    twilio_trunk = await twilio.find_trunk(TWILIO_TRUNK_NAME)
 
-    for trunk in rules.items:
-        meta = json.loads(trunk.metadata or "{}")
-        if meta.get("account_id", None) == params.account_id:
+    if not twilio_trunk:
+        twilio_trunk = await twilio.create_trunk(TWILIO_TRUNK_NAME, sip_uri)
+        db_trunk = session.get(InboundTrunk, str(twilio_trunk.sid))
+        if db_trunk is None:
+            db_trunk = InboundTrunk(
+                trunk_id=str(twilio_trunk.sid),
+                account_id=params.account_id,
+                livekit_sip_trunk_id="",
+                sip_username=f"lk_sip_user_{os.urandom(3).hex()}",
+                sip_password=generate_random_password(),
+            )
+    else:
+        logger.info("LiveKit Trunk already exists. Using the existing trunk.")
+        logger.info(twilio_trunk.sid)
+        db_trunk = session.get(InboundTrunk, str(twilio_trunk.sid))
+        if db_trunk is None:
             logger.warning(
-                f"Deleting inbound trunk for account: {params.account_id}",
+                "LiveKit Trunk not found in database, syncing and updating..."
             )
-            await livekit_api.sip.delete_sip_trunk(
-                delete=api.DeleteSIPTrunkRequest(sip_trunk_id=trunk.sip_trunk_id)
+            db_trunk = InboundTrunk(
+                trunk_id=str(twilio_trunk.sid),
+                account_id=params.account_id,
+                livekit_sip_trunk_id="",
             )
-    await livekit_api.aclose()
-
 
-async def _cleanup_lk_dispatch_rules():
-    livekit_api = api.LiveKitAPI()
-    logger.info("Cleaning up existing dispatch rules...")
-
-    trunks = await livekit_api.sip.list_sip_dispatch_rule(
-        api.ListSIPDispatchRuleRequest()
-    )
-    for trunk in trunks.items:
-        print("-- rule --", trunk.sip_dispatch_rule_id)
-        await livekit_api.sip.delete_sip_dispatch_rule(
-            api.DeleteSIPDispatchRuleRequest(
-                sip_dispatch_rule_id=trunk.sip_dispatch_rule_id
-            )
+    db_trunk.twilio_sid = params.twilio_account_sid
+    db_trunk.twilio_auth_token = params.twilio_auth_token
+    db_trunk.twilio_domain_name = twilio_trunk.domain_name
+    session.add(db_trunk)
+    session.commit()
+    session.refresh(db_trunk)
+    return db_trunk
+
+
+def find_cached_trunk(
+    session: Session, params: TwilioAccountParams
+) -> InboundTrunk | None:
+    """The account's trunk if an earlier connect saved it, skips the twilio lookup"""
+    return session.exec(
+        select(InboundTrunk).where(
+            InboundTrunk.account_id == params.account_id,
+            InboundTrunk.twilio_sid == params.twilio_account_sid,
+            InboundTrunk.twilio_domain_name != None,  # noqa: E711
         )
-    await livekit_api.aclose()
-
-
-async def create_lk_inbound_trunk(params: ConnectParams, phone_numbers: list[str]):
-    livekit_api = api.LiveKitAPI()
-    phone_numbers = list(set(phone_numbers))
-
-    trunk = api.SIPInboundTrunkInfo(
-        name="Inbound LiveKit Trunk",
-        numbers=phone_numbers,
-        krisp_enabled=True,
-        metadata=json.dumps({"account_id": params.account_id}),
-    )
-
-    # clean up existing trunks since we'll re-create them with newly added phone numbers
-    await _cleanup_lk_inbound_trunks(params)
-
-    request = api.CreateSIPInboundTrunkRequest(trunk=trunk)
-    logger.debug(
-        "Creating inbound trunk with command: lk sip inbound create inbound_trunk.json"
-    )
-
-    trunk = await livekit_api.sip.create_sip_inbound_trunk(request)
-    logger.info(f"Created inbound trunk with SID: {trunk}")
-
-    await livekit_api.aclose()
-    return trunk.sip_trunk_id
-
-
-async def create_lk_dispatch_rule() -> api.SIPDispatchRuleInfo:
-    lkapi = api.LiveKitAPI()
-
-    logger.info("Creating inbound dispatch rule: ...")
-    request = api.CreateSIPDispatchRuleRequest(
-        name="Inbound Dispatch Rule",
-        rule=api.SIPDispatchRule(
-            dispatch_rule_individual=api.SIPDispatchRuleIndividual(
-                room_prefix="call-",
-            )
-        ),
-        room_config=api.RoomConfiguration(
-            agents=[
-                api.RoomAgentDispatch(
-                    agent_name=settings.LIVEKIT_AGENT_NAME,
-                )
-            ]
-        ),
-    )
-
-    # clean up to avoid duplicate dispatch rules
-    await _cleanup_lk_dispatch_rules()
-    dispatch = await lkapi.sip.create_sip_dispatch_rule(request)
-
-    await lkapi.aclose()
-
-    logger.info(f"Created dispatch rule with SID: {dispatch}")
-    return dispatch
+    ).first()
 
 
 async def add_phone_to_twilio_trunk(
-    client: Client, phone_number: str, livekit_trunk: TrunkInstance
-):
+    twilio: TwilioAdapter, phone_number: str, db_trunk: InboundTrunk
+) -> str:
+    """Associates the number with the trunk, returns the number's sid"""
     logger.info(
-        f"Adding phone number {phone_number} to Twilio trunk: {livekit_trunk.sid}..."
+        f"Adding phone number {phone_number} to Twilio trunk: {db_trunk.trunk_id}..."
     )
-    incoming_phone_number = client.incoming_phone_numbers.list(
-        phone_number=phone_number
+    phone_number_sid = await twilio.find_phone_number_sid(phone_number)
+    await twilio.add_phone_number(db_trunk.trunk_id, phone_number_sid)
+    logger.info(
+        f"Associated phone number {phone_number} with trunk {db_trunk.trunk_id}"
     )
-
-    if incoming_phone_number:
-        phone_number_sid = incoming_phone_number[0].sid
-        client.trunking.v1.trunks(str(livekit_trunk.sid)).phone_numbers.create(
-            phone_number_sid=phone_number_sid  # type: ignore
-        )
-        logger.info(
-            f"Associated phone number {phone_number} with trunk {livekit_trunk.sid}"
-        )
-    else:
-        raise ValueError(
-            f"Phone number {phone_number} not found in your Twilio account."
-        )
+    return phone_number_sid
 
 
-async def configure_outbound_trunk(
+async def add_phones_to_twilio_trunk(
     session: Session,
-    twilio_trunk: TrunkInstance,
-    params: ConnectParams,
+    twilio: TwilioAdapter,
+    phone_numbers: list[str],
     db_trunk: InboundTrunk,
-):
-    # create a livekit trunk for each trunk
-    livekit_api = api.LiveKitAPI()
-    trunk_phones = session.exec(
-        select(PhoneNumber).where(PhoneNumber.trunk_id == db_trunk.trunk_id)
+) -> tuple[dict[str, str], dict[str, Exception]]:
+    """
+    Associates the numbers with the trunk, `TWILIO_CONCURRENCY` at a time. Numbers
+    already on the trunk are skipped. Returns the sids of the numbers on the trunk
+    and the errors of the others.
+    """
+    known = session.exec(
+        select(PhoneNumber).where(
+            PhoneNumber.phone_number.in_(phone_numbers),  # type: ignore
+            PhoneNumber.trunk_id == db_trunk.trunk_id,
+            PhoneNumber.twilio_sid != None,  # noqa: E711
+        )
     ).all()
+    sids = {number.phone_number: str(number.twilio_sid) for number in known}
+    if sids:
+        logger.info(
+            f"{len(sids)} numbers are already on Twilio trunk {db_trunk.trunk_id}"
+        )
 
-    phone_numbers = [trunk_phone.phone_number for trunk_phone in trunk_phones]
-    meta = {"account_id": params.account_id}
-    trunk = SIPOutboundTrunkInfo(
-        name="Livekit Outbound Trunk",
-        address=twilio_trunk.domain_name,
-        numbers=phone_numbers,
-        auth_username=db_trunk.sip_username,
-        auth_password=db_trunk.sip_password,
-        metadata=json.dumps(meta),
-    )
-
-    request = CreateSIPOutboundTrunkRequest(trunk=trunk)
-
-    existing_trunks = await livekit_api.sip.list_sip_outbound_trunk(
-        api.ListSIPOutboundTrunkRequest()
-    )
+    errors: dict[str, Exception] = {}
+    limit = asyncio.Semaphore(settings.TWILIO_CONCURRENCY)
 
-    for existing_trunk in existing_trunks.items:
-        existing_trunk_meta = json.loads(existing_trunk.metadata or "{}")
-        if existing_trunk_meta.get("account_id", None) == params.account_id:
-            logger.warning(
-                f"Removing existing outbound trunk with SID: {existing_trunk.sip_trunk_id}"
-            )
-            await livekit_api.sip.delete_sip_trunk(
-                delete=api.DeleteSIPTrunkRequest(
-                    sip_trunk_id=existing_trunk.sip_trunk_id
+    async def add(phone_number: str) -> None:
+        async with limit:
+            try:
+                sids[phone_number] = await add_phone_to_twilio_trunk(
+                    twilio, phone_number, db_trunk
                 )
-            )
-
-    trunk = await livekit_api.sip.create_sip_outbound_trunk(request)
-    logger.info(f"Successfully created: {trunk}")
-
-    # save to database
-    outbound_trunk = OutboundTrunk(
-        inbound_trunk_id=db_trunk.trunk_id,
-        account_id=params.account_id,
-        livekit_sip_trunk_id=str(trunk.sip_trunk_id),
-    )
-    session.add(outbound_trunk)
-    session.commit()
-
-    await livekit_api.aclose()
+            except Exception as e:
+                errors[phone_number] = e
 
-
-# @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=5))
-async def connect_custom_twilio_to_livekit(session: Session, params: ConnectParams):
-    sip_uri = os.environ["LIVEKIT_SIP_URI"]
-    phone_number = params.phone_number
-    client = Client(params.twilio_account_sid, params.twilio_auth_token)
-
-    existing_trunks = client.trunking.v1.trunks.list()
-    twilio_trunk = next(
-        (trunk for trunk in existing_trunks if trunk.friendly_name == "LiveKit Trunk"),
-        None,
+    await asyncio.gather(
+        *(add(number) for number in phone_numbers if number not in sids)
     )
-
-    def get_create_obj(twilio_trunk):
-        inbound_trunk = InboundTrunk(
-            trunk_id=str(twilio_trunk.sid),
-            twilio_auth_token=params.twilio_auth_token,
-            twilio_sid=params.twilio_account_sid,
-            account_id=params.account_id,
-            livekit_sip_trunk_id="",
+    return sids, errors
+
+
+def save_phone_numbers(
+    session: Session, db_trunk: InboundTrunk, sids: dict[str, str]
+) -> list[str]:
+    """Upserts the numbers of the trunk in one statement, returns the accounts they moved from"""
+    if not sids:
+        return []
+    previous_accounts = session.exec(
+        select(InboundTrunk.account_id)
+        .join(PhoneNumber, PhoneNumber.trunk_id == InboundTrunk.trunk_id)  # type: ignore
+        .where(
+            PhoneNumber.phone_number.in_(list(sids)),  # type: ignore
+            InboundTrunk.account_id != db_trunk.account_id,
         )
-        return inbound_trunk
-
-    if not twilio_trunk:
-        sip_username = f"lk_sip_user_{os.urandom(3).hex()}"
-        sip_password = generate_random_password()
-
-        twilio_trunk = create_twilio_trunk(
-            session=session,
-            client=client,
-            sip_uri=sip_uri,
+        .distinct()
+    ).all()
+    dialect = postgresql if session.get_bind().dialect.name == "postgresql" else sqlite
+    now = datetime.utcnow()
+    statement = dialect.insert(PhoneNumber).values(
+        [
+            {
+                "phone_number": phone_number,
+                "trunk_id": db_trunk.trunk_id,
+                "twilio_sid": sid,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for phone_number, sid in sids.items()
+        ]
+    )
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["phone_number"],
+            set_={
+                "trunk_id": statement.excluded.trunk_id,
+                "twilio_sid": statement.excluded.twilio_sid,
+                "updated_at": statement.excluded.updated_at,
+            },
         )
-
-        inbound_trunk = get_create_obj(twilio_trunk)
-        inbound_trunk.sip_password = sip_password
-        inbound_trunk.sip_username = sip_username
-
-        session.add(inbound_trunk)
-        session.commit()
-        session.refresh(inbound_trunk)
-    else:
-        logger.info("LiveKit Trunk already exists. Using the existing trunk.")
-        logger.info(twilio_trunk.sid)
-
-    await add_phone_to_twilio_trunk(
-        client=client, phone_number=phone_number, livekit_trunk=twilio_trunk
     )
+    session.commit()
+    return sorted(previous_accounts)
 
-    # update the existing trunk in db
-    db_trunk = session.exec(
-        select(InboundTrunk).where(InboundTrunk.trunk_id == twilio_trunk.sid)
-    ).first()
 
-    if not db_trunk:
-        logger.warning("LiveKit Trunk not found in database, syncing and updating...")
+async def connect_twilio_numbers_to_livekit(
+    session: Session,
+    params: BulkConnectParams,
+    livekit_api: api.LiveKitAPI,
+    on_step: Callable[[str], None] | None = None,
+) -> dict[str, str]:
+    """
+    Puts the numbers on the account's twilio trunk, then updates the LiveKit trunks
+    and dispatch rule once for all of them. `on_step` is called with the name of
+    each step as it starts. Returns the error of every number that failed.
+    """
+    step = on_step or (lambda name: None)
+    sip_uri = os.environ["LIVEKIT_SIP_URI"]
+    phone_numbers = list(dict.fromkeys(params.phone_numbers))
+    twilio = TwilioAdapter(params.twilio_account_sid, params.twilio_auth_token)
 
-        inbound_trunk = get_create_obj(twilio_trunk)
-        session.merge(inbound_trunk)
-        session.commit()
-        session.refresh(inbound_trunk)
-        db_trunk = inbound_trunk
+    step("twilio_trunk")
+    db_trunk = find_cached_trunk(session, params)
+    if db_trunk is None:
+        db_trunk = await sync_twilio_trunk(session, twilio, params, sip_uri)
 
-    # find all phone numbers in the database and add them to the livekit trunks
-    results = session.exec(
-        select(PhoneNumber).where(PhoneNumber.trunk_id == db_trunk.trunk_id)
+    step("twilio_numbers")
+    sids, errors = await add_phones_to_twilio_trunk(
+        session, twilio, phone_numbers, db_trunk
     )
-    phone_numbers = [result.phone_number for result in results]
-    if len(phone_numbers) == 0:
-        logger.warning(
-            f"No phone numbers found in database, adding phone number: {phone_number}"
+    if any(is_not_found(e) for e in errors.values()):
+        # the cached trunk was deleted on twilio, look it up again
+        logger.warning(f"Twilio trunk {db_trunk.trunk_id} is gone, syncing again")
+        db_trunk.twilio_domain_name = None
+        session.add(db_trunk)
+        session.commit()
+        db_trunk = await sync_twilio_trunk(session, twilio, params, sip_uri)
+        sids, errors = await add_phones_to_twilio_trunk(
+            session, twilio, phone_numbers, db_trunk
         )
 
-    # add this new phone number into the list of all known phone numbers
-    # that livekit trunk should have
-    phone_numbers.append(phone_number)
-    phone_numbers = list(set(phone_numbers))
-
-    assert db_trunk is not None, "db trunk can't be none"
-
-    new_trunk_id = await create_lk_inbound_trunk(params, phone_numbers)
-    if new_trunk_id:
-        logger.info(f"Creating dispatch rule for inbound trunk: {new_trunk_id}")
-
-        await create_lk_dispatch_rule()
+    step("database")
+    # the database holds the desired state, the reconciler brings LiveKit in line
+    previous_accounts = save_phone_numbers(session, db_trunk, sids)
 
-        # add this number phone number to database
-        phone_number = PhoneNumber(
-            phone_number=phone_number, trunk_id=db_trunk.trunk_id
+    if sids:
+        step("livekit")
+        # the accounts the numbers moved from are reconciled in the same pass, so
+        # their trunks release the numbers before the new trunk claims them
+        await SIPReconciler(livekit_api, session).reconcile(
+            [params.account_id, *previous_accounts]
         )
-        session.merge(phone_number)
-        session.commit()
 
-        # update the inbound trunk
-        db_trunk.livekit_sip_trunk_id = new_trunk_id
-        session.merge(db_trunk)
-        session.commit()
-    else:
-        logger.error("Failed to create inbound trunk.")
+    for phone_number, error in errors.items():
+        logger.error(f"Failed to connect {phone_number}: {error}")
+    logger.info(
+        f"Connected {len(sids)} of {len(phone_numbers)} numbers for {params.account_id}"
+    )
+    return {phone_number: str(error) for phone_number, error in errors.items()}
+
 
-    await configure_outbound_trunk(
-        session=session,
-        db_trunk=db_trunk,
-        twilio_trunk=twilio_trunk,
-        params=params,
+# @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=5))
+async def connect_custom_twilio_to_livekit(
+    session: Session,
+    params: ConnectParams,
+    livekit_api: api.LiveKitAPI,
+    on_step: Callable[[str], None] | None = None,
+):
+    """`on_step` is called with the name of each step as it starts"""
+    errors = await connect_twilio_numbers_to_livekit(
+        session,
+        BulkConnectParams(
+            **params.model_dump(exclude={"phone_number"}),
+            phone_numbers=[params.phone_number],
+        ),
+        livekit_api,
+        on_step=on_step,
     )
+    if errors:
+        raise ValueError(errors[params.phone_number])
     logger.info("Done - no news is good news")
 
 
@@ -351,4 +296,12 @@ if __name__ == "__main__":
         twilio_auth_token=os.environ["TWILIO_AUTH_TOKEN"],
         account_id="test-account-id",
     )
-    asyncio.run(connect_custom_twilio_to_livekit(session, params))
+
+    async def main():
+        livekit_api = api.LiveKitAPI()
+        try:
+            await connect_custom_twilio_to_livekit(session, params, livekit_api)
+        finally:
+            await livekit_api.aclose()
+
+    asyncio.run(main())
@@ -1,4 +1,5 @@
 import multiprocessing
+import sys
 from contextlib import asynccontextmanager
 import os
 from pathlib import Path
@@ -11,6 +12,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from livekit.agents import (
+    JobExecutorType,
     WorkerOptions,
     WorkerType,
     cli,
@@ -18,12 +20,20 @@ from livekit.agents import (
 from loguru import logger
 from app.core.database import init_db
 from app.agent.runner import VoiceAgent
+from app.agent.providers import PROVIDER_PLUGINS, preload_plugins
+from app.agent.cache import agent_cache
+from app.agent.scheduler import outbound_scheduler
+from app.campaign.routes import router as campaign_router
+from app.campaign.worker import CampaignWorker
 from app.agent.routes import router as agent_router
 from app.knowledgebase.routes import router as kb_router
+from app.lk_connector.jobs import provisioning_jobs
 from app.lk_connector.routes import router as lk_router
 from app.logging import configure_pretty_logging
 from app.utils import use_route_names_as_operation_ids
+from app.core.clients import api_clients
 from app.core.config import settings
+from com_bridge.dialer import voicecab_dailer
 
 load_dotenv(dotenv_path=".env.local")
 
@@ -33,8 +43,27 @@ configure_pretty_logging()
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, Any]:
     await init_db()
+    await voicecab_dailer.start()
+
+    campaign_worker = None
+    if settings.CAMPAIGN_WORKER:
+        campaign_worker = CampaignWorker(
+            scheduler=outbound_scheduler,
+            batch_size=settings.CAMPAIGN_BATCH_SIZE,
+            poll_interval=settings.CAMPAIGN_POLL_INTERVAL,
+        )
+        campaign_worker.start()
+
     yield
 
+    if campaign_worker is not None:
+        await campaign_worker.aclose()
+    await outbound_scheduler.aclose()
+    await provisioning_jobs.aclose()
+    await agent_cache.aclose()
+    await voicecab_dailer.close()
+    await api_clients.aclose()
+
 
 app = FastAPI(lifespan=lifespan)
 
@@ -61,6 +90,7 @@ router_prefix = "/api"
 app.include_router(agent_router, prefix=router_prefix)
 app.include_router(kb_router, prefix=router_prefix)
 app.include_router(lk_router, prefix=router_prefix)
+app.include_router(campaign_router, prefix=router_prefix)
 
 
 @app.get("/health")
@@ -94,12 +124,36 @@ use_route_names_as_operation_ids(app)
 
 def start_agent():
     logger.info("Starting LiveKit agent worker...")
+
+    # plugins register themselves on import and that must happen on the main thread,
+    # otherwise they're imported lazily in each job process
+    if "download-files" in sys.argv:
+        preload_plugins()
+    elif settings.VAD_BATCHING:
+        preload_plugins(
+            [
+                name
+                for name in PROVIDER_PLUGINS
+                if name != "turn_detector" or settings.TURN_DETECTOR
+            ]
+        )
+    elif settings.TURN_DETECTOR:
+        # the turn detector runs in the worker's inference process, it has to be
+        # registered before the worker starts, and then needs its model files
+        preload_plugins(["turn_detector"])
+
     cli.run_app(
         WorkerOptions(
             entrypoint_fnc=VoiceAgent.entrypoint,
             prewarm_fnc=VoiceAgent.prewarm,
             worker_type=WorkerType.ROOM,
             agent_name=settings.LIVEKIT_AGENT_NAME,
+            # batched VAD only pays off when calls share a process
+            job_executor_type=(
+                JobExecutorType.THREAD
+                if settings.VAD_BATCHING
+                else JobExecutorType.PROCESS
+            ),
         ),
     )
 
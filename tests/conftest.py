@@ -0,0 +1,5 @@
+import os
+
+# the settings the app refuses to start without, the tests don't reach any of them
+for name in ["ENV", "BASE_URL", "FRONTEND_URL", "OPENAI_API_KEY"]:
+    os.environ.setdefault(name, "test")
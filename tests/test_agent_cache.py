@@ -0,0 +1,148 @@
+"""Two processes sharing the agent cache through one redis server"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import fakeredis
+
+from app.agent.cache import AgentConfigCache
+from app.agent.models import AgentModel
+
+PUBLISHED_AT = datetime(2026, 1, 1, 12, 0)
+
+
+def agent(phone: str = "+15550001", *, updated_at: datetime = PUBLISHED_AT):
+    return AgentModel(
+        id="agent_1",
+        config={"agent_phone": phone, "name": phone},
+        updated_at=updated_at,
+    )
+
+
+class Database:
+    """The agents table, counts the reads"""
+
+    def __init__(self, row: AgentModel | None) -> None:
+        self.row = row
+        self.reads = 0
+
+    async def load(self) -> AgentModel | None:
+        self.reads += 1
+        return self.row
+
+
+def run(test) -> None:
+    async def main():
+        server = fakeredis.FakeServer()
+        caches = [
+            AgentConfigCache(
+                "redis://unused", redis_client=fakeredis.FakeAsyncRedis(server=server)
+            )
+            for _ in range(2)
+        ]
+        try:
+            await test(*caches)
+        finally:
+            for cache in caches:
+                await cache.aclose()
+
+    asyncio.run(main())
+
+
+async def settle() -> None:
+    """Lets the invalidation listeners subscribe, or receive a message"""
+    for _ in range(10):
+        await asyncio.sleep(0.01)
+
+
+def test_hit_in_redis_then_in_process():
+    async def test(a: AgentConfigCache, b: AgentConfigCache):
+        db = Database(agent())
+
+        assert (await a.get(agent_id="agent_1", load=db.load)).agent.id == "agent_1"
+        assert (await b.get(agent_id="agent_1", load=db.load)).agent.id == "agent_1"
+        assert (await b.get(agent_id="agent_1", load=db.load)).agent.id == "agent_1"
+
+        assert db.reads == 1
+        assert a.stats()["misses"] == 1
+        assert b.stats()["redis_hits"] == 1 and b.stats()["hits"] == 1
+
+    run(test)
+
+
+def test_invalidate_reaches_the_other_process():
+    async def test(a: AgentConfigCache, b: AgentConfigCache):
+        db = Database(agent())
+        await a.get(agent_id="agent_1", load=db.load)
+        await b.get(agent_id="agent_1", load=db.load)
+        await settle()
+
+        db.row = agent(updated_at=PUBLISHED_AT + timedelta(minutes=1))
+        db.row.config["name"] = "published"
+        await a.invalidate("agent_1", updated_at=db.row.updated_at)
+        await settle()
+
+        cached = await b.get(agent_id="agent_1", load=db.load)
+        assert cached.agent.config["name"] == "published"
+        assert db.reads == 2
+
+    run(test)
+
+
+def test_phone_number_keys():
+    async def test(a: AgentConfigCache, b: AgentConfigCache):
+        db = Database(agent("+15550001"))
+        await a.get(agent_id="agent_1", load=db.load)
+
+        cached = await b.get(phone_number="+15550001", load=db.load)
+        assert cached.agent.id == "agent_1"
+        assert db.reads == 1
+        await settle()
+
+        # the agent moves to another number
+        db.row = agent("+15550002", updated_at=PUBLISHED_AT + timedelta(minutes=1))
+        await a.invalidate(
+            "agent_1", "+15550001", "+15550002", updated_at=db.row.updated_at
+        )
+        await settle()
+
+        nobody = Database(None)
+        assert await b.get(phone_number="+15550001", load=nobody.load) is None
+        assert nobody.reads == 1
+
+        cached = await b.get(phone_number="+15550002", load=db.load)
+        assert cached.agent.config["agent_phone"] == "+15550002"
+        assert (await a.get(phone_number="+15550002", load=db.load)).agent is not None
+        assert db.reads == 2
+
+    run(test)
+
+
+def test_a_read_from_before_the_publish_is_not_cached():
+    async def test(a: AgentConfigCache, b: AgentConfigCache):
+        old, new = agent(), agent(updated_at=PUBLISHED_AT + timedelta(minutes=1))
+        new.config["name"] = "published"
+        read, publish = asyncio.Event(), asyncio.Event()
+
+        async def slow_load() -> AgentModel:
+            read.set()  # the old row is read...
+            await publish.wait()  # ...and written back after the publish
+            return old
+
+        lookup = asyncio.create_task(a.get(agent_id="agent_1", load=slow_load))
+        await read.wait()
+        await b.invalidate("agent_1", updated_at=new.updated_at)
+        publish.set()
+        await lookup
+
+        db = Database(new)
+        cached = await b.get(agent_id="agent_1", load=db.load)
+        assert cached.agent.config["name"] == "published"
+        assert db.reads == 1
+
+        # the process that read the old row didn't keep it either
+        cached = await a.get(agent_id="agent_1", load=db.load)
+        assert cached.agent.config["name"] == "published"
+        assert db.reads == 1
+
+    run(test)
@@ -0,0 +1,393 @@
+"""
+Runs the SQL of the campaign workers against a real database.
+
+Seeds an agent, a trunk and a campaign, then goes through what two API processes
+do with it: concurrent claims under the agent's `max_concurrent_calls`, dial
+results and their retry backoff, releasing undialed attempts, failed dispatches
+running out of attempts, a worker that dies mid-call and the recovery of its stale
+attempts, completing the campaign, and the trunk pacing shared by the processes'
+schedulers. Everything it creates is deleted at the end.
+
+Usage:
+    DATABASE_URL=postgresql://... python -m utils.campaign_check
+"""
+
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, text
+from sqlmodel import Session, select
+
+from app.agent.models import AgentModel
+from app.agent.scheduler import OutboundCallScheduler, TokenBucket
+from app.campaign.models import CallAttempt, Campaign
+from app.campaign.service import CampaignService, finish_attempt, mark_answered
+from app.campaign.worker import DUE_AGENTS, LOCK_AGENT, CampaignWorker, ClaimedAttempt
+from app.core.database import engine
+from app.lk_connector.models import InboundTrunk, OutboundTrunk
+from app.utils import make_cuid
+
+MAX_CONCURRENT_CALLS = 3
+RETRY_BACKOFF_SECONDS = 60
+
+
+class CheckFailed(AssertionError):
+    pass
+
+
+def expect(condition: bool, message: str) -> None:
+    if not condition:
+        raise CheckFailed(message)
+    print(f"  ok  {message}")
+
+
+def attempts(campaign_id: str) -> dict[str, CallAttempt]:
+    with Session(engine) as session:
+        rows = session.exec(
+            select(CallAttempt).where(CallAttempt.campaign_id == campaign_id)
+        ).all()
+        return {row.phone_number: row for row in rows}
+
+
+def seed(prefix: str) -> tuple[str, str, str]:
+    now = datetime.utcnow()
+    stamps = {"created_at": now, "updated_at": now}
+    agent_id, campaign_id, trunk_id = f"{prefix}agent", f"{prefix}camp", f"{prefix}ST"
+    with Session(engine) as session:
+        session.execute(
+            insert(AgentModel),
+            [
+                {
+                    "id": agent_id,
+                    "is_active": True,
+                    "config": {"max_concurrent_calls": MAX_CONCURRENT_CALLS},
+                    **stamps,
+                }
+            ],
+        )
+        session.execute(
+            insert(InboundTrunk),
+            [
+                {
+                    "trunk_id": f"{prefix}TK",
+                    "account_id": prefix,
+                    "livekit_sip_trunk_id": f"{prefix}ST_in",
+                    **stamps,
+                }
+            ],
+        )
+        session.execute(
+            insert(OutboundTrunk),
+            [
+                {
+                    "inbound_trunk_id": f"{prefix}TK",
+                    "livekit_sip_trunk_id": trunk_id,
+                    "account_id": prefix,
+                    "calls_per_second": 4.0,
+                    **stamps,
+                }
+            ],
+        )
+        session.execute(
+            insert(Campaign),
+            [
+                {
+                    "id": campaign_id,
+                    "name": "campaign check",
+                    "agent_id": agent_id,
+                    "status": "active",
+                    "max_attempts": 3,
+                    "retry_backoff_seconds": RETRY_BACKOFF_SECONDS,
+                    **stamps,
+                }
+            ],
+        )
+        session.commit()
+    return agent_id, campaign_id, trunk_id
+
+
+def cleanup(prefix: str) -> None:
+    with Session(engine) as session:
+        session.execute(
+            delete(CallAttempt).where(
+                CallAttempt.campaign_id.startswith(prefix)  # type: ignore
+            )
+        )
+        session.execute(delete(Campaign).where(Campaign.id.startswith(prefix)))  # type: ignore
+        session.execute(
+            delete(OutboundTrunk).where(OutboundTrunk.account_id == prefix)  # type: ignore
+        )
+        session.execute(
+            delete(InboundTrunk).where(InboundTrunk.account_id == prefix)  # type: ignore
+        )
+        session.execute(delete(AgentModel).where(AgentModel.id.startswith(prefix)))  # type: ignore
+        session.commit()
+
+
+def claim(worker: CampaignWorker, agent_id: str) -> list[ClaimedAttempt]:
+    """The claim of `_claim_all`, for the seeded agent only"""
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        due = session.execute(DUE_AGENTS, {"now": now}).scalars().all()
+        return worker._claim(session, agent_id, now) if agent_id in due else []
+
+
+def make_due(campaign_id: str) -> None:
+    """Skips the retry backoff of the pending attempts"""
+    with Session(engine) as session:
+        session.execute(
+            text(
+                "UPDATE call_attempts SET next_attempt_at = :past "
+                "WHERE campaign_id = :id AND status = 'pending'"
+            ),
+            {"id": campaign_id, "past": datetime.utcnow() - timedelta(seconds=1)},
+        )
+        session.commit()
+
+
+def check_claims(agent_id: str, campaign_id: str) -> None:
+    print("claims")
+    with Session(engine) as session:
+        imported = asyncio.run(
+            CampaignService(session).import_numbers(
+                campaign_id,
+                [{"phone_number": f"+1555000000{i}", "name": f"n{i}"} for i in range(5)]
+                + [{"phone_number": "+15550000000"}, {"name": "no number"}],
+            )
+        )
+    expect(
+        imported == {"imported": 5, "duplicates": 1, "invalid": 1},
+        f"import skips duplicates and rows without a number: {imported}",
+    )
+
+    # another process holds the agent's row, its claim is skipped, not waited for
+    with Session(engine) as holder:
+        holder.execute(LOCK_AGENT, {"agent_id": agent_id, "default_cap": 5})
+        worker = CampaignWorker(scheduler=None)  # type: ignore
+        with Session(engine) as session:
+            skipped = worker._claim(session, agent_id, datetime.utcnow())
+        holder.rollback()
+    expect(skipped == [], "a locked agent is skipped by the other workers")
+
+    workers = [CampaignWorker(scheduler=None) for _ in range(2)]  # type: ignore
+    workers[1].worker_id += ":2"
+    with ThreadPoolExecutor(2) as pool:
+        claimed = list(pool.map(lambda w: claim(w, agent_id), workers))
+    ids = [a.id for batch in claimed for a in batch]
+    expect(
+        len(ids) == MAX_CONCURRENT_CALLS and len(set(ids)) == len(ids),
+        f"two workers claim {len(ids)} distinct attempts, the agent's cap",
+    )
+    again = claim(workers[0], agent_id)
+    expect(again == [], "nothing more is claimed while the cap is in flight")
+
+    rows = attempts(campaign_id)
+    dialing = [row for row in rows.values() if row.status == "dialing"]
+    expect(
+        all(row.attempts == 1 and row.claimed_at for row in dialing),
+        "claimed attempts are dialing, counted and stamped",
+    )
+    expect(
+        all(row.variables.get("name") for row in dialing),
+        "the imported columns are kept as variables",
+    )
+
+    workers[0]._release([dialing[0].id], datetime.utcnow())
+    released = attempts(campaign_id)[dialing[0].phone_number]
+    expect(
+        released.status == "pending"
+        and released.attempts == 0
+        and released.claimed_by is None,
+        "a released attempt is pending again and not counted",
+    )
+
+
+def check_results(agent_id: str, campaign_id: str) -> None:
+    print("results")
+    rows = attempts(campaign_id)
+    dialing = sorted(
+        (row for row in rows.values() if row.status == "dialing"),
+        key=lambda row: row.phone_number,
+    )
+    answered, busy = dialing[0], dialing[1]
+
+    mark_answered(answered.id, "room-1")
+    finish_attempt(answered.id, "answered")
+    started = datetime.utcnow()
+    finish_attempt(busy.id, "busy", "room-2")
+
+    rows = attempts(campaign_id)
+    expect(
+        rows[answered.phone_number].status == "completed"
+        and rows[answered.phone_number].room == "room-1",
+        "an answered call completes its attempt",
+    )
+    retry = rows[busy.phone_number]
+    backoff = (retry.next_attempt_at.replace(tzinfo=None) - started).total_seconds()
+    expect(
+        retry.status == "pending" and abs(backoff - RETRY_BACKOFF_SECONDS) < 5,
+        f"a busy number is retried after the backoff ({backoff:.0f}s)",
+    )
+
+    # the second dial waits twice as long, the third is the last
+    worker = CampaignWorker(scheduler=None)  # type: ignore
+    for dial, wait in [(2, 2 * RETRY_BACKOFF_SECONDS), (3, None)]:
+        make_due(campaign_id)
+        while attempts(campaign_id)[busy.phone_number].status != "dialing":
+            claimed = claim(worker, agent_id)
+            expect(bool(claimed), "due retries are claimed")
+            for attempt in claimed:
+                if attempt.id != busy.id:
+                    finish_attempt(attempt.id, "answered")
+        started = datetime.utcnow()
+        finish_attempt(busy.id, "no_answer")
+        retry = attempts(campaign_id)[busy.phone_number]
+        if wait is None:
+            expect(
+                retry.status == "failed" and retry.attempts == 3,
+                "a number is given up after the campaign's max attempts",
+            )
+        else:
+            backoff = (retry.next_attempt_at.replace(tzinfo=None) - started).total_seconds()
+            expect(
+                retry.attempts == dial and abs(backoff - wait) < 5,
+                f"dial {dial} is retried after {backoff:.0f}s",
+            )
+
+
+def check_dispatch_failures(agent_id: str, campaign_id: str) -> None:
+    print("dispatch failures")
+    number = "+15550000200"
+    with Session(engine) as session:
+        asyncio.run(
+            CampaignService(session).import_numbers(
+                campaign_id, [{"phone_number": number}]
+            )
+        )
+
+    # the dispatch keeps failing, a bad trunk or agent name
+    worker = CampaignWorker(scheduler=None)  # type: ignore
+    for dial in range(1, 4):
+        make_due(campaign_id)
+        claimed = claim(worker, agent_id)
+        expect([a.phone_number for a in claimed] == [number], f"dial {dial} is claimed")
+        worker._retry_later([a.id for a in claimed], datetime.utcnow())
+        retry = attempts(campaign_id)[number]
+        expect(
+            retry.attempts == dial and retry.last_result == "failed",
+            f"failed dispatch {dial} counts as a dial",
+        )
+    expect(
+        retry.status == "failed",
+        "a number that can't be dispatched fails after max attempts",
+    )
+
+
+def check_restart(agent_id: str, campaign_id: str) -> None:
+    print("restart")
+    with Session(engine) as session:
+        asyncio.run(
+            CampaignService(session).import_numbers(
+                campaign_id, [{"phone_number": f"+1555000010{i}"} for i in range(3)]
+            )
+        )
+    crashed = CampaignWorker(scheduler=None)  # type: ignore
+    crashed.worker_id += ":crashed"
+    claimed = claim(crashed, agent_id)
+    expect(len(claimed) >= 2, f"the crashing worker claimed {len(claimed)} attempts")
+    mark_answered(claimed[0].id, "room-3")
+
+    # the worker died, nothing records the results of its calls
+    live = CampaignWorker(scheduler=None)  # type: ignore
+    live._maintenance()
+    rows = {row.id: row for row in attempts(campaign_id).values()}
+    expect(
+        all(rows[a.id].status == "dialing" for a in claimed),
+        "attempts dialing for less than stale_after are left alone",
+    )
+    expect(claim(live, agent_id) == [], "nothing is left to claim")
+
+    # only the seeded attempts go stale, the other workers' calls are left alone
+    with Session(engine) as session:
+        session.execute(
+            text(
+                "UPDATE call_attempts SET claimed_at = claimed_at - interval '1 hour' "
+                "WHERE campaign_id = :id AND status = 'dialing'"
+            ),
+            {"id": campaign_id},
+        )
+        session.commit()
+    live._maintenance()
+    rows = {row.id: row for row in attempts(campaign_id).values()}
+    expect(
+        rows[claimed[0].id].status == "completed"
+        and rows[claimed[0].id].last_result == "answered",
+        "a stale answered call is completed, never dialed twice",
+    )
+    expect(
+        all(
+            rows[a.id].status == "failed" and rows[a.id].last_result == "lost"
+            for a in claimed[1:]
+        ),
+        "stale unanswered attempts are marked lost",
+    )
+    with Session(engine) as session:
+        campaign = session.get(Campaign, campaign_id)
+        expect(
+            campaign is not None and campaign.status == "completed",
+            "a campaign with nothing pending or dialing is completed",
+        )
+
+
+def check_pacing(trunk_id: str) -> None:
+    print("pacing")
+    # one scheduler per API process, all reserving the same trunk's slots
+    schedulers = [
+        OutboundCallScheduler(max_queue_size=10, calls_per_second=1) for _ in range(3)
+    ]
+    bucket = TokenBucket(rate=4.0, burst=1)
+    with ThreadPoolExecutor(6) as pool:
+        waits = sorted(
+            pool.map(
+                lambda i: schedulers[i % 3]._reserve_slot(trunk_id, bucket), range(6)
+            )
+        )
+    gaps = [b - a for a, b in zip(waits, waits[1:])]
+    expect(
+        waits[0] < 0.1 and all(abs(gap - 0.25) < 0.05 for gap in gaps),
+        f"3 processes dial the trunk at its 4/s: {[round(w, 2) for w in waits]}",
+    )
+    time.sleep(waits[-1] + 0.3)
+    burst = [
+        schedulers[0]._reserve_slot(trunk_id, TokenBucket(rate=4.0, burst=3))
+        for _ in range(4)
+    ]
+    expect(
+        burst[:3] == [0.0, 0.0, 0.0] and burst[3] > 0.2,
+        f"a burst of 3 goes at once, the 4th waits: {[round(w, 2) for w in burst]}",
+    )
+    missing = schedulers[0]._reserve_slot("unknown trunk", bucket)
+    expect(missing is None, "a trunk that isn't in the db is paced in process")
+
+
+if __name__ == "__main__":
+    if engine.dialect.name != "postgresql":
+        sys.exit(f"needs a postgres DATABASE_URL, not {engine.url}")
+
+    prefix = make_cuid("check_")
+    agent_id, campaign_id, trunk_id = seed(prefix)
+    try:
+        check_claims(agent_id, campaign_id)
+        check_results(agent_id, campaign_id)
+        check_dispatch_failures(agent_id, campaign_id)
+        check_restart(agent_id, campaign_id)
+        check_pacing(trunk_id)
+    except CheckFailed as e:
+        print(f"  FAILED  {e}")
+        sys.exit(1)
+    finally:
+        cleanup(prefix)
+    print("\nall campaign checks passed")
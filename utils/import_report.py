@@ -0,0 +1,81 @@
+"""
+Reports the import-time cost of a module using `python -X importtime`.
+
+Usage:
+    python -m utils.import_report app.agent.runner main --top 25
+"""
+
+import argparse
+import subprocess
+import sys
+from dataclasses import dataclass
+
+
+@dataclass
+class ImportTiming:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def measure_imports(module: str) -> list[ImportTiming]:
+    """Imports `module` in a fresh interpreter and parses the importtime output"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"failed to import {module}:\n{proc.stderr[-2000:]}")
+
+    timings: list[ImportTiming] = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        timings.append(
+            ImportTiming(
+                module=name.strip(),
+                self_us=int(self_us),
+                cumulative_us=int(cumulative_us),
+                depth=depth,
+            )
+        )
+    return timings
+
+
+def package_totals(timings: list[ImportTiming]) -> dict[str, int]:
+    """Self time summed per top level package, eg `livekit.plugins.google` -> `livekit.plugins.google`"""
+    totals: dict[str, int] = {}
+    for timing in timings:
+        parts = timing.module.split(".")
+        package = ".".join(parts[:3] if parts[:2] == ["livekit", "plugins"] else parts[:1])
+        totals[package] = totals.get(package, 0) + timing.self_us
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def print_report(module: str, top: int = 20) -> None:
+    timings = measure_imports(module)
+    total_us = sum(timing.self_us for timing in timings)
+
+    print(f"\n{'--' * 20}\n import {module}: {total_us / 1000:.1f}ms total\n{'--' * 20}")
+
+    print("\n by package (self time):")
+    for package, self_us in list(package_totals(timings).items())[:top]:
+        print(f"  {self_us / 1000:9.1f}ms  {package}")
+
+    print("\n by module (cumulative):")
+    for timing in sorted(timings, key=lambda t: t.cumulative_us, reverse=True)[:top]:
+        print(f"  {timing.cumulative_us / 1000:9.1f}ms  {timing.module}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("modules", nargs="*", default=["main"])
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        print_report(module, top=args.top)
@@ -0,0 +1,248 @@
+"""
+Checks that the account scoped queries of the services use an index.
+
+Seeds a few thousand accounts inside a transaction, runs the service code against
+them and captures every SELECT it sends, then runs `EXPLAIN` on each with sequential
+scans disabled. A plan that still scans a table sequentially has no usable index
+and fails the check. The transaction is rolled back, nothing is left behind.
+
+Usage:
+    DATABASE_URL=postgresql://... python -m utils.query_plans --accounts 2000
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import event, insert, text
+from sqlalchemy.engine import Connection
+from sqlmodel import Session
+
+from app.agent.models import AgentModel
+from app.agent.schema import AgentSettings, MakeOutboundCallInputs
+from app.agent.service import AssistantService
+from app.core.database import engine
+from app.knowledgebase.models import Knowledgebase
+from app.knowledgebase.routes import get_knowledgebase
+from app.lk_connector.models import InboundTrunk, OutboundTrunk, PhoneNumber
+from app.lk_connector.reconciler import SIPReconciler
+from lk_twilio_connector import (
+    TwilioAccountParams,
+    add_phones_to_twilio_trunk,
+    find_cached_trunk,
+)
+
+NUMBERS_PER_ACCOUNT = 3
+
+
+@dataclass
+class QueryPlan:
+    scenario: str
+    statement: str
+    seq_scans: list[str] = field(default_factory=list)
+
+
+def seed(connection: Connection, accounts: int) -> None:
+    now = datetime.utcnow()
+    stamps = {"created_at": now, "updated_at": now}
+    for table, rows in [
+        (
+            InboundTrunk,
+            [
+                {
+                    "trunk_id": f"TK{i}",
+                    "account_id": f"account-{i}",
+                    "livekit_sip_trunk_id": f"ST_in{i}",
+                    "twilio_sid": f"AC{i}",
+                    "twilio_domain_name": f"trunk-{i}.pstn.twilio.com",
+                    **stamps,
+                }
+                for i in range(accounts)
+            ],
+        ),
+        (
+            OutboundTrunk,
+            [
+                {
+                    "inbound_trunk_id": f"TK{i}",
+                    "account_id": f"account-{i}",
+                    "livekit_sip_trunk_id": f"ST_out{i}",
+                    **stamps,
+                }
+                for i in range(accounts)
+            ],
+        ),
+        (
+            PhoneNumber,
+            [
+                {
+                    "phone_number": f"+1555{i:06d}{n}",
+                    "trunk_id": f"TK{i}",
+                    "twilio_sid": f"PN{i}{n}",
+                    **stamps,
+                }
+                for i in range(accounts)
+                for n in range(NUMBERS_PER_ACCOUNT)
+            ],
+        ),
+        (
+            Knowledgebase,
+            [
+                {
+                    "id": f"kb_{i}",
+                    "openai_file_id": f"file-{i}",
+                    "openai_vector_store_id": f"vs_{i}",
+                    "filename": "faq.pdf",
+                    "filesize": 1024,
+                    "account_id": f"account-{i}",
+                    **stamps,
+                }
+                for i in range(accounts)
+            ],
+        ),
+        (
+            AgentModel,
+            [
+                {
+                    "id": f"agent_{i}",
+                    "is_active": True,
+                    "config": {
+                        "agent_name": f"Agent {i}",
+                        "account_id": f"account-{i}",
+                        "agent_phone": f"+1555{i:06d}0",
+                    },
+                    **stamps,
+                }
+                for i in range(accounts)
+            ],
+        ),
+    ]:
+        connection.execute(insert(table), rows)
+        connection.execute(text(f"ANALYZE {table.__tablename__}"))
+
+
+def scenarios(
+    session: Session, account: int
+) -> dict[str, Callable[[], Awaitable[Any]]]:
+    """The hot paths of the services, for an account of the seeded data"""
+    account_id = f"account-{account}"
+    agent_service = AssistantService(session, client=object())  # type: ignore
+    twilio_account = TwilioAccountParams(
+        twilio_auth_token="token",
+        twilio_account_sid=f"AC{account}",
+        account_id=account_id,
+    )
+
+    async def create_agent():
+        await agent_service.create_agent(
+            AgentSettings(
+                greeting_message="Hello",
+                system_prompt="You are a test agent",
+                account_id=account_id,
+                agent_phone=f"+1555{account:06d}0",
+                agent_id=f"agent_{account}",
+            )
+        )
+
+    async def find_cached_twilio_trunk():
+        db_trunk = find_cached_trunk(session, twilio_account)
+        assert db_trunk is not None
+        # every number is known, so no twilio call is made
+        await add_phones_to_twilio_trunk(
+            session, None, [f"+1555{account:06d}1"], db_trunk  # type: ignore
+        )
+
+    async def reconcile_desired_state():
+        SIPReconciler(None, session).desired_state([account_id])  # type: ignore
+
+    async def knowledgebase():
+        await get_knowledgebase(session, account_id)
+
+    return {
+        "create_agent": create_agent,
+        "make_outbound_call": lambda: agent_service.outbound_call_payload(
+            f"agent_{account}", MakeOutboundCallInputs(to_number="+15550000000")
+        ),
+        "get_knowledgebase": knowledgebase,
+        "connect_cached_trunk": find_cached_twilio_trunk,
+        "reconcile_desired_state": reconcile_desired_state,
+    }
+
+
+def seq_scans(plan: dict) -> list[str]:
+    found = []
+    if plan["Node Type"] == "Seq Scan":
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def check(accounts: int) -> list[QueryPlan]:
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError(f"needs a postgres DATABASE_URL, not {engine.url}")
+
+    captured: list[tuple[str, Any]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    plans: list[QueryPlan] = []
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            seed(connection, accounts)
+            # with sequential scans priced out, only a missing index leaves one
+            connection.execute(text("SET LOCAL enable_seqscan = off"))
+
+            # the services commit, the commits only release savepoints
+            session = Session(bind=connection, join_transaction_mode="create_savepoint")
+            for name, scenario in scenarios(session, accounts // 2).items():
+                captured.clear()
+                event.listen(connection, "before_cursor_execute", capture)
+                try:
+                    asyncio.run(scenario())
+                finally:
+                    event.remove(connection, "before_cursor_execute", capture)
+
+                for statement, parameters in list(captured):
+                    result = connection.exec_driver_sql(
+                        f"EXPLAIN (FORMAT JSON) {statement}", parameters
+                    ).scalar()
+                    plan = result if isinstance(result, list) else json.loads(result)
+                    plans.append(
+                        QueryPlan(
+                            scenario=name,
+                            statement=" ".join(statement.split()),
+                            seq_scans=seq_scans(plan[0]["Plan"]),
+                        )
+                    )
+            session.close()
+        finally:
+            transaction.rollback()
+    return plans
+
+
+def print_report(plans: list[QueryPlan]) -> None:
+    for plan in plans:
+        status = "SEQ SCAN " + ", ".join(plan.seq_scans) if plan.seq_scans else "ok"
+        print(f"  {plan.scenario:<26} {status}")
+        if plan.seq_scans:
+            print(f"    {plan.statement[:300]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--accounts", type=int, default=2000)
+    args = parser.parse_args()
+
+    plans = check(args.accounts)
+    print_report(plans)
+    failed = [plan for plan in plans if plan.seq_scans]
+    print(f"\n{len(plans)} queries, {len(failed)} with sequential scans")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,261 @@
+"""
+Measures the time to first audio byte of the streaming TTS providers.
+
+By default the providers talk to a local stub server that speaks the Cartesia and
+ElevenLabs websocket protocols and answers after `--stub-latency-ms`, so the numbers
+only reflect our side: connection setup and reuse, and the plugin's streaming path.
+Pass `--live` to measure the real APIs, with the api keys from the environment.
+
+Usage:
+    python -m utils.tts_benchmark cartesia elevenlabs --runs 10
+    python -m utils.tts_benchmark cartesia --live --voice <voice id>
+"""
+
+import argparse
+import asyncio
+import base64
+import functools
+import io
+import json
+import os
+import statistics
+import time
+from dataclasses import dataclass
+
+import aiohttp
+import av
+from aiohttp import web
+from livekit.agents import tokenize, tts
+from livekit.agents.utils import http_context
+
+import app.agent.providers as providers
+from app.agent.schema import AgentSettings, AgentVoice
+
+STUB_PROVIDERS = ["cartesia", "elevenlabs"]
+
+DEFAULT_VOICES = {
+    "cartesia": "794f9389-aac1-45b6-b726-9d9369183238",
+    "elevenlabs": "EXAVITQu4vr4xnSDxMaL",
+    "openai": "alloy",
+    "google": "en-US-Standard-C",
+}
+
+TEXT = "Hi, thanks for calling. How can I help you today?"
+
+
+# ╔═╗┌┬┐┬ ┬┌┐   ┌─┐┌─┐┬─┐┬  ┬┌─┐┬─┐┬
+# ╚═╗ │ │ │├┴┐  └─┐├┤ ├┬┘└┐┌┘├┤ ├┬┘│
+# ╚═╝ ┴ └─┘└─┘  └─┘└─┘┴└─ └┘ └─┘┴└─o
+
+
+def _silence(sample_rate: int, ms: int = 100) -> str:
+    return base64.b64encode(b"\x00\x00" * (sample_rate * ms // 1000)).decode()
+
+
+@functools.cache
+def _mp3_silence(sample_rate: int, ms: int = 100) -> str:
+    """Bare mp3 frames without a tag, so the chunks of a stream concatenate"""
+    samples = sample_rate * ms // 1000
+    frame = av.AudioFrame(format="s16", layout="mono", samples=samples)
+    frame.planes[0].update(bytes(samples * 2))
+    frame.sample_rate = sample_rate
+
+    buffer = io.BytesIO()
+    options = {"id3v2_version": "0", "write_xing": "0"}
+    with av.open(buffer, "w", format="mp3", options=options) as container:
+        stream = container.add_stream("libmp3lame", rate=sample_rate)
+        stream.layout = "mono"  # type: ignore
+        for packet in [*stream.encode(frame), *stream.encode(None)]:  # type: ignore
+            container.mux(packet)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+class StubTTSServer:
+    """Answers every chunk of text with 100ms of silence after a fixed latency"""
+
+    def __init__(self, latency: float) -> None:
+        self._latency = latency
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/tts/websocket", self._cartesia)
+        app.router.add_get(
+            "/v1/text-to-speech/{voice_id}/stream-input", self._elevenlabs
+        )
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # type: ignore
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _cartesia(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        started: set[str] = set()
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            data = json.loads(msg.data)
+            context_id = data["context_id"]
+            if context_id not in started:
+                started.add(context_id)
+                await asyncio.sleep(self._latency)
+            if data["transcript"].strip():
+                sample_rate = data["output_format"]["sample_rate"]
+                await ws.send_json(
+                    {"context_id": context_id, "data": _silence(sample_rate)}
+                )
+            if not data["continue"]:
+                await ws.send_json({"context_id": context_id, "done": True})
+        return ws
+
+    async def _elevenlabs(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        sample_rate = int(request.query["output_format"].split("_")[1])
+        first = True
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            data = json.loads(msg.data)
+            text = data.get("text", "")
+            if data.get("flush") or text == "":  # end of the input
+                await ws.send_json({"isFinal": True})
+                continue
+            if not text.strip():
+                continue  # init message
+            if first:
+                first = False
+                await asyncio.sleep(self._latency)
+            await ws.send_json({"audio": _mp3_silence(sample_rate)})
+        return ws
+
+
+# ╔╗ ┌─┐┌┐┌┌─┐┬ ┬┌┬┐┌─┐┬─┐┬┌─┬
+# ╠╩╗├┤ ││││  ├─┤│││├─┤├┬┘├┴┐│
+# ╚═╝└─┘┘└┘└─┘┴ ┴┴ ┴┴ ┴┴└─┴ ┴o
+
+
+@dataclass
+class BenchmarkResult:
+    provider: str
+    ttfb: list[float]
+
+    @property
+    def cold(self) -> float:
+        return self.ttfb[0]
+
+    def warm(self, quantile: int) -> float:
+        warm = self.ttfb[1:] or self.ttfb
+        if len(warm) < 2:
+            return warm[0]
+        return statistics.quantiles(warm, n=100)[quantile - 1]
+
+
+def agent_settings_for(provider: str, voice: str | None) -> AgentSettings:
+    return AgentSettings(
+        greeting_message="",
+        system_prompt="",
+        synth_provider=provider,  # type: ignore
+        voice=AgentVoice(
+            voice_name=voice or DEFAULT_VOICES[provider], language_code="en"
+        ),
+    )
+
+
+async def measure_ttfb(client: tts.TTS, runs: int) -> list[float]:
+    """Pushes the text word by word, the way LLM tokens arrive, and times the first audio"""
+    if not client.capabilities.streaming:
+        client = tts.StreamAdapter(
+            tts=client, sentence_tokenizer=tokenize.basic.SentenceTokenizer()
+        )
+
+    ttfb: list[float] = []
+    for _ in range(runs):
+        stream = client.stream()
+        started_at = time.perf_counter()
+        for word in TEXT.split():
+            stream.push_text(word + " ")
+        stream.end_input()
+        async for _ in stream:
+            ttfb.append(time.perf_counter() - started_at)
+            break
+        await stream.aclose()
+    return ttfb
+
+
+async def run_benchmark(
+    names: list[str],
+    *,
+    runs: int,
+    live: bool,
+    stub_latency: float,
+    voice: str | None,
+) -> list[BenchmarkResult]:
+    stub = None
+    if not live:
+        unsupported = set(names) - set(STUB_PROVIDERS)
+        if unsupported:
+            raise ValueError(
+                f"No stub for {', '.join(unsupported)}, use --live to measure them"
+            )
+        stub = StubTTSServer(latency=stub_latency)
+        await stub.start()
+        os.environ["CARTESIA_BASE_URL"] = stub.url
+        os.environ["ELEVENLABS_BASE_URL"] = f"{stub.url}/v1"
+        os.environ.setdefault("CARTESIA_API_KEY", "stub")
+        os.environ.setdefault("ELEVEN_API_KEY", "stub")
+
+    # the plugins pick their http session from the job context
+    http_context._new_session_ctx()
+    results = []
+    try:
+        for name in names:
+            client = providers.create_tts(agent_settings_for(name, voice))
+            results.append(BenchmarkResult(name, await measure_ttfb(client, runs)))
+            await client.aclose()
+    finally:
+        await http_context._close_http_ctx()
+        if stub is not None:
+            await stub.stop()
+    return results
+
+
+def print_report(results: list[BenchmarkResult], live: bool) -> None:
+    target = "live api" if live else "local stub"
+    print(f"\n{'--' * 20}\n time to first audio byte ({target})\n{'--' * 20}")
+    print(f"  {'provider':<12} {'cold':>9} {'warm p50':>9} {'warm p90':>9}")
+    for result in results:
+        print(
+            f"  {result.provider:<12} {result.cold * 1000:7.1f}ms "
+            f"{result.warm(50) * 1000:7.1f}ms {result.warm(90) * 1000:7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("providers", nargs="*", default=STUB_PROVIDERS)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--live", action="store_true")
+    parser.add_argument("--stub-latency-ms", type=float, default=50)
+    parser.add_argument("--voice", default=None)
+    args = parser.parse_args()
+
+    providers.preload_plugins(args.providers)
+    results = asyncio.run(
+        run_benchmark(
+            args.providers,
+            runs=args.runs,
+            live=args.live,
+            stub_latency=args.stub_latency_ms / 1000,
+            voice=args.voice,
+        )
+    )
+    print_report(results, live=args.live)